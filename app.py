@@ -1,21 +1,45 @@
+import hashlib
+import mimetypes
 import os
 import secrets
+import time
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, g, request, jsonify, send_file
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity, current_user
 from flask_cors import CORS
+from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import random
 import string
 from dotenv import load_dotenv
+from utils.admin import admin_required, parse_admin_ids
+from utils.backplane import create_backplane
+from utils.fastjson import FastJSONProvider
+from utils.handoff import HandoffCache
+from utils.health import ReadinessProber
+from utils.pagination import decode_cursor, encode_cursor, page_limit
+from utils.previews import tiny_preview
+from utils.profiling import MemoryTracer, SamplingProfiler
+from utils.ratelimit import RateLimiter
+from utils.refresh_tokens import RefreshTokens
+from utils.singleflight import SingleFlight
+from utils.sql import execute_autocommit, lock_rows, utcnow
+from utils.storage import StorageAccountant
+from utils.tasks import TaskQueue
+from utils.replicas import (REPLICA_BIND, RecentWrites, RoutingSession,
+                            mark_written, read_only, recent_writes,
+                            use_primary)
+from utils.token_versions import TokenVersionCache
 
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 # Configuration class
 
@@ -32,25 +56,149 @@ class Config:
     else:
         SQLALCHEMY_DATABASE_URI = 'sqlite:///flashpair.db'
 
+    # Optional read replica used by read-only routes. Users who wrote within
+    # REPLICA_STALENESS_SECONDS keep reading from the primary. Other workers
+    # learn of those writes over BACKPLANE_URL; with the default memory://
+    # they stay per process, so run a replica with a shared backplane.
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    if DATABASE_REPLICA_URL:
+        if DATABASE_REPLICA_URL.startswith('postgres://'):
+            DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace(
+                'postgres://', 'postgresql://', 1)
+        SQLALCHEMY_BINDS = {'replica': DATABASE_REPLICA_URL}
+    REPLICA_STALENESS_SECONDS = float(
+        os.environ.get('REPLICA_STALENESS_SECONDS', 5))
+
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
     # Security
     SECRET_KEY = os.environ.get('SECRET_KEY') or secrets.token_urlsafe(32)
     JWT_SECRET_KEY = os.environ.get(
         'JWT_SECRET_KEY') or secrets.token_urlsafe(32)
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=1)
+    # Short-lived access tokens, renewed through /auth/refresh with a
+    # rotating refresh token instead of a password login
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(
+        minutes=int(os.environ.get('JWT_ACCESS_TOKEN_MINUTES', 15)))
+    REFRESH_TOKEN_DAYS = int(os.environ.get('REFRESH_TOKEN_DAYS', 30))
+
+    # Embed pair context in access tokens so protected routes can skip the
+    # per-request user load. Another worker notices a token version bump
+    # within TOKEN_VERSION_CACHE_SECONDS.
+    JWT_STATELESS_PAIR_CLAIMS = os.environ.get(
+        'JWT_STATELESS_PAIR_CLAIMS', 'false').lower() == 'true'
+    TOKEN_VERSION_CACHE_SECONDS = int(
+        os.environ.get('TOKEN_VERSION_CACHE_SECONDS', 5))
+
+    # Pair affinity: authenticated responses carry PAIR_AFFINITY_HEADER (and
+    # tokens an "aff" claim), equal for both partners. Clients send it back
+    # so the load balancer can hash on it, e.g. HAProxy
+    # `balance hdr(X-Pair-Affinity)`. A recipient seen by this process in the
+    # last HANDOFF_LOCAL_SECONDS gets fresh uploads handed over in memory.
+    PAIR_AFFINITY_HEADER = os.environ.get(
+        'PAIR_AFFINITY_HEADER', 'X-Pair-Affinity')
+    HANDOFF_CACHE_MB = int(os.environ.get('HANDOFF_CACHE_MB', 64))
+    HANDOFF_LOCAL_SECONDS = int(os.environ.get('HANDOFF_LOCAL_SECONDS', 60))
+
+    # Pair/inbox event fan-out between workers: memory:// (single process),
+    # postgresql://... (LISTEN/NOTIFY) or redis://host:port
+    BACKPLANE_URL = os.environ.get('BACKPLANE_URL') or 'memory://'
 
     # Upload configuration
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    # Live, unviewed images a recipient may have queued at once
+    IMAGE_QUEUE_DEPTH = int(os.environ.get('IMAGE_QUEUE_DEPTH', 10))
+    # Upload responses are replayed to retries with the same
+    # Idempotency-Key for this long
+    IDEMPOTENCY_KEY_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_HOURS', 24))
+    # Members a group room may have, its creator included
+    ROOM_MAX_MEMBERS = int(os.environ.get('ROOM_MAX_MEMBERS', 16))
+    # Resumable uploads: idle sessions and their partial files expire
+    UPLOAD_SESSION_TTL_MINUTES = int(
+        os.environ.get('UPLOAD_SESSION_TTL_MINUTES', 60))
+    # Edge in pixels of the inline placeholder sent with /image/check and
+    # /sync (needs Pillow; 0 disables)
+    IMAGE_PREVIEW_SIZE = int(os.environ.get('IMAGE_PREVIEW_SIZE', 16))
+
+    # Durable background tasks (file deletion, expiry, orphan scans) run on
+    # TASK_WORKERS threads per process; 0 leaves them to another process
+    TASK_WORKERS = int(os.environ.get('TASK_WORKERS', 1))
+    TASK_POLL_INTERVAL = float(os.environ.get('TASK_POLL_INTERVAL', 1))
+    EXPIRY_SWEEP_INTERVAL = int(os.environ.get('EXPIRY_SWEEP_INTERVAL', 10))
+    ORPHAN_SCAN_INTERVAL = int(os.environ.get('ORPHAN_SCAN_INTERVAL', 600))
+    # Files younger than this are never treated as orphans (uploads in flight)
+    ORPHAN_GRACE_SECONDS = int(os.environ.get('ORPHAN_GRACE_SECONDS', 600))
+    # Tasks that exhausted their retries are kept this long for inspection
+    TASK_FAILED_RETENTION_DAYS = int(
+        os.environ.get('TASK_FAILED_RETENTION_DAYS', 7))
+
+    # Upload storage accounting: STORAGE_QUOTA_MB caps stored uploads (0 =
+    # bounded by free disk only), USER_STORAGE_QUOTA_MB caps each sender's
+    # queued bytes. Above STORAGE_HIGH_WATERMARK of capacity, uploads are
+    # increasingly refused and viewed images are evicted early.
+    STORAGE_QUOTA_MB = int(os.environ.get('STORAGE_QUOTA_MB', 0))
+    USER_STORAGE_QUOTA_MB = int(os.environ.get('USER_STORAGE_QUOTA_MB', 64))
+    STORAGE_HIGH_WATERMARK = float(
+        os.environ.get('STORAGE_HIGH_WATERMARK', 0.85))
+    STORAGE_REFRESH_INTERVAL = float(
+        os.environ.get('STORAGE_REFRESH_INTERVAL', 5))
+
+    # Readiness prober: checks DB, upload storage and free space in the
+    # background so /readyz never does I/O itself
+    HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', 10))
+    HEALTH_MIN_FREE_MB = int(os.environ.get('HEALTH_MIN_FREE_MB', 100))
+
+    # Load shedding: token-bucket budgets per endpoint as (requests per
+    # second, burst) per user; the per-IP bucket is RATE_LIMIT_IP_FACTOR
+    # times larger. RATE_LIMIT_BACKEND=redis://... shares buckets.
+    RATE_LIMITS = {
+        'check_new_image': (2, 10),
+        'get_image_info': (2, 10),
+        'get_pair_status': (2, 10),
+        'sync': (2, 10),
+        'view_image': (1, 5),
+        'upload_image': (1, 10),
+        'upload_images': (0.2, 5),
+        'upload_room_image': (0.5, 5),
+        'create_room': (0.1, 5),
+        'join_room': (0.2, 5),
+        'create_upload_session': (1, 10),
+        'generate_pair_code': (0.2, 5),
+        'connect_with_code': (0.2, 5),
+        'login': (0.5, 10),
+        'register': (0.1, 5),
+        'refresh_access_token': (0.1, 5)
+    }
+    RATE_LIMIT_IP_FACTOR = int(os.environ.get('RATE_LIMIT_IP_FACTOR', 5))
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND')
+    MAX_CONCURRENT_REQUESTS = int(
+        os.environ.get('MAX_CONCURRENT_REQUESTS', 64))
+    # Identical concurrent polls by one user (check, pair status, image
+    # info) share one computation and its result for this many seconds
+    SINGLE_FLIGHT_TTL = float(os.environ.get('SINGLE_FLIGHT_TTL', 0.25))
+    # Seconds a poll waits for that computation before running its own
+    SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 5))
+
+    # Number of reverse proxies in front of the app (Railway adds one), so
+    # per-IP limits see the client address
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+    # Users allowed on /admin/* routes (comma separated ids)
+    ADMIN_USER_IDS = parse_admin_ids(os.environ.get('ADMIN_USER_IDS'))
+    # Stack sampling period of the on-demand profiler
+    PROFILE_SAMPLE_INTERVAL_MS = float(
+        os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
 
 
 app.config.from_object(Config)
 
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
 # Initialize extensions
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 jwt = JWTManager(app)
-CORS(app, origins=["*"])
+CORS(app, origins=["*"], expose_headers=[app.config['PAIR_AFFINITY_HEADER']])
 
 # JWT Identity handlers - FIXED
 
@@ -65,13 +213,134 @@ def user_identity_lookup(user_id):
 def user_lookup_callback(_jwt_header, jwt_data):
     """Load user from JWT data"""
     identity = jwt_data["sub"]
-    return User.query.filter_by(id=int(identity)).one_or_none()
+
+    # Trust embedded pair claims while the token version is current
+    if 'tv' in jwt_data and token_versions.get(int(identity)) == jwt_data['tv']:
+        return TokenUser(int(identity), jwt_data.get('pair_id'),
+                         jwt_data.get('pair_name'))
+
+    return fetch_user_record(int(identity))
+
+
+class TokenUser:
+    """Identity rebuilt from verified token claims, without a DB load"""
+    __slots__ = ('id', 'current_pair_id', 'paired_username')
+
+    def __init__(self, id, current_pair_id, paired_username):
+        self.id = id
+        self.current_pair_id = current_pair_id
+        self.paired_username = paired_username
+
+
+token_versions = TokenVersionCache(
+    lambda user_id: fetch_token_version(user_id),
+    ttl=app.config['TOKEN_VERSION_CACHE_SECONDS'])
+
+
+def pair_affinity_key(user_id, partner_id=None):
+    """Stable routing key, the same for both partners of a pair"""
+    if partner_id is None:
+        source = f"user:{user_id}"
+    else:
+        source = "pair:{}:{}".format(*sorted((int(user_id), int(partner_id))))
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def issue_access_token(user, paired_username=None):
+    """Create an access token, embedding pair context when enabled"""
+    claims = {'aff': pair_affinity_key(user.id, user.current_pair_id)}
+    if app.config['JWT_STATELESS_PAIR_CLAIMS']:
+        if paired_username is None and user.current_pair_id:
+            paired_user = User.query.get(user.current_pair_id)
+            paired_username = paired_user.username if paired_user else None
+        claims.update({
+            'tv': user.token_version or 0,
+            'pair_id': user.current_pair_id,
+            'pair_name': paired_username
+        })
+    return create_access_token(identity=str(user.id), additional_claims=claims)
+
+
+def bump_token_versions(*users):
+    """Invalidate pair claims of already issued tokens (commit afterwards)"""
+    for user in users:
+        user.token_version = (user.token_version or 0) + 1
+
+
+def with_fresh_token(payload, user, paired_username=None):
+    """Attach a re-issued access token after the caller's pair changed"""
+    token_versions.invalidate(user.id)
+    if app.config['JWT_STATELESS_PAIR_CLAIMS']:
+        payload['access_token'] = issue_access_token(user, paired_username)
+    return payload
+
+
+def on_backplane_event(event):
+    """Apply pair and inbox events published by any worker"""
+    user_ids = [int(u) for u in event.get('users', [])]
+    if event['type'].startswith('pair.'):
+        token_versions.invalidate(*user_ids)
+    recent_writes.mark(user_ids, app.config['REPLICA_STALENESS_SECONDS'])
+
+
+backplane = create_backplane(app.config['BACKPLANE_URL'])
+backplane.subscribe(on_backplane_event)
+# Every worker pins writers to the primary, not just the one that served them
+recent_writes.publish = lambda user_ids: backplane.publish('writes', user_ids)
 
 
 # Create upload directory
 UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+prober = ReadinessProber(
+    app, db, UPLOAD_FOLDER,
+    interval=app.config['HEALTH_PROBE_INTERVAL'],
+    min_free_bytes=app.config['HEALTH_MIN_FREE_MB'] * 1024 * 1024)
+
+
+# On-demand profiling, switched on through /admin/profile and /admin/memory
+profiler = SamplingProfiler(
+    app, interval=app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000)
+memory_tracer = MemoryTracer()
+
+
+# Users this process served recently, and uploads waiting for them
+local_users = RecentWrites()
+handoff = HandoffCache(app.config['HANDOFF_CACHE_MB'] * 1024 * 1024)
+
+
+@app.after_request
+def add_pair_affinity(response):
+    """Routing key of the caller's pair, for the load balancer"""
+    pair = g.get('pair_affinity')
+    if pair is None:
+        try:
+            user = current_user._get_current_object()
+        except RuntimeError:
+            return response  # no verified token on this request
+        if user is None:
+            return response
+        pair = (user.id, user.current_pair_id)
+
+    local_users.mark([pair[0]], app.config['HANDOFF_LOCAL_SECONDS'])
+    response.headers[app.config['PAIR_AFFINITY_HEADER']] = (
+        pair_affinity_key(*pair))
+    return response
+
+
+@app.before_request
+def start_background_threads():
+    backplane.start()
+    prober.start()
+    tasks.start()
+    storage.start()
+
+
+rate_limiter = RateLimiter(app)
+flights = SingleFlight(ttl=app.config['SINGLE_FLIGHT_TTL'],
+                       timeout=app.config['SINGLE_FLIGHT_TIMEOUT'])
+
 # Models
 
 
@@ -85,6 +354,8 @@ class User(db.Model):
     current_pair_code = db.Column(db.String(6), index=True)
     current_pair_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    token_version = db.Column(db.Integer, nullable=False,
+                              default=0, server_default='0')
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -103,61 +374,798 @@ class Image(db.Model):
     recipient_id = db.Column(db.Integer, db.ForeignKey(
         'users.id'), nullable=False, index=True)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    viewed_at = db.Column(db.DateTime)
+    # End of the 30 second viewing window. A queued image's window starts
+    # when the one ahead of it ends (see queue_deadlines)
+    expires_at = db.Column(db.DateTime, index=True)
+    # Stored bytes live in a shared Blob; NULL for images stored before
+    # deduplication, whose file belongs to this row alone
+    content_hash = db.Column(db.String(64), index=True)
+    # Tiny data: URI thumbnail, copied from the blob
+    preview = db.Column(db.Text)
+    # Set on the per-member copies of an image sent to a group room
+    room_id = db.Column(db.Integer, db.ForeignKey(
+        'rooms.id', ondelete='SET NULL'))
 
     sender = db.relationship('User', foreign_keys=[sender_id])
     recipient = db.relationship('User', foreign_keys=[recipient_id])
 
+    __table_args__ = (
+        # Pending-image check and inbox: a recipient's live images in order
+        db.Index('ix_images_recipient_sent', 'recipient_id', 'sent_at', 'id'),
+    )
+
+
+class Blob(db.Model):
+    """Content-addressed image file shared by every Image row with its hash"""
+    __tablename__ = 'blobs'
+
+    content_hash = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    preview = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Room(db.Model):
+    """Group of users who all receive each image sent to it"""
+    __tablename__ = 'rooms'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    code = db.Column(db.String(8), unique=True, nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class RoomMember(db.Model):
+    __tablename__ = 'room_members'
+
+    room_id = db.Column(db.Integer, db.ForeignKey(
+        'rooms.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'users.id'), primary_key=True, index=True)
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'users.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+    received = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class IdempotencyKey(db.Model):
+    """Response to an upload, replayed to retries with the same key"""
+    __tablename__ = 'idempotency_keys'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                        primary_key=True)
+    key = db.Column(db.String(80), primary_key=True)
+    # What the key was first used for; other uses of it are refused
+    operation = db.Column(db.String(80), nullable=False)
+    response = db.Column(db.JSON, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class RefreshToken(db.Model):
+    """Refresh token digest, see utils/refresh_tokens.py"""
+    __tablename__ = 'refresh_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'users.id'), nullable=False, index=True)
+    # Every token descends from one login; reuse revokes the whole family
+    family_id = db.Column(db.String(32), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    used_at = db.Column(db.DateTime)
+
+
+class Task(db.Model):
+    """Queued background work, see utils/tasks.py"""
+    __tablename__ = 'tasks'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    # Set for periodic tasks so that only one of each is ever queued
+    dedupe_key = db.Column(db.String(128), unique=True)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_tasks_status_run_at', 'status', 'run_at'),
+    )
+
+
+tasks = TaskQueue(
+    app, db, Task,
+    workers=app.config['TASK_WORKERS'],
+    poll_interval=app.config['TASK_POLL_INTERVAL'])
+
+refresh_tokens = RefreshTokens(
+    db, RefreshToken, app.config['JWT_SECRET_KEY'],
+    ttl=timedelta(days=app.config['REFRESH_TOKEN_DAYS']))
+
+# Core read paths for the hottest lookups: cached lambda statements over
+# plain table columns return named rows, with no identity map, attribute
+# instrumentation or autoflush involved
+
+
+users_table = User.__table__
+images_table = Image.__table__
+
+
+def read(statement):
+    """Execute a Core statement on the session's (replica-aware) connection"""
+    return db.session.connection().execute(statement)
+
+
+def fetch_user_record(user_id):
+    """The user's id, username, pair state and token version, or None"""
+    return read(db.lambda_stmt(lambda: db.select(
+        users_table.c.id,
+        users_table.c.username,
+        users_table.c.current_pair_id,
+        users_table.c.current_pair_code,
+        users_table.c.token_version
+    ).where(users_table.c.id == user_id))).first()
+
+
+def fetch_token_version(user_id):
+    """Current token version of a user, or None if the user is gone"""
+    return read(db.lambda_stmt(lambda: db.select(
+        users_table.c.token_version
+    ).where(users_table.c.id == user_id))).scalar()
+
+
+def fetch_username(user_id):
+    return read(db.lambda_stmt(lambda: db.select(
+        users_table.c.username
+    ).where(users_table.c.id == user_id))).scalar()
+
+
+def fetch_pending_image(recipient_id):
+    """Oldest live, unviewed image for a recipient (see pending_images)"""
+    now = datetime.utcnow()
+    return read(db.lambda_stmt(lambda: db.select(
+        images_table.c.id,
+        images_table.c.sender_id,
+        images_table.c.sent_at,
+        images_table.c.expires_at,
+        images_table.c.filename,
+        images_table.c.content_hash,
+        images_table.c.preview,
+        images_table.c.room_id
+    ).where(
+        images_table.c.recipient_id == recipient_id,
+        images_table.c.viewed_at.is_(None),
+        images_table.c.expires_at >= now
+    ).order_by(images_table.c.sent_at, images_table.c.id).limit(1))).first()
+
+
+def fetch_received_image(image_id, recipient_id):
+    return read(db.lambda_stmt(lambda: db.select(
+        images_table.c.id,
+        images_table.c.sent_at,
+        images_table.c.expires_at,
+        images_table.c.filename,
+        images_table.c.content_hash
+    ).where(
+        images_table.c.id == image_id,
+        images_table.c.recipient_id == recipient_id
+    ))).first()
+
+
 # Helper function to clean up expired images
 
 
-def cleanup_expired_images():
-    """Clean up images that are older than 30 seconds"""
-    try:
-        cutoff_time = datetime.utcnow() - timedelta(seconds=30)
-        expired_images = Image.query.filter(Image.sent_at < cutoff_time).all()
+def cleanup_expired_images(limit=500):
+    """Clean up images whose viewing window has ended, oldest first and at
+    most ``limit`` per call; returns how many were removed.
 
-        for image in expired_images:
-            # Delete physical file
-            try:
-                file_path = os.path.join(UPLOAD_FOLDER, image.filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                print(f"Error deleting file {image.filename}: {e}")
+    Errors propagate so that the task running it is retried.
+    """
+    with use_primary():
+        expired_images = Image.query.filter(
+            Image.expires_at < datetime.utcnow()
+        ).order_by(Image.expires_at).limit(limit).all()
 
-            # Delete from database
-            db.session.delete(image)
+    release_image_files(expired_images)
+    for image in expired_images:
+        db.session.delete(image)
 
-        if expired_images:
-            db.session.commit()
-            print(f"Cleaned up {len(expired_images)} expired images")
+    if expired_images:
+        db.session.commit()
+        print(f"Cleaned up {len(expired_images)} expired images")
+    return len(expired_images)
+
+
+def hash_stream(stream):
+    """SHA-256 and size of a binary stream, read in chunks"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def acquire_blob(content_hash, size, extension, write, references=1):
+    """Take ``references`` on the blob with this content (one per Image row).
+
+    Only when no such blob exists is ``write(path)`` called to store the
+    bytes, and their preview made. Returns ``(filename, preview, created)``;
+    a created file must be removed if the transaction is rolled back.
+    """
+    for _ in range(2):
+        existing = db.session.execute(
+            db.update(Blob)
+            .where(Blob.content_hash == content_hash)
+            .values(refcount=Blob.refcount + references)
+            .returning(Blob.filename, Blob.preview)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if existing:
+            return existing.filename, existing.preview, False
+
+        # A fresh name per stored copy, so deleting a released blob's file
+        # can never remove a newer copy of the same content
+        filename = f"{content_hash}_{secrets.token_hex(4)}{extension}"
+        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        write(file_path)
+        preview = tiny_preview(file_path, app.config['IMAGE_PREVIEW_SIZE'])
+        try:
+            with db.session.begin_nested():
+                db.session.add(Blob(content_hash=content_hash,
+                                    filename=filename, size=size,
+                                    refcount=references,
+                                    preview=preview))
+            return filename, preview, True
+        except IntegrityError:
+            # Another upload stored the same content first; reference theirs
+            os.remove(file_path)
+
+    raise RuntimeError(f"Could not reference blob {content_hash}")
+
+
+def store_upload(file, references=1):
+    """Hash an uploaded file and reference its blob, writing it only if new"""
+    content_hash, size = hash_stream(file.stream)
+    extension = os.path.splitext(secure_filename(file.filename))[1].lower()
+
+    def write(file_path):
+        file.stream.seek(0)
+        file.save(file_path)
 
-    except Exception as e:
-        print(f"Error during cleanup: {e}")
-        db.session.rollback()
+    filename, preview, created = acquire_blob(
+        content_hash, size, extension, write, references)
+    return content_hash, filename, preview, created
+
+
+def release_image_files(images):
+    """Drop the blob references of images about to be deleted.
+
+    Files nobody references any more are queued for deletion in the same
+    transaction, so they go only if the deletion commits.
+    """
+    unused_files = []
+    released = {}
+    for image in images:
+        if image.content_hash:
+            released[image.content_hash] = released.get(
+                image.content_hash, 0) + 1
+        else:
+            unused_files.append(image.filename)
+
+    for content_hash, count in released.items():
+        db.session.execute(
+            db.update(Blob)
+            .where(Blob.content_hash == content_hash)
+            .values(refcount=Blob.refcount - count)
+            .execution_options(synchronize_session=False))
+
+    if released:
+        unused_files.extend(db.session.execute(
+            db.delete(Blob)
+            .where(Blob.content_hash.in_(released), Blob.refcount <= 0)
+            .returning(Blob.filename)
+            .execution_options(synchronize_session=False)
+        ).scalars())
+    queue_file_removal(unused_files)
+
+
+def queue_file_removal(filenames):
+    """Delete upload files in the background once the session commits"""
+    for filename in filenames:
+        tasks.enqueue('delete_file', {'filename': filename})
+
+
+def remove_upload_files(filenames):
+    """Delete upload files right away; for rollback paths only"""
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(UPLOAD_FOLDER, filename))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error deleting file {filename}: {e}")
+
+
+def idempotency_key():
+    """Validated Idempotency-Key header; raises ValueError if malformed"""
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= 64:
+        raise ValueError('Idempotency-Key must be 1-64 characters')
+    return key
+
+
+def replay(user_id, key, operation):
+    """Response to replay for a retried request, or None to go ahead.
+
+    Keys live in their own table for IDEMPOTENCY_KEY_HOURS, well past the
+    images they created. A key first used for another operation is refused.
+    """
+    if not key:
+        return None
+    record = db.session.get(IdempotencyKey, (user_id, key))
+    if record is None:
+        return None
+    if record.expires_at < datetime.utcnow():
+        # Free to reuse; the new response replaces it in this transaction
+        db.session.delete(record)
+        return None
+    if record.operation != operation:
+        return jsonify({
+            'error': 'Idempotency-Key was already used for a different request'
+        }), 422
+    return replayed(record.response)
+
+
+def remember_response(user_id, key, operation, payload):
+    """Stage ``payload`` for replays; commit it with the rows it describes"""
+    if key:
+        db.session.add(IdempotencyKey(
+            user_id=user_id, key=key, operation=operation, response=payload,
+            expires_at=datetime.utcnow() + timedelta(
+                hours=app.config['IDEMPOTENCY_KEY_HOURS'])))
+    return payload
+
+
+def replayed(payload, status=200):
+    return jsonify(payload), status, {'Idempotent-Replayed': 'true'}
+
+
+def pending_images(recipient_id):
+    """Live, unviewed images for a recipient, oldest first"""
+    return Image.query.filter(
+        Image.recipient_id == recipient_id,
+        Image.viewed_at.is_(None),
+        Image.expires_at >= datetime.utcnow()
+    ).order_by(Image.sent_at, Image.id)
+
+
+VIEW_WINDOW = timedelta(seconds=30)
+
+
+def lock_queues(recipient_ids):
+    """Depth and last deadline of recipients' image queues, locked.
+
+    Locks the recipients' user rows until commit, so concurrent uploads to
+    one queue take turns and the depth check and the insert that follows
+    are atomic. Returns ``{recipient_id: (pending, last_expires_at)}``.
+    """
+    lock_rows(db.session, User.id, recipient_ids)
+    queues = {recipient_id: (0, None) for recipient_id in recipient_ids}
+    queues.update(
+        (recipient_id, (pending, last_expires_at))
+        for recipient_id, pending, last_expires_at in db.session.query(
+            Image.recipient_id, db.func.count(), db.func.max(Image.expires_at)
+        ).filter(
+            Image.recipient_id.in_(recipient_ids),
+            Image.viewed_at.is_(None),
+            Image.expires_at >= datetime.utcnow()
+        ).group_by(Image.recipient_id))
+    return queues
+
+
+def queue_deadlines(last_expires_at, count, now):
+    """Deadlines of ``count`` images appended to a queue.
+
+    Each window starts when the one ahead of it ends, so a queued image
+    gets its full 30 seconds once it reaches the head of the queue.
+    """
+    start = max(now, last_expires_at) if last_expires_at else now
+    return [start + VIEW_WINDOW * (n + 1) for n in range(count)]
+
+
+def advance_queue(recipient_id, viewed_expires_at):
+    """Move the images queued behind a viewed one forward.
+
+    The next image's window starts now instead of when the viewed one
+    would have expired; the ones after it keep their place behind it.
+    """
+    delta = min(viewed_expires_at - datetime.utcnow(), VIEW_WINDOW)
+    if delta <= timedelta(0):
+        return
+
+    lock_rows(db.session, User.id, [recipient_id])
+    queued = Image.query.filter(
+        Image.recipient_id == recipient_id,
+        Image.viewed_at.is_(None),
+        Image.expires_at > viewed_expires_at
+    ).all()
+    for image in queued:
+        image.expires_at -= delta
+    db.session.commit()
+
+
+def cleanup_expired_upload_sessions(limit=100):
+    """Drop idle resumable upload sessions and their partial files.
+
+    Errors propagate so that the task running it is retried.
+    """
+    expired_sessions = UploadSession.query.filter(
+        UploadSession.expires_at < datetime.utcnow()).limit(limit).all()
+
+    queue_file_removal(upload.filename for upload in expired_sessions)
+    for upload in expired_sessions:
+        db.session.delete(upload)
+
+    if expired_sessions:
+        db.session.commit()
+        print(f"Cleaned up {len(expired_sessions)} expired upload sessions")
+
+
+# Background task handlers; each may run more than once. They let errors
+# propagate: the task queue rolls back, logs and retries with backoff
+
+
+@tasks.handler('delete_file')
+def delete_file_task(payload):
+    try:
+        os.remove(os.path.join(UPLOAD_FOLDER, payload['filename']))
+    except FileNotFoundError:
+        pass
+
+
+@tasks.handler('cleanup_expired_images')
+def cleanup_expired_images_task(payload, limit=500):
+    while cleanup_expired_images(limit) >= limit:
+        pass
+
+
+@tasks.handler('cleanup_expired_upload_sessions')
+def cleanup_expired_upload_sessions_task(payload):
+    cleanup_expired_upload_sessions()
+
+
+@tasks.handler('reconcile_orphan_files')
+def reconcile_orphan_files(payload, batch_size=500):
+    """Delete files in UPLOAD_FOLDER that no blob, image or upload uses"""
+    cutoff = time.time() - app.config['ORPHAN_GRACE_SECONDS']
+    candidates = [entry.name for entry in os.scandir(UPLOAD_FOLDER)
+                  if entry.is_file() and not entry.name.startswith('.')
+                  and entry.stat().st_mtime < cutoff]
+
+    removed = 0
+    for start in range(0, len(candidates), batch_size):
+        names = candidates[start:start + batch_size]
+        referenced = set(db.session.execute(db.union(
+            db.select(Blob.filename).where(Blob.filename.in_(names)),
+            db.select(Image.filename).where(Image.filename.in_(names)),
+            db.select(UploadSession.filename)
+            .where(UploadSession.filename.in_(names))
+        )).scalars())
+        for name in names:
+            if name not in referenced:
+                delete_file_task({'filename': name})
+                removed += 1
+
+    db.session.rollback()
+    if removed:
+        print(f"Removed {removed} orphaned upload files")
+
+
+tasks.periodic('cleanup_expired_images', app.config['EXPIRY_SWEEP_INTERVAL'])
+tasks.periodic('cleanup_expired_upload_sessions', 60)
+tasks.periodic('reconcile_orphan_files', app.config['ORPHAN_SCAN_INTERVAL'])
+tasks.periodic('purge_refresh_tokens', 3600)
+tasks.periodic('purge_idempotency_keys', 3600)
+tasks.periodic('purge_failed_tasks', 86400)
+
+
+@tasks.handler('purge_refresh_tokens')
+def purge_refresh_tokens(payload):
+    removed = db.session.execute(
+        db.delete(RefreshToken).where(refresh_tokens.expired())
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    if removed:
+        print(f"Purged {removed} expired refresh tokens")
+
+
+@tasks.handler('purge_idempotency_keys')
+def purge_idempotency_keys(payload):
+    removed = db.session.execute(
+        db.delete(IdempotencyKey)
+        .where(IdempotencyKey.expires_at < datetime.utcnow())
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    if removed:
+        print(f"Purged {removed} expired idempotency keys")
+
+
+@tasks.handler('purge_failed_tasks')
+def purge_failed_tasks(payload):
+    cutoff = datetime.utcnow() - timedelta(
+        days=app.config['TASK_FAILED_RETENTION_DAYS'])
+    removed = db.session.execute(
+        db.delete(Task).where(Task.status == 'failed', Task.run_at < cutoff)
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    if removed:
+        print(f"Purged {removed} failed tasks")
+
+
+def evict_viewed_images(limit=500):
+    """Drop images already viewed, oldest view first and at most ``limit``
+    per call; returns how many were removed"""
+    viewed = Image.query.filter(
+        Image.viewed_at.isnot(None)
+    ).order_by(Image.viewed_at).limit(limit).all()
+
+    release_image_files(viewed)
+    for image in viewed:
+        db.session.delete(image)
+
+    if viewed:
+        db.session.commit()
+        print(f"Evicted {len(viewed)} viewed images under storage pressure")
+    return len(viewed)
+
+
+@tasks.handler('evict_storage')
+def evict_storage(payload, limit=500):
+    """Free space early: drop expired images, and ones already viewed.
+
+    Works in committed batches, so memory stays flat and each batch's files
+    are freed as it goes.
+    """
+    while cleanup_expired_images(limit) >= limit:
+        pass
+    while evict_viewed_images(limit) >= limit:
+        pass
+
+
+def stored_upload_bytes():
+    """Bytes held by stored blobs plus space reserved by resumable uploads"""
+    return db.session.execute(db.select(
+        db.select(db.func.coalesce(db.func.sum(Blob.size), 0))
+        .scalar_subquery()
+        + db.select(db.func.coalesce(db.func.sum(UploadSession.length), 0))
+        .scalar_subquery()
+    )).scalar()
+
+
+def user_upload_bytes(user_id):
+    """Bytes of the distinct blobs a sender has queued.
+
+    An image fanned out to a room is stored once and counted once.
+    """
+    user_id = int(user_id)
+    return db.session.execute(db.select(
+        db.select(db.func.coalesce(db.func.sum(Blob.size), 0))
+        .where(Blob.content_hash.in_(
+            db.select(Image.content_hash)
+            .where(Image.sender_id == user_id)))
+        .scalar_subquery()
+        + db.select(db.func.coalesce(db.func.sum(UploadSession.length), 0))
+        .where(UploadSession.user_id == user_id)
+        .scalar_subquery()
+    )).scalar()
+
+
+def declared_upload_length():
+    """Full size a resumable upload declares, from its JSON ``length`` or
+    the Upload-Length header; raises ValueError if missing or malformed"""
+    data = request.get_json(silent=True) or {}
+    try:
+        return int(data.get('length') or request.headers['Upload-Length'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Upload length required')
+
+
+storage = StorageAccountant(
+    app, UPLOAD_FOLDER,
+    stored_bytes=stored_upload_bytes,
+    user_bytes=user_upload_bytes,
+    # A resumable upload is admitted, and counted, once for its declared
+    # length when the session is created; its chunks fill that reservation
+    endpoints={'upload_image', 'upload_images', 'upload_room_image',
+               'create_upload_session'},
+    on_pressure=lambda: tasks.enqueue_unique('evict_storage'),
+    declared_size=declared_upload_length)
+
+
+def queue_full_error(pending, incoming):
+    depth = app.config['IMAGE_QUEUE_DEPTH']
+    if pending + incoming > depth:
+        return jsonify({
+            'error': f'Image queue full ({pending} of {depth} pending)'
+        }), 400
+    return None
 
 # Routes
 
 
+@app.route('/livez', methods=['GET'])
+def liveness_check():
+    """Process is up; no I/O"""
+    return jsonify({'status': 'alive'}), 200
+
+
+@app.route('/readyz', methods=['GET'])
+def readiness_check():
+    """Last result of the background prober, served from memory"""
+    result = prober.snapshot()
+    return jsonify(result), 200 if result['ready'] else 503
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    try:
-        # Test database connection
-        db.session.execute('SELECT 1')
-        db_status = 'connected'
-    except Exception as e:
-        print(f"Database health check failed: {e}")
-        db_status = 'error'
+    result = prober.snapshot()
+    database = result['checks'].get('database')
 
     return jsonify({
         'status': 'healthy',
         'message': 'FlashPair backend is running!',
-        'database': db_status,
+        'database': 'connected' if database and database['ok'] else 'error',
+        'storage': storage.snapshot(),
+        'handoff': handoff.stats(),
         'database_url': 'postgresql' if 'postgresql' in app.config['SQLALCHEMY_DATABASE_URI'] else 'sqlite',
         'port': os.environ.get('PORT', '5000')
     }), 200
 
 
+def other_worker():
+    """409 when ?pid= names another worker process.
+
+    Profiling and memory tracing state lives in the process that started
+    it; responses carry its ``pid`` so that follow-up calls can pass it and
+    be retried until they reach the same worker.
+    """
+    pid = request.args.get('pid')
+    if pid is not None and pid != str(os.getpid()):
+        return jsonify({
+            'error': 'Session belongs to another worker process, retry',
+            'pid': os.getpid()
+        }), 409
+    return None
+
+
+@app.route('/admin/profile', methods=['POST'])
+@jwt_required()
+@admin_required
+def start_profile():
+    """Sample requests on this worker process only, e.g. {"seconds": 30,
+    "routes": ["/image/upload", "/auth/login"], "percent": 10}; pass the
+    returned pid to GET and DELETE"""
+    try:
+        data = request.get_json(silent=True) or {}
+        routes = data.get('routes') or []
+        if isinstance(routes, str):
+            routes = [routes]
+        try:
+            status = profiler.start(
+                seconds=float(data.get('seconds', 30)),
+                routes=[str(route) for route in routes],
+                rate=float(data.get('percent', 100)) / 100)
+        except (TypeError, ValueError):
+            return jsonify({
+                'error': 'seconds must be positive and percent in (0, 100]'
+            }), 400
+
+        return jsonify(status), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/admin/profile', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_profile():
+    """Collapsed stacks of this worker's latest session (flamegraph.pl,
+    speedscope), or its status with ?format=json"""
+    refused = other_worker()
+    if refused:
+        return refused
+    if request.args.get('format') == 'json':
+        return jsonify(profiler.status()), 200
+    response = app.response_class(profiler.collapsed(), mimetype='text/plain')
+    response.headers['X-Worker-PID'] = str(os.getpid())
+    return response
+
+
+@app.route('/admin/profile', methods=['DELETE'])
+@jwt_required()
+@admin_required
+def stop_profile():
+    refused = other_worker()
+    if refused:
+        return refused
+    profiler.stop()
+    return jsonify(profiler.status()), 200
+
+
+@app.route('/admin/memory/snapshot', methods=['POST'])
+@jwt_required()
+@admin_required
+def memory_snapshot():
+    """Start tracemalloc in this worker process if needed and take the
+    baseline for /diff"""
+    try:
+        frames = min(max(int(request.args.get('frames', 1)), 1), 25)
+        limit = page_limit(request.args.get('limit'), default=20, maximum=200)
+        key_type = request.args.get('groupBy', 'lineno')
+        if key_type not in ('lineno', 'filename', 'traceback'):
+            return jsonify({'error': 'groupBy must be lineno, filename or traceback'}), 400
+
+        return jsonify(memory_tracer.snapshot(frames, limit, key_type)), 200
+
+    except ValueError:
+        return jsonify({'error': 'Invalid frames'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/admin/memory/diff', methods=['GET'])
+@jwt_required()
+@admin_required
+def memory_diff():
+    """Allocation growth on this worker process since its last snapshot"""
+    refused = other_worker()
+    if refused:
+        return refused
+    try:
+        limit = page_limit(request.args.get('limit'), default=20, maximum=200)
+        key_type = request.args.get('groupBy', 'lineno')
+        if key_type not in ('lineno', 'filename', 'traceback'):
+            return jsonify({'error': 'groupBy must be lineno, filename or traceback'}), 400
+
+        result = memory_tracer.diff(limit, key_type)
+        if result is None:
+            return jsonify({'error': 'No snapshot taken yet'}), 409
+        return jsonify(result), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/admin/memory', methods=['DELETE'])
+@jwt_required()
+@admin_required
+def stop_memory_tracing():
+    refused = other_worker()
+    if refused:
+        return refused
+    memory_tracer.stop()
+    return jsonify(memory_tracer.status()), 200
+
+
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({
@@ -186,12 +1194,16 @@ def register():
 
         db.session.add(user)
         db.session.commit()
+        mark_written(user.id)
 
         # FIXED: Convert user ID to string for JWT
-        access_token = create_access_token(identity=str(user.id))
+        access_token = issue_access_token(user)
+        refresh_token = refresh_tokens.issue(user.id)
+        db.session.commit()
         return jsonify({
             'message': 'User created successfully',
             'access_token': access_token,
+            'refresh_token': refresh_token,
             'user': {'id': user.id, 'username': user.username}
         }), 201
 
@@ -218,18 +1230,71 @@ def login():
             return jsonify({'error': 'Invalid credentials'}), 401
 
         # FIXED: Convert user ID to string for JWT
-        access_token = create_access_token(identity=str(user.id))
+        access_token = issue_access_token(user)
+        refresh_token = refresh_tokens.issue(user.id)
+        db.session.commit()
         return jsonify({
             'message': 'Login successful',
             'access_token': access_token,
+            'refresh_token': refresh_token,
             'user': {'id': user.id, 'username': user.username}
         }), 200
 
     except Exception as e:
+        db.session.rollback()
         print(f"Login error: {e}")
         return jsonify({'error': 'Login failed'}), 500
 
 
+@app.route('/auth/refresh', methods=['POST'])
+def refresh_access_token():
+    """Swap a refresh token for a new access token and refresh token"""
+    try:
+        data = request.get_json(silent=True)
+
+        if not data or not data.get('refresh_token'):
+            return jsonify({'error': 'Refresh token required'}), 400
+
+        try:
+            user_id, refresh_token = refresh_tokens.rotate(
+                str(data['refresh_token']))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 401
+
+        user = fetch_user_record(user_id)
+        if not user:
+            return jsonify({'error': 'User not found'}), 401
+
+        return jsonify({
+            'access_token': issue_access_token(user),
+            'refresh_token': refresh_token
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Refresh error: {e}")
+        return jsonify({'error': 'Refresh failed'}), 500
+
+
+@app.route('/auth/logout', methods=['POST'])
+def logout():
+    """Revoke a refresh token and every token rotated from the same login"""
+    try:
+        data = request.get_json(silent=True)
+
+        if not data or not data.get('refresh_token'):
+            return jsonify({'error': 'Refresh token required'}), 400
+
+        refresh_tokens.revoke(str(data['refresh_token']))
+        db.session.commit()
+        return jsonify({'message': 'Logged out'}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Logout error: {e}")
+        return jsonify({'error': 'Logout failed'}), 500
+
+
 @app.route('/pair/generate', methods=['POST'])
 @jwt_required()
 def generate_pair_code():
@@ -248,11 +1313,32 @@ def generate_pair_code():
         while User.query.filter_by(current_pair_code=code).first():
             code = ''.join(random.choices(string.digits, k=6))
 
+        # Clear the existing pair on both sides, so the old partner is not
+        # left pointing at a user who moved on
+        partner_id = current_user.current_pair_id
+        released = []
+        if partner_id:
+            released = db.session.execute(
+                db.update(User)
+                .where(User.id == partner_id,
+                       User.current_pair_id == current_user_id)
+                .values(current_pair_id=None,
+                        token_version=User.token_version + 1)
+                .returning(User.id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+
         current_user.current_pair_code = code
-        current_user.current_pair_id = None  # Clear existing pair
+        current_user.current_pair_id = None
+        bump_token_versions(current_user)
 
         db.session.commit()
-        return jsonify({'pairCode': code}), 200
+        mark_written(current_user_id, *released)
+        if released:
+            token_versions.invalidate(*released)
+            backplane.publish('pair.disconnected',
+                              [current_user_id, *released])
+        return jsonify(with_fresh_token({'pairCode': code}, current_user)), 200
 
     except Exception as e:
         db.session.rollback()
@@ -266,7 +1352,6 @@ def connect_with_code():
     try:
         # FIXED: Convert JWT identity back to int
         current_user_id = int(get_jwt_identity())
-        current_user = User.query.get(current_user_id)
 
         data = request.get_json()
         if not data or not data.get('code'):
@@ -274,28 +1359,57 @@ def connect_with_code():
 
         code = data['code'].strip()
 
-        # Find user with this code
-        target_user = User.query.filter_by(current_pair_code=code).first()
+        # Claim the code in one conditional UPDATE: once it is cleared no
+        # concurrent redeemer can match the row again
+        target_user = db.session.execute(
+            db.update(User)
+            .where(User.current_pair_code == code,
+                   User.current_pair_id.is_(None),
+                   User.id != current_user_id)
+            .values(current_pair_id=current_user_id,
+                    current_pair_code=None,
+                    token_version=User.token_version + 1)
+            .returning(User.id, User.username)
+            .execution_options(synchronize_session=False)
+        ).first()
 
         if not target_user:
+            db.session.rollback()
+            owner_id = db.session.query(User.id).filter_by(
+                current_pair_code=code).scalar()
+            if owner_id == current_user_id:
+                return jsonify({'error': 'Cannot pair with yourself'}), 400
             return jsonify({'error': 'Invalid pairing code'}), 400
 
-        if target_user.id == current_user_id:
-            return jsonify({'error': 'Cannot pair with yourself'}), 400
-
-        # Pair both users
-        current_user.current_pair_id = target_user.id
-        target_user.current_pair_id = current_user_id
+        # Pair the caller with the claimed user, but only if the caller is
+        # still unpaired: a second code redeemed concurrently (or while
+        # paired) must not leave its owner pointing at the caller
+        current_user = db.session.execute(
+            db.update(User)
+            .where(User.id == current_user_id,
+                   User.current_pair_id.is_(None))
+            .values(current_pair_id=target_user.id,
+                    current_pair_code=None,
+                    token_version=User.token_version + 1)
+            .returning(User.id, User.current_pair_id, User.token_version)
+            .execution_options(synchronize_session=False)
+        ).first()
 
-        # Clear pair codes
-        target_user.current_pair_code = None
-        current_user.current_pair_code = None
+        if not current_user:
+            db.session.rollback()
+            return jsonify({
+                'error': 'Already paired with someone, disconnect first'
+            }), 400
 
         db.session.commit()
-        return jsonify({
+        g.pair_affinity = (current_user_id, target_user.id)
+        mark_written(current_user_id, target_user.id)
+        token_versions.invalidate(target_user.id)
+        backplane.publish('pair.connected', [current_user_id, target_user.id])
+        return jsonify(with_fresh_token({
             'message': 'Successfully paired!',
             'pairedWith': target_user.username
-        }), 200
+        }, current_user, target_user.username)), 200
 
     except Exception as e:
         db.session.rollback()
@@ -305,27 +1419,38 @@ def connect_with_code():
 
 @app.route('/pair/status', methods=['GET'])
 @jwt_required()
+@read_only
+@flights.view('pair_status')
 def get_pair_status():
     try:
         # FIXED: Convert JWT identity back to int
         current_user_id = int(get_jwt_identity())
-        current_user = User.query.get(current_user_id)
 
-        if not current_user:
-            return jsonify({'error': 'User not found'}), 404
+        # Pair context from verified token claims, no DB round trip
+        if isinstance(current_user, TokenUser):
+            if current_user.current_pair_id:
+                return {
+                    'isPaired': True,
+                    'pairedWith': current_user.paired_username
+                }, 200
+            return {'isPaired': False}, 200
 
-        if current_user.current_pair_id:
-            paired_user = User.query.get(current_user.current_pair_id)
-            return jsonify({
+        user = fetch_user_record(current_user_id)
+
+        if not user:
+            return {'error': 'User not found'}, 404
+
+        if user.current_pair_id:
+            return {
                 'isPaired': True,
-                'pairedWith': paired_user.username if paired_user else None
-            }), 200
+                'pairedWith': fetch_username(user.current_pair_id)
+            }, 200
 
-        return jsonify({'isPaired': False}), 200
+        return {'isPaired': False}, 200
 
     except Exception as e:
         print(f"Pair status error: {e}")
-        return jsonify({'error': 'Failed to get pair status'}), 500
+        return {'error': 'Failed to get pair status'}, 500
 
 
 @app.route('/pair/disconnect', methods=['POST'])
@@ -334,21 +1459,41 @@ def disconnect():
     try:
         # FIXED: Convert JWT identity back to int
         current_user_id = int(get_jwt_identity())
-        current_user = User.query.get(current_user_id)
-
-        if current_user.current_pair_id:
-            # Disconnect both users
-            paired_user = User.query.get(current_user.current_pair_id)
-            if paired_user:
-                paired_user.current_pair_id = None
-
-            current_user.current_pair_id = None
-            current_user.current_pair_code = None
 
-            db.session.commit()
-            return jsonify({'message': 'Disconnected successfully'}), 200
+        # Release the caller and, if it still points back, the partner in a
+        # single UPDATE
+        partner_id = db.select(User.current_pair_id).where(
+            User.id == current_user_id).scalar_subquery()
+        released = db.session.execute(
+            db.update(User)
+            .where(db.or_(
+                db.and_(User.id == current_user_id,
+                        User.current_pair_id.isnot(None)),
+                db.and_(User.id == partner_id,
+                        User.current_pair_id == current_user_id)))
+            .values(current_pair_id=None,
+                    current_pair_code=db.case(
+                        (User.id == current_user_id, None),
+                        else_=User.current_pair_code),
+                    token_version=User.token_version + 1)
+            .returning(User.id, User.current_pair_id, User.token_version)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+        current_user = next(
+            (row for row in released if row.id == current_user_id), None)
+        if not current_user:
+            db.session.rollback()
+            return jsonify({'message': 'Not paired with anyone'}), 200
 
-        return jsonify({'message': 'Not paired with anyone'}), 200
+        db.session.commit()
+        g.pair_affinity = (current_user_id, None)
+        released_ids = [row.id for row in released]
+        mark_written(*released_ids)
+        token_versions.invalidate(*released_ids)
+        backplane.publish('pair.disconnected', released_ids)
+        return jsonify(with_fresh_token(
+            {'message': 'Disconnected successfully'}, current_user)), 200
 
     except Exception as e:
         db.session.rollback()
@@ -356,14 +1501,34 @@ def disconnect():
         return jsonify({'error': 'Disconnect failed'}), 500
 
 
+def image_upload_payload(image):
+    paired_user = User.query.get(image.recipient_id)
+    return {
+        'message': 'Image uploaded successfully',
+        'imageId': image.id,
+        'sentTo': paired_user.username if paired_user else 'Unknown'
+    }
+
+
 @app.route('/image/upload', methods=['POST'])
 @jwt_required()
 def upload_image():
+    new_files = []
     try:
         # FIXED: Convert JWT identity back to int
         current_user_id = int(get_jwt_identity())
         current_user = User.query.get(current_user_id)
 
+        try:
+            key = idempotency_key()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # A retried upload returns the original image before the body is read
+        previous = replay(current_user_id, key, 'image.upload')
+        if previous:
+            return previous
+
         if not current_user.current_pair_id:
             return jsonify({'error': 'Not paired with anyone'}), 400
 
@@ -374,126 +1539,786 @@ def upload_image():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
-        # Generate secure filename
-        original_filename = secure_filename(file.filename)
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{current_user_id}_{original_filename}"
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        recipient_id = current_user.current_pair_id
+        pending, last_expires_at = lock_queues([recipient_id])[recipient_id]
+        error = queue_full_error(pending, 1)
+        if error:
+            db.session.rollback()
+            return error
 
-        file.save(file_path)
+        content_hash, filename, preview, created = store_upload(file)
+        if created:
+            new_files.append(filename)
 
         # Save to database
+        now = datetime.utcnow()
         image = Image(
             filename=filename,
+            content_hash=content_hash,
+            preview=preview,
             sender_id=current_user_id,
-            recipient_id=current_user.current_pair_id
+            recipient_id=recipient_id,
+            sent_at=now,
+            expires_at=queue_deadlines(last_expires_at, 1, now)[0]
         )
 
         db.session.add(image)
+        db.session.flush()
+        payload = remember_response(current_user_id, key, 'image.upload',
+                                    image_upload_payload(image))
         db.session.commit()
+        mark_written(current_user_id, current_user.current_pair_id)
+        backplane.publish('image.new', [current_user.current_pair_id],
+                          imageId=image.id, senderId=current_user_id)
 
-        paired_user = User.query.get(current_user.current_pair_id)
-        return jsonify({
-            'message': 'Image uploaded successfully',
-            'imageId': image.id,
-            'sentTo': paired_user.username if paired_user else 'Unknown'
-        }), 200
+        if local_users.is_recent(current_user.current_pair_id):
+            # The recipient polls this process: hand the bytes to their view
+            file.stream.seek(0)
+            handoff.put(image.id, file.stream.read(), filename=filename)
+
+        return jsonify(payload), 200
+
+    except IntegrityError as e:
+        # A concurrent retry with the same Idempotency-Key won the insert
+        db.session.rollback()
+        remove_upload_files(new_files)
+        previous = replay(current_user_id, key, 'image.upload')
+        if previous:
+            return previous
+        print(f"Upload error: {e}")
+        return jsonify({'error': 'Upload failed'}), 500
 
     except Exception as e:
         db.session.rollback()
         print(f"Upload error: {e}")
         # Clean up file if database save failed
+        remove_upload_files(new_files)
+        return jsonify({'error': 'Upload failed'}), 500
+
+
+def batch_upload_payload(images):
+    paired_user = User.query.get(images[0].recipient_id)
+    return {
+        'message': f'{len(images)} images uploaded successfully',
+        'imageIds': [image.id for image in images],
+        'sentTo': paired_user.username if paired_user else 'Unknown'
+    }
+
+
+@app.route('/image/upload/batch', methods=['POST'])
+@jwt_required()
+def upload_images():
+    """Queue several images from one multipart request (field 'images')"""
+    new_files = []
+    try:
+        current_user_id = int(get_jwt_identity())
+        current_user = User.query.get(current_user_id)
+
         try:
-            if 'file_path' in locals() and os.path.exists(file_path):
-                os.remove(file_path)
-        except:
-            pass
+            key = idempotency_key()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        previous = replay(current_user_id, key, 'image.upload.batch')
+        if previous:
+            return previous
+
+        if not current_user.current_pair_id:
+            return jsonify({'error': 'Not paired with anyone'}), 400
+
+        files = [f for f in request.files.getlist('images') if f.filename]
+        if not files:
+            return jsonify({'error': 'No images provided'}), 400
+
+        recipient_id = current_user.current_pair_id
+        pending, last_expires_at = lock_queues([recipient_id])[recipient_id]
+        error = queue_full_error(pending, len(files))
+        if error:
+            db.session.rollback()
+            return error
+
+        # Consecutive timestamps keep the batch in upload order; identical
+        # files in one batch share a single stored blob
+        sent_at = datetime.utcnow()
+        deadlines = queue_deadlines(last_expires_at, len(files), sent_at)
+        images = []
+        for offset, file in enumerate(files):
+            content_hash, filename, preview, created = store_upload(file)
+            if created:
+                new_files.append(filename)
+            images.append(Image(
+                filename=filename,
+                content_hash=content_hash,
+                preview=preview,
+                sender_id=current_user_id,
+                recipient_id=recipient_id,
+                sent_at=sent_at + timedelta(microseconds=offset),
+                expires_at=deadlines[offset]
+            ))
+
+        db.session.add_all(images)
+        db.session.flush()
+        payload = remember_response(current_user_id, key,
+                                    'image.upload.batch',
+                                    batch_upload_payload(images))
+        db.session.commit()
+        mark_written(current_user_id, recipient_id)
+        backplane.publish('image.new', [recipient_id],
+                          imageIds=[image.id for image in images],
+                          senderId=current_user_id)
+
+        return jsonify(payload), 200
+
+    except IntegrityError as e:
+        db.session.rollback()
+        remove_upload_files(new_files)
+        previous = replay(current_user_id, key, 'image.upload.batch')
+        if previous:
+            return previous
+        print(f"Batch upload error: {e}")
         return jsonify({'error': 'Upload failed'}), 500
 
+    except Exception as e:
+        db.session.rollback()
+        print(f"Batch upload error: {e}")
+        remove_upload_files(new_files)
+        return jsonify({'error': 'Upload failed'}), 500
+
+
+# Group rooms: an image sent to a room is stored once, as one blob holding a
+# reference per recipient, and fanned out as one Image row per member. Each
+# row keeps its own view-once state and 30-second timer, so checks and views
+# work exactly as for pairs.
+ROOM_CODE_CHARS = string.ascii_uppercase + string.digits
+
+
+def room_member_ids(room_id):
+    return db.session.execute(
+        db.select(RoomMember.user_id).where(RoomMember.room_id == room_id)
+    ).scalars().all()
+
+
+def room_payload(room):
+    members = db.session.execute(
+        db.select(User.id, User.username)
+        .join(RoomMember, RoomMember.user_id == User.id)
+        .where(RoomMember.room_id == room.id)
+        .order_by(RoomMember.joined_at, User.id)).all()
+    return {
+        'roomId': room.id,
+        'name': room.name,
+        'code': room.code,
+        'ownerId': room.owner_id,
+        'members': [{'userId': user_id, 'username': username}
+                    for user_id, username in members]
+    }
+
+
+@app.route('/rooms', methods=['POST'])
+@jwt_required()
+def create_room():
+    try:
+        current_user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+        name = (data.get('name') or '').strip()
+        if not 0 < len(name) <= 80:
+            return jsonify({'error': 'Room name must be 1-80 characters'}), 400
+
+        for _ in range(5):
+            room = Room(
+                name=name,
+                code=''.join(secrets.choice(ROOM_CODE_CHARS) for _ in range(8)),
+                owner_id=current_user_id)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(room)
+                break
+            except IntegrityError:
+                # Code already taken, draw another
+                continue
+        else:
+            return jsonify({'error': 'Failed to create room'}), 500
+
+        db.session.add(RoomMember(room_id=room.id, user_id=current_user_id))
+        db.session.commit()
+        mark_written(current_user_id)
+        return jsonify(room_payload(room)), 201
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Create room error: {e}")
+        return jsonify({'error': 'Failed to create room'}), 500
+
+
+@app.route('/rooms/join', methods=['POST'])
+@jwt_required()
+def join_room():
+    try:
+        current_user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+        code = (data.get('code') or '').strip().upper()
+
+        room = Room.query.filter_by(code=code).first() if code else None
+        if not room:
+            return jsonify({'error': 'Invalid room code'}), 404
+
+        # Joins and leaves of one room take turns, so the size check and
+        # the insert are atomic and the room cannot be dropped in between
+        lock_rows(db.session, Room.id, [room.id])
+        if db.session.get(Room, room.id, populate_existing=True) is None:
+            db.session.rollback()
+            return jsonify({'error': 'Invalid room code'}), 404
+
+        members = room_member_ids(room.id)
+        if current_user_id not in members:
+            if len(members) >= app.config['ROOM_MAX_MEMBERS']:
+                db.session.rollback()
+                return jsonify({'error': 'Room is full'}), 400
+            db.session.add(RoomMember(room_id=room.id,
+                                      user_id=current_user_id))
+            db.session.commit()
+            mark_written(current_user_id)
+            backplane.publish('room.joined', members, roomId=room.id,
+                              userId=current_user_id)
+
+        return jsonify(room_payload(room)), 200
+
+    except IntegrityError:
+        # A concurrent join by the same user got there first
+        db.session.rollback()
+        return jsonify(room_payload(room)), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Join room error: {e}")
+        return jsonify({'error': 'Failed to join room'}), 500
+
+
+@app.route('/rooms/<int:room_id>/leave', methods=['POST'])
+@jwt_required()
+def leave_room(room_id):
+    try:
+        current_user_id = int(get_jwt_identity())
+        lock_rows(db.session, Room.id, [room_id])
+        left = db.session.execute(
+            db.delete(RoomMember)
+            .where(RoomMember.room_id == room_id,
+                   RoomMember.user_id == current_user_id)
+            .execution_options(synchronize_session=False)).rowcount
+        if not left:
+            db.session.rollback()
+            return jsonify({'error': 'Room not found'}), 404
+
+        remaining = room_member_ids(room_id)
+        if not remaining:
+            # Images already delivered stay pending; their room_id is cleared
+            db.session.execute(
+                db.update(Image).where(Image.room_id == room_id)
+                .values(room_id=None)
+                .execution_options(synchronize_session=False))
+            db.session.execute(
+                db.delete(Room).where(Room.id == room_id)
+                .execution_options(synchronize_session=False))
+        db.session.commit()
+        mark_written(current_user_id)
+        backplane.publish('room.left', remaining, roomId=room_id,
+                          userId=current_user_id)
+
+        return jsonify({'message': 'Left room'}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Leave room error: {e}")
+        return jsonify({'error': 'Failed to leave room'}), 500
+
+
+@app.route('/rooms', methods=['GET'])
+@jwt_required()
+@read_only
+def list_rooms():
+    try:
+        current_user_id = int(get_jwt_identity())
+        rooms = Room.query.join(
+            RoomMember, RoomMember.room_id == Room.id
+        ).filter(
+            RoomMember.user_id == current_user_id
+        ).order_by(Room.id).all()
+        return jsonify({'rooms': [room_payload(room) for room in rooms]}), 200
+
+    except Exception as e:
+        print(f"List rooms error: {e}")
+        return jsonify({'error': 'Failed to list rooms'}), 500
+
+
+def room_upload_payload(room_id, images, skipped=()):
+    return {
+        'message': f'Image sent to {len(images)} members',
+        'roomId': room_id,
+        'imageIds': [image.id for image in images],
+        'sentTo': [image.recipient_id for image in images],
+        'skipped': list(skipped)
+    }
+
+
+@app.route('/rooms/<int:room_id>/images', methods=['POST'])
+@jwt_required()
+def upload_room_image(room_id):
+    """Store one image once and deliver it to every other room member"""
+    new_files = []
+    try:
+        current_user_id = int(get_jwt_identity())
+
+        try:
+            key = idempotency_key()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Scoped by room: a key reused for another room is refused
+        operation = f'room:{room_id}.image'
+        previous = replay(current_user_id, key, operation)
+        if previous:
+            return previous
+
+        members = room_member_ids(room_id)
+        if current_user_id not in members:
+            return jsonify({'error': 'Room not found'}), 404
+
+        if 'image' not in request.files:
+            return jsonify({'error': 'No image provided'}), 400
+
+        file = request.files['image']
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        # Members whose queue is full miss this image; the rest still get it
+        others = [user_id for user_id in members if user_id != current_user_id]
+        queues = lock_queues(others) if others else {}
+        depth = app.config['IMAGE_QUEUE_DEPTH']
+        recipients = [user_id for user_id in others
+                      if queues[user_id][0] < depth]
+        skipped = [user_id for user_id in others if user_id not in recipients]
+        if not recipients:
+            db.session.rollback()
+            return jsonify({
+                'error': 'No other member can receive images right now',
+                'skipped': skipped
+            }), 400
+
+        content_hash, filename, preview, created = store_upload(
+            file, references=len(recipients))
+        if created:
+            new_files.append(filename)
+
+        # Every delivery row in a single multi-row INSERT
+        sent_at = datetime.utcnow()
+        images = db.session.execute(
+            db.insert(Image).values([{
+                'filename': filename,
+                'content_hash': content_hash,
+                'preview': preview,
+                'sender_id': current_user_id,
+                'recipient_id': recipient_id,
+                'room_id': room_id,
+                'sent_at': sent_at,
+                'expires_at': queue_deadlines(
+                    queues[recipient_id][1], 1, sent_at)[0]
+            } for recipient_id in recipients])
+            .returning(Image.id, Image.recipient_id)).all()
+        payload = remember_response(current_user_id, key, operation,
+                                    room_upload_payload(room_id, images,
+                                                        skipped))
+        db.session.commit()
+        mark_written(current_user_id, *recipients)
+        backplane.publish('image.new', recipients, roomId=room_id,
+                          senderId=current_user_id)
+
+        return jsonify(payload), 200
+
+    except IntegrityError as e:
+        # A concurrent retry with the same Idempotency-Key won the insert
+        db.session.rollback()
+        remove_upload_files(new_files)
+        previous = replay(current_user_id, key, f'room:{room_id}.image')
+        if previous:
+            return previous
+        print(f"Room upload error: {e}")
+        return jsonify({'error': 'Upload failed'}), 500
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Room upload error: {e}")
+        remove_upload_files(new_files)
+        return jsonify({'error': 'Upload failed'}), 500
+
+
+# Resumable uploads (tus-style): create a session, PATCH chunks at the
+# current offset, query the offset after a dropped connection, finalize.
+# Chunks are written straight to their final place in UPLOAD_FOLDER.
+
+
+def upload_session_headers(upload):
+    return {
+        'Upload-Offset': str(upload.received),
+        'Upload-Length': str(upload.length),
+        'Upload-Expires': upload.expires_at.isoformat(),
+        'Cache-Control': 'no-store'
+    }
+
+
+def get_upload_session(upload_id, user_id):
+    return UploadSession.query.filter_by(
+        id=upload_id, user_id=user_id).filter(
+            UploadSession.expires_at >= datetime.utcnow()).first()
+
+
+@app.route('/image/uploads', methods=['POST'])
+@jwt_required()
+def create_upload_session():
+    try:
+        current_user_id = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+
+        try:
+            length = declared_upload_length()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if length <= 0 or length > app.config['MAX_CONTENT_LENGTH']:
+            return jsonify({'error': 'Invalid upload length'}), 413
+
+        original_filename = secure_filename(data.get('filename') or 'image')
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')
+        filename = f"{timestamp}_{current_user_id}_{original_filename}"
+
+        # Reserve the file so chunks can be written at any offset
+        open(os.path.join(UPLOAD_FOLDER, filename), 'wb').close()
+
+        upload = UploadSession(
+            id=secrets.token_hex(16),
+            user_id=current_user_id,
+            filename=filename,
+            length=length,
+            received=0,
+            expires_at=datetime.utcnow() + timedelta(
+                minutes=app.config['UPLOAD_SESSION_TTL_MINUTES'])
+        )
+        db.session.add(upload)
+        db.session.commit()
+
+        headers = upload_session_headers(upload)
+        headers['Location'] = f"/image/uploads/{upload.id}"
+        return jsonify({
+            'uploadId': upload.id,
+            'offset': 0,
+            'length': length,
+            'expiresAt': upload.expires_at.isoformat()
+        }), 201, headers
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Create upload session error: {e}")
+        return jsonify({'error': 'Failed to create upload'}), 500
+
+
+@app.route('/image/uploads/<upload_id>', methods=['GET', 'HEAD'])
+@jwt_required()
+def get_upload_offset(upload_id):
+    try:
+        upload = get_upload_session(upload_id, int(get_jwt_identity()))
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        return jsonify({
+            'uploadId': upload.id,
+            'offset': upload.received,
+            'length': upload.length,
+            'expiresAt': upload.expires_at.isoformat()
+        }), 200, upload_session_headers(upload)
+
+    except Exception as e:
+        print(f"Get upload offset error: {e}")
+        return jsonify({'error': 'Failed to get upload'}), 500
+
+
+@app.route('/image/uploads/<upload_id>', methods=['PATCH'])
+@jwt_required()
+def upload_chunk(upload_id):
+    try:
+        upload = get_upload_session(upload_id, int(get_jwt_identity()))
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return jsonify({'error': 'Upload-Offset header required'}), 400
+
+        if offset != upload.received:
+            return jsonify({
+                'error': 'Offset mismatch',
+                'offset': upload.received
+            }), 409, upload_session_headers(upload)
+
+        # Stream the chunk into place without buffering it in memory
+        remaining = upload.length - offset
+        written = 0
+        with open(os.path.join(UPLOAD_FOLDER, upload.filename), 'r+b') as f:
+            f.seek(offset)
+            while written < remaining:
+                chunk = request.stream.read(min(64 * 1024, remaining - written))
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+
+        # Advance only from the offset we wrote at, so a concurrent retry of
+        # the same chunk cannot move the offset twice
+        advanced = db.session.execute(
+            db.update(UploadSession)
+            .where(UploadSession.id == upload.id,
+                   UploadSession.received == offset)
+            .values(received=offset + written,
+                    expires_at=datetime.utcnow() + timedelta(
+                        minutes=app.config['UPLOAD_SESSION_TTL_MINUTES']))
+            .execution_options(synchronize_session='fetch')
+        ).rowcount
+        db.session.commit()
+
+        if not advanced:
+            db.session.refresh(upload)
+            return jsonify({
+                'error': 'Offset mismatch',
+                'offset': upload.received
+            }), 409, upload_session_headers(upload)
+
+        return '', 204, upload_session_headers(upload)
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Upload chunk error: {e}")
+        return jsonify({'error': 'Failed to store chunk'}), 500
+
+
+@app.route('/image/uploads/<upload_id>/finalize', methods=['POST'])
+@jwt_required()
+def finalize_upload(upload_id):
+    try:
+        current_user_id = int(get_jwt_identity())
+        current_user = User.query.get(current_user_id)
+
+        # The session is gone once finalized; a retry gets the same image
+        finalize_key = f"upload:{upload_id}"
+        upload = get_upload_session(upload_id, current_user_id)
+        if not upload:
+            previous = replay(current_user_id, finalize_key, 'image.finalize')
+            if previous:
+                return previous
+            return jsonify({'error': 'Upload not found'}), 404
+
+        if upload.received < upload.length:
+            return jsonify({
+                'error': 'Upload incomplete',
+                'offset': upload.received
+            }), 409, upload_session_headers(upload)
+
+        if not current_user.current_pair_id:
+            return jsonify({'error': 'Not paired with anyone'}), 400
+
+        recipient_id = current_user.current_pair_id
+        pending, last_expires_at = lock_queues([recipient_id])[recipient_id]
+        error = queue_full_error(pending, 1)
+        if error:
+            db.session.rollback()
+            return error
+
+        # The bytes are already on disk: move them into a new blob, or
+        # drop them if the same content is stored already
+        session_path = os.path.join(UPLOAD_FOLDER, upload.filename)
+        with open(session_path, 'rb') as f:
+            content_hash, size = hash_stream(f)
+        extension = os.path.splitext(upload.filename)[1].lower()
+        filename, preview, created = acquire_blob(
+            content_hash, size, extension,
+            lambda file_path: os.replace(session_path, file_path))
+
+        now = datetime.utcnow()
+        image = Image(
+            filename=filename,
+            content_hash=content_hash,
+            preview=preview,
+            sender_id=current_user_id,
+            recipient_id=recipient_id,
+            sent_at=now,
+            expires_at=queue_deadlines(last_expires_at, 1, now)[0]
+        )
+        db.session.add(image)
+        db.session.delete(upload)
+        if not created:
+            queue_file_removal([upload.filename])
+        try:
+            db.session.flush()
+            payload = remember_response(current_user_id, finalize_key,
+                                        'image.finalize',
+                                        image_upload_payload(image))
+            db.session.commit()
+        except Exception:
+            if created:
+                # Put the bytes back so the session can be finalized again
+                os.replace(os.path.join(UPLOAD_FOLDER, filename), session_path)
+            raise
+
+        mark_written(current_user_id, current_user.current_pair_id)
+        backplane.publish('image.new', [current_user.current_pair_id],
+                          imageId=image.id, senderId=current_user_id)
+
+        return jsonify(payload), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Finalize upload error: {e}")
+        return jsonify({'error': 'Upload failed'}), 500
+
+
+@app.route('/image/uploads/<upload_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_upload(upload_id):
+    try:
+        upload = get_upload_session(upload_id, int(get_jwt_identity()))
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        queue_file_removal([upload.filename])
+        db.session.delete(upload)
+        db.session.commit()
+        return '', 204
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Cancel upload error: {e}")
+        return jsonify({'error': 'Failed to cancel upload'}), 500
+
+
+@app.route('/image/inbox', methods=['GET'])
+@jwt_required()
+@read_only
+def list_inbox():
+    """Cursor-paginated queue of pending images, oldest first"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        limit = page_limit(request.args.get('limit'))
+
+        query = pending_images(current_user_id).with_entities(
+            Image.id, Image.sender_id, Image.sent_at, Image.expires_at,
+            Image.room_id)
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                sent_at, image_id = decode_cursor(cursor)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.filter(
+                db.tuple_(Image.sent_at, Image.id) > (sent_at, image_id))
+
+        rows = query.limit(limit + 1).all()
+        now = datetime.utcnow()
+        images = [{
+            'imageId': image_id,
+            'senderId': sender_id,
+            'sentAt': sent_at.isoformat(),
+            'timeLeft': max(0, (expires_at - now).total_seconds()),
+            'roomId': room_id
+        } for image_id, sender_id, sent_at, expires_at, room_id
+            in rows[:limit]]
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last.sent_at, last.id)
+
+        return jsonify({'images': images, 'nextCursor': next_cursor}), 200
+
+    except Exception as e:
+        print(f"Inbox error: {e}")
+        return jsonify({'error': 'Failed to list inbox'}), 500
+
 
 @app.route('/image/check', methods=['GET'])
 @jwt_required()
+@read_only
+@flights.view('check')
 def check_new_image():
     try:
-        cleanup_expired_images()
-
         # FIXED: Convert JWT identity back to int
         current_user_id = int(get_jwt_identity())
 
-        # Check for new images for the current user
-        new_image = Image.query.filter_by(
-            recipient_id=current_user_id).order_by(Image.sent_at.desc()).first()
+        # Oldest pending image first, so queued images are shown in order
+        new_image = fetch_pending_image(current_user_id)
 
         if new_image:
-            # Check if image is still valid (not older than 30 seconds)
-            time_diff = (datetime.utcnow() - new_image.sent_at).total_seconds()
-            if time_diff > 30:
+            # Check if image is still valid (its window has not ended)
+            time_left = (new_image.expires_at
+                         - datetime.utcnow()).total_seconds()
+            if time_left < 0:
                 # Image expired, delete it
-                try:
-                    file_path = os.path.join(UPLOAD_FOLDER, new_image.filename)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except:
-                    pass
-                db.session.delete(new_image)
+                release_image_files([new_image])
+                db.session.execute(
+                    db.delete(Image).where(Image.id == new_image.id))
                 db.session.commit()
-                return jsonify({'hasNewImage': False})
+                return {'hasNewImage': False}
 
-            return jsonify({
+            return {
                 'hasNewImage': True,
                 'imageId': new_image.id,
                 'senderId': new_image.sender_id,
-                'sentAt': new_image.sent_at.isoformat()
-            })
+                'sentAt': new_image.sent_at.isoformat(),
+                'timeLeft': time_left,
+                'preview': new_image.preview,
+                'roomId': new_image.room_id
+            }
 
-        return jsonify({'hasNewImage': False})
+        return {'hasNewImage': False}
 
     except Exception as e:
         print(f"Check new image error: {e}")
-        return jsonify({'hasNewImage': False})
+        return {'hasNewImage': False}
 
 
 @app.route('/image/info/<int:image_id>', methods=['GET'])
 @jwt_required()
+@read_only
+@flights.view('image_info')
 def get_image_info(image_id):
     try:
-        cleanup_expired_images()
-
         # FIXED: Convert JWT identity back to int
         current_user_id = int(get_jwt_identity())
 
-        image = Image.query.filter_by(
-            id=image_id, recipient_id=current_user_id).first()
+        image = fetch_received_image(image_id, current_user_id)
         if not image:
-            return jsonify({'error': 'Image not found'}), 404
+            return {'error': 'Image not found'}, 404
 
         # Calculate remaining time
-        time_diff = (datetime.utcnow() - image.sent_at).total_seconds()
-        time_left = max(0, 30 - time_diff)
+        time_left = max(
+            0, (image.expires_at - datetime.utcnow()).total_seconds())
 
         if time_left <= 0:
             # Image expired, delete it
-            try:
-                file_path = os.path.join(UPLOAD_FOLDER, image.filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except:
-                pass
-            db.session.delete(image)
+            release_image_files([image])
+            db.session.execute(db.delete(Image).where(Image.id == image.id))
             db.session.commit()
-            return jsonify({'error': 'Image expired'}), 404
+            return {'error': 'Image expired'}, 404
 
-        return jsonify({
+        return {
             'image': {
                 'id': image.id,
                 'sent_at': image.sent_at.isoformat()
             },
             'timeLeft': time_left
-        })
+        }
 
     except Exception as e:
         print(f"Get image info error: {e}")
-        return jsonify({'error': 'Failed to get image info'}), 500
+        return {'error': 'Failed to get image info'}, 500
 
 
 @app.route('/image/view/<int:image_id>', methods=['GET'])
@@ -503,17 +2328,44 @@ def view_image(image_id):
         # FIXED: Convert JWT identity back to int
         current_user_id = int(get_jwt_identity())
 
-        image = Image.query.filter_by(
-            id=image_id, recipient_id=current_user_id).first()
-        if not image:
-            return jsonify({'error': 'Image not found'}), 404
+        # Claim the view in one autocommitted UPDATE, checking the 30 second
+        # window against the DB clock; only the first viewer gets a row back
+        claimed = execute_autocommit(
+            db.engine,
+            db.update(Image)
+            .where(Image.id == image_id,
+                   Image.recipient_id == current_user_id,
+                   Image.viewed_at.is_(None),
+                   Image.expires_at >= utcnow())
+            .values(viewed_at=utcnow())
+            .returning(Image.filename, Image.expires_at)
+        )
 
-        # Check if expired
-        time_diff = (datetime.utcnow() - image.sent_at).total_seconds()
-        if time_diff > 30:
+        if not claimed:
+            image = Image.query.filter_by(
+                id=image_id, recipient_id=current_user_id).first()
+            if not image:
+                return jsonify({'error': 'Image not found'}), 404
+            if image.viewed_at:
+                return jsonify({'error': 'Image already viewed'}), 404
             return jsonify({'error': 'Image expired'}), 404
 
-        file_path = os.path.join(UPLOAD_FOLDER, image.filename)
+        mark_written(current_user_id)
+        try:
+            advance_queue(current_user_id, claimed[0].expires_at)
+        except Exception as e:
+            # The view is claimed already; the queue just moves on later
+            db.session.rollback()
+            print(f"Advance queue error: {e}")
+        filename = claimed[0].filename
+        handed_off = handoff.take(image_id)
+        if handed_off is not None and handed_off[1]['filename'] == filename:
+            return app.response_class(
+                handed_off[0],
+                mimetype=mimetypes.guess_type(filename)[0]
+                or 'application/octet-stream')
+
+        file_path = os.path.join(UPLOAD_FOLDER, filename)
         if not os.path.exists(file_path):
             return jsonify({'error': 'Image file not found'}), 404
 
@@ -524,17 +2376,138 @@ def view_image(image_id):
         return jsonify({'error': 'Failed to view image'}), 500
 
 
+@app.route('/sync', methods=['GET'])
+@jwt_required()
+@read_only
+def sync():
+    """Pair status, pending image and its timer in a single round trip"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        now = datetime.utcnow()
+
+        # One joined query: the user, their partner and the oldest live
+        # image, the head of their queue
+        partner = db.aliased(User)
+        row = db.session.query(
+            User.current_pair_id,
+            User.current_pair_code,
+            partner.username,
+            Image.id,
+            Image.sender_id,
+            Image.sent_at,
+            Image.expires_at,
+            Image.preview,
+            Image.room_id
+        ).outerjoin(
+            partner, partner.id == User.current_pair_id
+        ).outerjoin(
+            Image, db.and_(Image.recipient_id == User.id,
+                           Image.expires_at >= now,
+                           Image.viewed_at.is_(None))
+        ).filter(
+            User.id == current_user_id
+        ).order_by(Image.sent_at, Image.id).first()
+
+        if not row:
+            return jsonify({'error': 'User not found'}), 404
+
+        (pair_id, pair_code, paired_with,
+         image_id, sender_id, sent_at, expires_at, preview, room_id) = row
+
+        result = {
+            'isPaired': bool(pair_id),
+            'pairedWith': paired_with if pair_id else None,
+            'pairCode': pair_code,
+            'hasNewImage': image_id is not None
+        }
+
+        if image_id is not None:
+            result.update({
+                'imageId': image_id,
+                'senderId': sender_id,
+                'sentAt': sent_at.isoformat(),
+                'timeLeft': max(0, (expires_at - now).total_seconds()),
+                'preview': preview,
+                'roomId': room_id
+            })
+
+        return jsonify(result), 200
+
+    except Exception as e:
+        print(f"Sync error: {e}")
+        return jsonify({'error': 'Sync failed'}), 500
+
+
+def upgrade_schema():
+    """Add columns and indexes introduced after the initial release"""
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name']
+                    for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+
+            ddl = (f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                   f"{column.type.compile(db.engine.dialect)}")
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            for foreign_key in column.foreign_keys:
+                # Both PostgreSQL and SQLite accept a nullable column's
+                # REFERENCES clause in ADD COLUMN
+                ddl += (f" REFERENCES {foreign_key.column.table.name} "
+                        f"({foreign_key.column.name})")
+                if foreign_key.ondelete:
+                    ddl += f" ON DELETE {foreign_key.ondelete}"
+            db.session.execute(db.text(ddl))
+            print(f"➕ Added column {table.name}.{column.name}")
+
+        existing_indexes = {index['name']
+                            for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.session.connection())
+                print(f"➕ Added index {index.name}")
+
+    db.session.commit()
+
+
+def backfill_image_expiry():
+    """Give images stored before expires_at existed their 30 second window"""
+    live = Image.query.filter(
+        Image.expires_at.is_(None),
+        Image.sent_at >= datetime.utcnow() - VIEW_WINDOW).all()
+    for image in live:
+        image.expires_at = image.sent_at + VIEW_WINDOW
+    # Everything older has expired already; cleanup removes it
+    db.session.execute(
+        db.update(Image).where(Image.expires_at.is_(None))
+        .values(expires_at=Image.sent_at)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+
+
 def init_db():
     """Initialize database tables"""
     try:
         with app.app_context():
             # Try to create tables
             db.create_all()
+            upgrade_schema()
+            backfill_image_expiry()
+
+            # Local replica testing: give a SQLite replica the same schema
+            replica = db.engines.get(REPLICA_BIND)
+            if replica is not None and replica.dialect.name == 'sqlite':
+                db.metadata.create_all(bind=replica)
             print("✅ Database tables created successfully!")
 
             # Test with a simple query
             try:
-                db.session.execute('SELECT 1')
+                db.session.execute(db.text('SELECT 1'))
                 print("✅ Database connection test successful!")
             except Exception as e:
                 print(f"⚠️  Database connection test failed: {e}")
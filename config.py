@@ -1,11 +1,31 @@
 import os
 from datetime import timedelta
+from utils.admin import parse_admin_ids
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///flashpair.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    if os.environ.get('DATABASE_REPLICA_URL'):
+        SQLALCHEMY_BINDS = {'replica': os.environ['DATABASE_REPLICA_URL']}
+    REPLICA_STALENESS_SECONDS = float(os.environ.get('REPLICA_STALENESS_SECONDS', 5))
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-change-in-production'
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
+    # Short-lived access tokens, renewed with rotating refresh tokens
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=int(os.environ.get('JWT_ACCESS_TOKEN_MINUTES', 15)))
+    REFRESH_TOKEN_DAYS = int(os.environ.get('REFRESH_TOKEN_DAYS', 30))
+    ADMIN_USER_IDS = parse_admin_ids(os.environ.get('ADMIN_USER_IDS'))  # comma separated
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    IMAGE_QUEUE_DEPTH = int(os.environ.get('IMAGE_QUEUE_DEPTH', 10))  # pending images per pair
+    # Identical concurrent polls by one user share one computation and its
+    # result for SINGLE_FLIGHT_TTL seconds; a poll waits for it at most
+    # SINGLE_FLIGHT_TIMEOUT seconds before running its own
+    SINGLE_FLIGHT_TTL = float(os.environ.get('SINGLE_FLIGHT_TTL', 0.25))
+    SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 5))
+    # Retention (utils/retention.py): finished images and inactive pairs are
+    # purged, or archived, this many days after they stop being used
+    RETENTION_IMAGE_DAYS = int(os.environ.get('RETENTION_IMAGE_DAYS', 7))
+    RETENTION_PAIR_DAYS = int(os.environ.get('RETENTION_PAIR_DAYS', 30))
+    RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 1000))
+    RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 300))  # seconds, 0 disables
+    RETENTION_ARCHIVE = os.environ.get('RETENTION_ARCHIVE', 'false').lower() == 'true'
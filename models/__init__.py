@@ -1,5 +1,6 @@
 from .user import User
 from .pair import Pair
 from .image import Image
+from .refresh_token import RefreshToken
 
-__all__ = ['User', 'Pair', 'Image']
+__all__ = ['User', 'Pair', 'Image', 'RefreshToken']
@@ -1,8 +1,16 @@
 from database import db
+from utils.serializers import RowSerializer
 from datetime import datetime, timedelta
 import uuid
 
 class Image(db.Model):
+    __table_args__ = (
+        db.Index('ix_image_receiver_status_sent', 'receiver_id', 'status', 'sent_at'),
+        db.Index('ix_image_pair_status', 'pair_id', 'status'),
+        db.Index('ix_image_status_expires', 'status', 'expires_at'),
+        db.Index('ix_image_status_sent', 'status', 'sent_at'),
+    )
+    
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     pair_id = db.Column(db.String(36), nullable=False)
     sender_id = db.Column(db.String(36), nullable=False)
@@ -10,9 +18,13 @@ class Image(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     status = db.Column(db.String(20), default='sent')
-    sent_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Part of the table's primary key, so that it can be range-partitioned
+    # by month (utils/retention.py); rows are still identified by id alone
+    sent_at = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
     viewed_at = db.Column(db.DateTime, nullable=True)
     expires_at = db.Column(db.DateTime, nullable=True)
+
+    __mapper_args__ = {'primary_key': [id]}
     
     def mark_as_viewed(self):
         self.viewed_at = datetime.utcnow()
@@ -24,13 +36,17 @@ class Image(db.Model):
         return self.expires_at and datetime.utcnow() > self.expires_at
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'pairId': self.pair_id,
-            'senderId': self.sender_id,
-            'receiverId': self.receiver_id,
-            'status': self.status,
-            'sentAt': self.sent_at.isoformat(),
-            'viewedAt': self.viewed_at.isoformat() if self.viewed_at else None,
-            'expiresAt': self.expires_at.isoformat() if self.expires_at else None
-        }
+        return IMAGE_ROW.from_object(self)
+
+
+# Public fields, also used to serialize column-only selects
+IMAGE_ROW = RowSerializer(
+    id=Image.id,
+    pairId=Image.pair_id,
+    senderId=Image.sender_id,
+    receiverId=Image.receiver_id,
+    status=Image.status,
+    sentAt=Image.sent_at,
+    viewedAt=Image.viewed_at,
+    expiresAt=Image.expires_at
+)
@@ -1,8 +1,17 @@
 from database import db
+from utils.serializers import RowSerializer
 from datetime import datetime
 import uuid
 
 class Pair(db.Model):
+    __table_args__ = (
+        db.Index('ix_pair_status_activity', 'status', 'last_activity'),
+        db.Index('ix_pair_created', 'created_at', 'id'),
+        db.Index('ix_pair_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_pair_user1_created', 'user1_id', 'created_at', 'id'),
+        db.Index('ix_pair_user2_created', 'user2_id', 'created_at', 'id'),
+    )
+    
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user1_id = db.Column(db.String(36), nullable=False)
     user2_id = db.Column(db.String(36), nullable=False)
@@ -14,11 +23,15 @@ class Pair(db.Model):
         return self.user2_id if self.user1_id == user_id else self.user1_id
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'user1Id': self.user1_id,
-            'user2Id': self.user2_id,
-            'status': self.status,
-            'createdAt': self.created_at.isoformat(),
-            'lastActivity': self.last_activity.isoformat()
-        }
+        return PAIR_ROW.from_object(self)
+
+
+# Public fields, also used to serialize column-only selects
+PAIR_ROW = RowSerializer(
+    id=Pair.id,
+    user1Id=Pair.user1_id,
+    user2Id=Pair.user2_id,
+    status=Pair.status,
+    createdAt=Pair.created_at,
+    lastActivity=Pair.last_activity
+)
@@ -0,0 +1,15 @@
+from database import db
+from datetime import datetime
+
+class RefreshToken(db.Model):
+    """Refresh token digest, see utils/refresh_tokens.py"""
+    __tablename__ = 'refresh_token'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.String(36), nullable=False, index=True)
+    # Every token descends from one login; reuse revokes the whole family
+    family_id = db.Column(db.String(32), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    used_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,4 +1,5 @@
 from database import db
+from utils.serializers import RowSerializer
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import uuid
@@ -11,7 +12,7 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_verified = db.Column(db.Boolean, default=True)
     current_pair_id = db.Column(db.String(36), nullable=True)
-    pairing_code = db.Column(db.String(6), nullable=True)
+    pairing_code = db.Column(db.String(6), nullable=True, index=True)
     pairing_code_expiry = db.Column(db.DateTime, nullable=True)
     
     def set_password(self, password):
@@ -21,9 +22,13 @@ class User(db.Model):
         return check_password_hash(self.password_hash, password)
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'currentPairId': self.current_pair_id
-        }
+        return USER_ROW.from_object(self)
+
+
+# Public fields, also used to serialize column-only selects
+USER_ROW = RowSerializer(
+    id=User.id,
+    username=User.username,
+    email=User.email,
+    currentPairId=User.current_pair_id
+)
@@ -1,11 +1,22 @@
 from database import db
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from models.user import User
+from models.refresh_token import RefreshToken
+from utils.refresh_tokens import RefreshTokens
+from utils.replicas import mark_written
+from datetime import timedelta
 import re
 
 auth_bp = Blueprint('auth', __name__)
 
+
+def refresh_tokens():
+    return RefreshTokens(
+        db, RefreshToken, current_app.config['JWT_SECRET_KEY'],
+        ttl=timedelta(days=current_app.config.get('REFRESH_TOKEN_DAYS', 30)))
+
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -32,12 +43,16 @@ def register():
         
         db.session.add(user)
         db.session.commit()
+        mark_written(user.id)
         
         access_token = create_access_token(identity=user.id)
+        refresh_token = refresh_tokens().issue(user.id)
+        db.session.commit()
         
         return jsonify({
             'message': 'User registered successfully',
             'token': access_token,
+            'refreshToken': refresh_token,
             'user': user.to_dict()
         }), 201
         
@@ -58,14 +73,59 @@ def login():
             return jsonify({'error': 'Invalid credentials'}), 401
         
         access_token = create_access_token(identity=user.id)
+        refresh_token = refresh_tokens().issue(user.id)
+        db.session.commit()
         
         return jsonify({
             'message': 'Login successful',
             'token': access_token,
+            'refreshToken': refresh_token,
             'user': user.to_dict()
         }), 200
         
     except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh():
+    """New access and refresh token for a refresh token; one HMAC and one
+    indexed UPDATE, no password hash"""
+    try:
+        data = request.get_json(silent=True)
+        
+        if not data or not data.get('refreshToken'):
+            return jsonify({'error': 'Refresh token required'}), 400
+        
+        try:
+            user_id, refresh_token = refresh_tokens().rotate(str(data['refreshToken']))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 401
+        
+        return jsonify({
+            'token': create_access_token(identity=user_id),
+            'refreshToken': refresh_token
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@auth_bp.route('/logout', methods=['POST'])
+def logout():
+    try:
+        data = request.get_json(silent=True)
+        
+        if not data or not data.get('refreshToken'):
+            return jsonify({'error': 'Refresh token required'}), 400
+        
+        refresh_tokens().revoke(str(data['refreshToken']))
+        db.session.commit()
+        
+        return jsonify({'message': 'Logged out'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/profile', methods=['GET'])
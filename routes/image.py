@@ -3,24 +3,82 @@ from flask import Blueprint, request, jsonify, send_file, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.user import User
 from models.pair import Pair
-from models.image import Image
+from models.image import Image, IMAGE_ROW
 from utils.database import cleanup_expired_images
+from utils.pagination import decode_cursor, encode_cursor, page_limit
+from utils.replicas import mark_written, read_only
+from utils.retention import retention
+from utils.serializers import RowSerializer
+from utils.singleflight import flights
+from utils.sql import execute_autocommit, lock_rows, utcnow
 from werkzeug.utils import secure_filename
 import os
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_, update
 from PIL import Image as PILImage
 
 image_bp = Blueprint('image', __name__)  # THIS LINE WAS MISSING!
+# Keep the image and pair tables bounded wherever these routes are served
+image_bp.record_once(lambda state: retention.init_app(state.app))
+image_bp.record_once(lambda state: flights.init_app(state.app))
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+INBOX_ROW = RowSerializer(
+    imageId=Image.id,
+    senderId=Image.sender_id,
+    sentAt=Image.sent_at
+)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_image(file, pair, user_id, other_user_id, sent_at):
+    """Store one uploaded file and stage its Image row"""
+    file_extension = file.filename.rsplit('.', 1)[1].lower()
+    unique_filename = f"{uuid.uuid4()}.{file_extension}"
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+    
+    # Save file without PIL processing to avoid the PIL error
+    file.save(file_path)
+    
+    image = Image(
+        pair_id=pair.id,
+        sender_id=user_id,
+        receiver_id=other_user_id,
+        filename=secure_filename(file.filename),
+        file_path=file_path,
+        sent_at=sent_at
+    )
+    db.session.add(image)
+    return image
+
+def queue_full_error(pair, incoming):
+    """Reject uploads that would push the pair's queue past its depth.
+
+    Locks the pair row until commit, so concurrent uploads to one pair take
+    turns and the count and the insert that follows are atomic.
+    """
+    depth = current_app.config['IMAGE_QUEUE_DEPTH']
+    lock_rows(db.session, Pair.id, [pair.id])
+    pending = Image.query.filter_by(pair_id=pair.id, status='sent').count()
+    if pending + incoming > depth:
+        db.session.rollback()
+        return jsonify({'error': f'Image queue full ({pending} of {depth} pending)'}), 400
+    return None
+
+def discard_files(images):
+    for image in images:
+        try:
+            os.remove(image.file_path)
+        except OSError:
+            pass
+
 @image_bp.route('/upload', methods=['POST'])
 @jwt_required()
 def upload_image():
+    images = []
     try:
         user_id = get_jwt_identity()
         user = User.query.get(user_id)
@@ -42,37 +100,105 @@ def upload_image():
         other_user_id = pair.get_other_user_id(user_id)
         other_user = User.query.get(other_user_id)
         
-        existing_image = Image.query.filter_by(
-            pair_id=pair.id,
-            status='sent'
-        ).first()
+        error = queue_full_error(pair, 1)
+        if error:
+            return error
         
-        if existing_image:
-            return jsonify({'error': 'Previous image still pending. Only one image at a time.'}), 400
+        image = save_image(file, pair, user_id, other_user_id, datetime.utcnow())
+        images.append(image)
+        pair.last_activity = datetime.utcnow()
+        db.session.commit()
+        mark_written(user_id, other_user_id)
         
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+        return jsonify({
+            'imageId': image.id,
+            'sentTo': other_user.username,
+            'message': 'Image sent successfully'
+        }), 200
         
-        # Save file without PIL processing to avoid the PIL error
-        file.save(file_path)
+    except Exception as e:
+        db.session.rollback()
+        discard_files(images)
+        return jsonify({'error': str(e)}), 500
+
+@image_bp.route('/upload/batch', methods=['POST'])
+@jwt_required()
+def upload_images():
+    images = []
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
         
-        image = Image(
-            pair_id=pair.id,
-            sender_id=user_id,
-            receiver_id=other_user_id,
-            filename=secure_filename(file.filename),
-            file_path=file_path
-        )
+        if not user or not user.current_pair_id:
+            return jsonify({'error': 'Not paired with anyone'}), 400
         
-        db.session.add(image)
-        pair.last_activity = datetime.utcnow()
+        files = [f for f in request.files.getlist('images') if f.filename]
+        if not files:
+            return jsonify({'error': 'No image files provided'}), 400
+        
+        if not all(allowed_file(f.filename) for f in files):
+            return jsonify({'error': 'Invalid file type'}), 400
+        
+        pair = Pair.query.get(user.current_pair_id)
+        other_user_id = pair.get_other_user_id(user_id)
+        other_user = User.query.get(other_user_id)
+        
+        error = queue_full_error(pair, len(files))
+        if error:
+            return error
+        
+        # Consecutive timestamps keep the batch in upload order
+        sent_at = datetime.utcnow()
+        for offset, file in enumerate(files):
+            images.append(save_image(file, pair, user_id, other_user_id,
+                                     sent_at + timedelta(microseconds=offset)))
+        
+        pair.last_activity = sent_at
         db.session.commit()
+        mark_written(user_id, other_user_id)
         
         return jsonify({
-            'imageId': image.id,
+            'imageIds': [image.id for image in images],
             'sentTo': other_user.username,
-            'message': 'Image sent successfully'
+            'message': f'{len(images)} images sent successfully'
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        discard_files(images)
+        return jsonify({'error': str(e)}), 500
+
+@image_bp.route('/inbox', methods=['GET'])
+@jwt_required()
+@read_only
+def list_inbox():
+    try:
+        user_id = get_jwt_identity()
+        limit = page_limit(request.args.get('limit'))
+        
+        query = INBOX_ROW.select().where(
+            Image.receiver_id == user_id,
+            Image.status == 'sent'
+        )
+        
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                sent_at, image_id = decode_cursor(cursor)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.where(tuple_(Image.sent_at, Image.id) > (sent_at, image_id))
+        
+        rows = db.session.execute(
+            query.order_by(Image.sent_at, Image.id).limit(limit + 1)).all()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(rows[limit - 1].sent_at, rows[limit - 1].id)
+        
+        return jsonify({
+            'images': INBOX_ROW.many(rows[:limit]),
+            'nextCursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -81,33 +207,36 @@ def upload_image():
 # Add all your other route functions here...
 @image_bp.route('/check', methods=['GET'])
 @jwt_required()
+@read_only
+@flights.view('check')
 def check_new_image():
     try:
         user_id = get_jwt_identity()
         user = User.query.get(user_id)
         
         if not user or not user.current_pair_id:
-            return jsonify({'hasNewImage': False}), 200
+            return {'hasNewImage': False}, 200
         
         cleanup_expired_images()
         
+        # Oldest queued image first
         new_image = Image.query.filter_by(
             receiver_id=user_id,
             status='sent'
-        ).first()
+        ).order_by(Image.sent_at, Image.id).first()
         
         if new_image:
-            return jsonify({
+            return {
                 'hasNewImage': True,
                 'imageId': new_image.id,
                 'senderId': new_image.sender_id,
                 'sentAt': new_image.sent_at.isoformat()
-            }), 200
+            }, 200
         
-        return jsonify({'hasNewImage': False}), 200
+        return {'hasNewImage': False}, 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
 @image_bp.route('/view/<image_id>', methods=['GET'])
 @jwt_required()
@@ -115,44 +244,63 @@ def view_image(image_id):
     try:
         user_id = get_jwt_identity()
         
-        image = Image.query.get(image_id)
-        if not image:
-            return jsonify({'error': 'Image not found'}), 404
-        
-        if image.receiver_id != user_id:
-            return jsonify({'error': 'Unauthorized'}), 403
+        # Claim the view and start the 30 second timer from the DB clock in
+        # one autocommitted UPDATE; only the first viewer gets a row back
+        claimed = execute_autocommit(
+            db.engine,
+            update(Image)
+            .where(Image.id == image_id,
+                   Image.receiver_id == user_id,
+                   Image.status == 'sent')
+            .values(status='viewed',
+                    viewed_at=utcnow(),
+                    expires_at=utcnow(30))
+            .returning(Image.file_path)
+        )
         
-        if image.is_expired():
+        if not claimed:
+            image = Image.query.get(image_id)
+            if not image:
+                return jsonify({'error': 'Image not found'}), 404
+            
+            if image.receiver_id != user_id:
+                return jsonify({'error': 'Unauthorized'}), 403
+            
+            if image.status == 'viewed' and not image.is_expired():
+                return jsonify({'error': 'Image already viewed'}), 410
+            
             return jsonify({'error': 'Image has expired'}), 410
         
-        if image.status == 'sent':
-            image.mark_as_viewed()
-        
-        if not os.path.exists(image.file_path):
+        mark_written(user_id)
+        file_path = claimed[0].file_path
+        if not os.path.exists(file_path):
             return jsonify({'error': 'Image file not found'}), 404
         
-        return send_file(image.file_path), 200
+        return send_file(file_path), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @image_bp.route('/info/<image_id>', methods=['GET'])
 @jwt_required()
+@read_only
+@flights.view('image_info')
 def get_image_info(image_id):
     try:
         user_id = get_jwt_identity()
         
-        image = Image.query.get(image_id)
+        image = db.session.execute(
+            IMAGE_ROW.select().where(Image.id == image_id)).first()
         if not image:
-            return jsonify({'error': 'Image not found'}), 404
+            return {'error': 'Image not found'}, 404
         
         if image.receiver_id != user_id and image.sender_id != user_id:
-            return jsonify({'error': 'Unauthorized'}), 403
+            return {'error': 'Unauthorized'}, 403
         
-        return jsonify({
-            'image': image.to_dict(),
+        return {
+            'image': IMAGE_ROW(image),
             'timeLeft': max(0, int((image.expires_at - datetime.utcnow()).total_seconds())) if image.expires_at else None
-        }), 200
+        }, 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
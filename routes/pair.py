@@ -1,12 +1,20 @@
 from database import db
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.user import User
-from models.pair import Pair
+from models.pair import Pair, PAIR_ROW
+from utils.admin import admin_required
 from utils.database import generate_pairing_code
+from utils.fastjson import dumps_bytes
+from utils.pagination import decode_cursor, encode_cursor, page_limit
+from utils.replicas import mark_written, read_only
+from utils.singleflight import flights
 from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, select, tuple_, update
+import uuid
 
 pair_bp = Blueprint('pair', __name__)
+pair_bp.record_once(lambda state: flights.init_app(state.app))
 
 @pair_bp.route('/generate', methods=['POST'])
 @jwt_required()
@@ -26,6 +34,7 @@ def generate_code():
         user.pairing_code_expiry = datetime.utcnow() + timedelta(minutes=10)
         
         db.session.commit()
+        mark_written(user_id)
         
         return jsonify({
             'pairingCode': pairing_code,
@@ -41,51 +50,50 @@ def generate_code():
 def connect():
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
         data = request.get_json()
         
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
         if not data or not data.get('pairingCode'):
             return jsonify({'error': 'Pairing code required'}), 400
         
-        if user.current_pair_id:
-            return jsonify({'error': 'Already paired with someone'}), 400
-        
         pairing_code = data['pairingCode']
-        target_user = User.query.filter_by(pairing_code=pairing_code).first()
-        
-        if not target_user:
-            return jsonify({'error': 'Invalid pairing code'}), 400
+        pair_id = str(uuid.uuid4())
         
-        if target_user.pairing_code_expiry < datetime.utcnow():
-            return jsonify({'error': 'Pairing code expired'}), 400
+        # Claim the caller and the code owner in one conditional UPDATE;
+        # both rows must still be unpaired, so concurrent redeemers of the
+        # same code cannot both win
+        claimed = db.session.execute(
+            update(User)
+            .where(or_(
+                and_(User.id == user_id,
+                     User.current_pair_id.is_(None)),
+                and_(User.pairing_code == pairing_code,
+                     User.pairing_code_expiry >= datetime.utcnow(),
+                     User.current_pair_id.is_(None),
+                     User.id != user_id)))
+            .values(current_pair_id=pair_id,
+                    pairing_code=None,
+                    pairing_code_expiry=None)
+            .returning(User.id, User.username)
+            .execution_options(synchronize_session=False)
+        ).all()
         
-        if target_user.current_pair_id:
-            return jsonify({'error': 'User already paired with someone else'}), 400
+        targets = [row for row in claimed if row.id != user_id]
+        if len(claimed) != 2 or len(targets) != 1:
+            db.session.rollback()
+            return pairing_error(user_id, pairing_code)
         
-        if target_user.id == user_id:
-            return jsonify({'error': 'Cannot pair with yourself'}), 400
-        
-        # Create pair
+        target_user = targets[0]
         pair = Pair(
+            id=pair_id,
             user1_id=user_id,
             user2_id=target_user.id
         )
         db.session.add(pair)
-        db.session.flush()  # This ensures pair.id is available
-        
-        # Update both users
-        user.current_pair_id = pair.id
-        target_user.current_pair_id = pair.id
-        target_user.pairing_code = None
-        target_user.pairing_code_expiry = None
-        
         db.session.commit()
+        mark_written(user_id, target_user.id)
         
         return jsonify({
-            'pairId': pair.id,
+            'pairId': pair_id,
             'pairedWith': target_user.username,
             'message': f'Successfully paired with {target_user.username}'
         }), 200
@@ -95,84 +103,168 @@ def connect():
         return jsonify({'error': str(e)}), 500
 
 
+def pairing_error(user_id, pairing_code):
+    """Explain why a pairing claim matched nothing (failure path only)"""
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    if user.current_pair_id:
+        return jsonify({'error': 'Already paired with someone'}), 400
+    
+    target_user = User.query.filter_by(pairing_code=pairing_code).first()
+    
+    if not target_user:
+        return jsonify({'error': 'Invalid pairing code'}), 400
+    
+    if target_user.pairing_code_expiry < datetime.utcnow():
+        return jsonify({'error': 'Pairing code expired'}), 400
+    
+    if target_user.current_pair_id:
+        return jsonify({'error': 'User already paired with someone else'}), 400
+    
+    if target_user.id == user_id:
+        return jsonify({'error': 'Cannot pair with yourself'}), 400
+    
+    return jsonify({'error': 'Invalid pairing code'}), 400
+
+
 
 @pair_bp.route('/disconnect', methods=['DELETE'])
 @jwt_required()
 def disconnect():
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
         
-        if not user or not user.current_pair_id:
-            return jsonify({'error': 'Not currently paired'}), 400
+        # Deactivate the caller's pair and release both members: two
+        # statements, whatever the state of the rows
+        current_pair_id = select(User.current_pair_id).where(
+            User.id == user_id).scalar_subquery()
+        pair = db.session.execute(
+            update(Pair)
+            .where(Pair.id == current_pair_id)
+            .values(status='inactive', last_activity=datetime.utcnow())
+            .returning(Pair.id, Pair.user1_id, Pair.user2_id)
+            .execution_options(synchronize_session=False)
+        ).first()
         
-        pair = Pair.query.get(user.current_pair_id)
         if pair:
-            other_user_id = pair.get_other_user_id(user_id)
-            other_user = User.query.get(other_user_id)
-            
-            user.current_pair_id = None
-            other_user.current_pair_id = None
-            pair.status = 'inactive'
-            
+            db.session.execute(
+                update(User)
+                .where(User.id.in_([pair.user1_id, pair.user2_id]),
+                       User.current_pair_id == pair.id)
+                .values(current_pair_id=None)
+                .execution_options(synchronize_session=False)
+            )
             db.session.commit()
+            mark_written(pair.user1_id, pair.user2_id)
             
             return jsonify({'message': 'Successfully disconnected'}), 200
         
+        db.session.rollback()
+        user = User.query.get(user_id)
+        if not user or not user.current_pair_id:
+            return jsonify({'error': 'Not currently paired'}), 400
+        
         return jsonify({'error': 'Pair not found'}), 404
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
-@pair_bp.route('/debug', methods=['GET'])
+@pair_bp.route('/admin/pairs', methods=['GET'])
 @jwt_required()
-def debug():
+@admin_required
+@read_only
+def list_pairs():
+    """Newest pairs first, keyset-paginated on (created_at, id) and streamed"""
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        limit = page_limit(request.args.get('limit'), default=100, maximum=1000)
         
-        all_pairs = Pair.query.all()
-        pairs_data = [p.to_dict() for p in all_pairs]
+        # Plain column tuples, no ORM instances
+        query = PAIR_ROW.select()
         
-        return jsonify({
-            'currentUser': user.to_dict(),
-            'allPairs': pairs_data
-        }), 200
+        status = request.args.get('status')
+        if status:
+            query = query.where(Pair.status == status)
+        
+        user_id = request.args.get('userId')
+        if user_id:
+            query = query.where(or_(Pair.user1_id == user_id,
+                                    Pair.user2_id == user_id))
+        
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                created_at, pair_id = decode_cursor(cursor)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.where(
+                tuple_(Pair.created_at, Pair.id) < (created_at, pair_id))
+        
+        rows = db.session.execute(
+            query.order_by(Pair.created_at.desc(), Pair.id.desc())
+            .limit(limit + 1)
+            .execution_options(yield_per=100))
+        
+        return Response(stream_with_context(stream_pairs(rows, limit)),
+                        mimetype='application/json')
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def stream_pairs(rows, limit):
+    """Write the page row by row, so memory stays flat for any limit"""
+    yield b'{"pairs":['
+    last = None
+    try:
+        for count, row in enumerate(rows):
+            if count == limit:
+                yield b'],"nextCursor":' + dumps_bytes(
+                    encode_cursor(last.created_at, last.id)) + b'}'
+                return
+            if last is not None:
+                yield b','
+            yield dumps_bytes(PAIR_ROW(row))
+            last = row
+        yield b'],"nextCursor":null}'
+    finally:
+        rows.close()
+
+
 @pair_bp.route('/status', methods=['GET'])
 @jwt_required()
+@read_only
+@flights.view('pair_status')
 def get_status():
     try:
         user_id = get_jwt_identity()
         user = User.query.get(user_id)
         
         if not user:
-            return jsonify({'error': 'User not found'}), 404
+            return {'error': 'User not found'}, 404
         
         if not user.current_pair_id:
-            return jsonify({
+            return {
                 'isPaired': False,
                 'pairingCode': user.pairing_code,
                 'codeExpiry': user.pairing_code_expiry.isoformat() if user.pairing_code_expiry else None
-            }), 200
+            }, 200
         
         pair = Pair.query.get(user.current_pair_id)
         if pair:
             other_user_id = pair.get_other_user_id(user_id)
             other_user = User.query.get(other_user_id)
-            return jsonify({
+            return {
                 'isPaired': True,
                 'pairId': pair.id,
                 'pairedWith': other_user.username,
                 'pairedSince': pair.created_at.isoformat()
-            }), 200
+            }, 200
         
-        return jsonify({'isPaired': False}), 200
+        return {'isPaired': False}, 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
@@ -0,0 +1,91 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+# app.py reads its configuration at import time
+TMP_DIR = tempfile.mkdtemp(prefix='flashpair-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(TMP_DIR, 'test.db')}",
+    'UPLOAD_FOLDER': os.path.join(TMP_DIR, 'uploads'),
+    'SECRET_KEY': 'test-secret-key',
+    'JWT_SECRET_KEY': 'test-jwt-secret-key-of-at-least-32-bytes',
+    'TASK_WORKERS': '0',
+    'MAX_CONCURRENT_REQUESTS': '0',
+    'SINGLE_FLIGHT_TTL': '0',
+    'TOKEN_VERSION_CACHE_SECONDS': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as flashpair  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flashpair.rate_limiter.budgets = {}
+    with flashpair.app.app_context():
+        flashpair.db.drop_all()
+        flashpair.db.create_all()
+    yield flashpair.app
+    with flashpair.app.app_context():
+        flashpair.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def register(client):
+    """Register a user; returns its id, auth headers and refresh token"""
+    def register(username, password='password'):
+        response = client.post('/auth/register', json={
+            'username': username, 'password': password})
+        assert response.status_code == 201, response.get_json()
+        body = response.get_json()
+        return {
+            'id': body['user']['id'],
+            'headers': {'Authorization': f"Bearer {body['access_token']}"},
+            'refresh_token': body['refresh_token'],
+        }
+
+    return register
+
+
+@pytest.fixture
+def pair(client):
+    """Pair two registered users through a pairing code"""
+    def pair(first, second):
+        code = client.post('/pair/generate',
+                           headers=first['headers']).get_json()['pairCode']
+        response = client.post('/pair/connect', json={'code': code},
+                               headers=second['headers'])
+        assert response.status_code == 200, response.get_json()
+
+    return pair
+
+
+def image_file(data=b'\xff\xd8\xff\xe0 test image', name='photo.jpg'):
+    return io.BytesIO(data), name
+
+
+def run_concurrently(calls):
+    """Start every call at once on its own thread; returns their results"""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(index, call):
+        barrier.wait()
+        results[index] = call()
+
+    threads = [threading.Thread(target=run, args=(index, call))
+               for index, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
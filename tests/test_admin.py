@@ -0,0 +1,40 @@
+import os
+
+from conftest import flashpair
+
+
+def admin(app, register, monkeypatch):
+    user = register('admin')
+    monkeypatch.setitem(app.config, 'ADMIN_USER_IDS',
+                        frozenset({str(user['id'])}))
+    return user
+
+
+def test_profile_session_reports_its_worker(app, client, register,
+                                            monkeypatch):
+    headers = admin(app, register, monkeypatch)['headers']
+    started = client.post('/admin/profile', json={'seconds': 1},
+                          headers=headers)
+    assert started.status_code == 200
+    pid = started.get_json()['pid']
+    assert pid == os.getpid()
+
+    stacks = client.get(f'/admin/profile?pid={pid}', headers=headers)
+    assert stacks.status_code == 200
+    assert stacks.headers['X-Worker-PID'] == str(pid)
+
+    stopped = client.delete(f'/admin/profile?pid={pid}', headers=headers)
+    assert stopped.status_code == 200
+    assert stopped.get_json()['running'] is False
+
+
+def test_profile_calls_for_another_worker_are_refused(app, client, register,
+                                                      monkeypatch):
+    headers = admin(app, register, monkeypatch)['headers']
+    flashpair.profiler.stop()
+
+    for method in (client.get, client.delete):
+        response = method(f'/admin/profile?pid={os.getpid() + 1}',
+                          headers=headers)
+        assert response.status_code == 409
+        assert response.get_json()['pid'] == os.getpid()
@@ -0,0 +1,31 @@
+import time
+
+from conftest import flashpair
+from utils import replicas
+from utils.replicas import RecentWrites
+
+
+def test_responses_carry_the_pair_affinity_key(client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    header = flashpair.app.config['PAIR_AFFINITY_HEADER']
+
+    first = client.get('/pair/status', headers=alice['headers'])
+    second = client.get('/pair/status', headers=bob['headers'])
+
+    assert first.headers[header] == second.headers[header]
+    assert flashpair.local_users.is_recent(alice['id'])
+
+
+def test_local_users_do_not_grow_without_bound(app, client, register,
+                                               monkeypatch):
+    monkeypatch.setattr(replicas, 'SWEEP_SIZE', 4)
+    monkeypatch.setattr(flashpair, 'local_users', RecentWrites())
+    monkeypatch.setitem(app.config, 'HANDOFF_LOCAL_SECONDS', 0)
+
+    for n in range(12):
+        user = register(f'user{n}')
+        client.get('/pair/status', headers=user['headers'])
+        time.sleep(0.001)
+
+    assert len(flashpair.local_users._deadlines) < 4
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+from conftest import flashpair, image_file, run_concurrently
+
+
+def upload(client, sender, key, data=b'\xff\xd8 retried'):
+    return client.post('/image/upload',
+                       data={'image': image_file(data)},
+                       headers={**sender['headers'], 'Idempotency-Key': key},
+                       content_type='multipart/form-data')
+
+
+def image_count(app):
+    with app.app_context():
+        return flashpair.Image.query.count()
+
+
+def test_retry_replays_the_original_response(app, client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+
+    first = upload(client, alice, 'key-1')
+    retry = upload(client, alice, 'key-1')
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert image_count(app) == 1
+
+
+def test_replay_outlives_the_image(app, client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    first = upload(client, alice, 'key-1').get_json()
+    with app.app_context():
+        flashpair.db.session.execute(
+            flashpair.db.update(flashpair.Image)
+            .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        flashpair.db.session.commit()
+        flashpair.cleanup_expired_images()
+
+    retry = upload(client, alice, 'key-1')
+
+    assert image_count(app) == 0
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first
+
+
+def test_expired_key_can_be_used_again(app, client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    first = upload(client, alice, 'key-1').get_json()
+    with app.app_context():
+        flashpair.db.session.execute(
+            flashpair.db.update(flashpair.IdempotencyKey)
+            .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        flashpair.db.session.commit()
+
+    again = upload(client, alice, 'key-1', b'\xff\xd8 new')
+
+    assert 'Idempotent-Replayed' not in again.headers
+    assert again.get_json()['imageId'] != first['imageId']
+
+
+def test_key_reused_for_another_operation_is_refused(client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    assert upload(client, alice, 'key-1').status_code == 200
+
+    batch = client.post('/image/upload/batch',
+                        data={'images': [image_file(b'a', 'a.jpg')]},
+                        headers={**alice['headers'], 'Idempotency-Key': 'key-1'},
+                        content_type='multipart/form-data')
+
+    assert batch.status_code == 422
+
+
+def test_batch_keys_do_not_collide_with_single_keys(app, client, register,
+                                                     pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    batch = client.post('/image/upload/batch',
+                        data={'images': [image_file(b'a', 'a.jpg'),
+                                         image_file(b'b', 'b.jpg')]},
+                        headers={**alice['headers'], 'Idempotency-Key': 'abc'},
+                        content_type='multipart/form-data')
+
+    single = upload(client, alice, 'abc:0')
+
+    assert batch.status_code == single.status_code == 200
+    assert 'Idempotent-Replayed' not in single.headers
+    assert image_count(app) == 3
+
+
+def test_concurrent_retries_create_one_image(app, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+
+    responses = run_concurrently([
+        lambda: upload(app.test_client(), alice, 'key-1')
+        for _ in range(4)])
+
+    assert [response.status_code for response in responses] == [200] * 4
+    assert len({response.get_json()['imageId']
+                for response in responses}) == 1
+    assert image_count(app) == 1
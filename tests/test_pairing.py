@@ -0,0 +1,87 @@
+from conftest import flashpair, run_concurrently
+
+
+def pair_ids(app):
+    with app.app_context():
+        return {user.username: user.current_pair_id
+                for user in flashpair.User.query.all()}
+
+
+def test_connect_pairs_both_users(app, client, register):
+    alice, bob = register('alice'), register('bob')
+    code = client.post('/pair/generate',
+                       headers=alice['headers']).get_json()['pairCode']
+
+    response = client.post('/pair/connect', json={'code': code},
+                           headers=bob['headers'])
+
+    assert response.status_code == 200
+    assert response.get_json()['pairedWith'] == 'alice'
+    assert pair_ids(app) == {'alice': bob['id'], 'bob': alice['id']}
+
+
+def test_connect_while_paired_is_rejected(app, client, register, pair):
+    xx, aa, bb = register('xx'), register('aa'), register('bb')
+    pair(aa, xx)
+    code = client.post('/pair/generate',
+                       headers=bb['headers']).get_json()['pairCode']
+
+    response = client.post('/pair/connect', json={'code': code},
+                           headers=xx['headers'])
+
+    assert response.status_code == 400
+    assert pair_ids(app) == {'xx': aa['id'], 'aa': xx['id'], 'bb': None}
+    # bb's code was not consumed
+    with app.app_context():
+        assert flashpair.db.session.get(flashpair.User, bb['id']).current_pair_code == code
+
+
+def test_new_code_releases_old_partner(app, client, register, pair):
+    aa, xx = register('aa'), register('xx')
+    pair(aa, xx)
+
+    client.post('/pair/generate', headers=xx['headers'])
+
+    assert pair_ids(app) == {'aa': None, 'xx': None}
+
+
+def test_concurrent_redeems_of_one_code_pair_once(app, register):
+    owner = register('owner')
+    redeemers = [register(f'redeemer{n}') for n in range(4)]
+    code = app.test_client().post(
+        '/pair/generate', headers=owner['headers']).get_json()['pairCode']
+
+    statuses = run_concurrently([
+        lambda user=user: app.test_client().post(
+            '/pair/connect', json={'code': code},
+            headers=user['headers']).status_code
+        for user in redeemers])
+
+    assert sorted(statuses) == [200, 400, 400, 400]
+    pairs = pair_ids(app)
+    winners = [user for n, user in enumerate(redeemers)
+               if pairs[f'redeemer{n}']]
+    assert len(winners) == 1
+    assert pairs['owner'] == winners[0]['id']
+
+
+def test_one_caller_redeeming_two_codes_pairs_once(app, register):
+    caller, aa, bb = register('caller'), register('aa'), register('bb')
+    codes = [app.test_client().post(
+        '/pair/generate', headers=user['headers']).get_json()['pairCode']
+        for user in (aa, bb)]
+
+    statuses = run_concurrently([
+        lambda code=code: app.test_client().post(
+            '/pair/connect', json={'code': code},
+            headers=caller['headers']).status_code
+        for code in codes])
+
+    assert sorted(statuses) == [200, 400]
+    pairs = pair_ids(app)
+    partner = pairs['caller']
+    assert partner in (aa['id'], bb['id'])
+    # Only the partner points back at the caller; the other is untouched
+    assert [name for name in ('aa', 'bb') if pairs[name]] == (
+        ['aa'] if partner == aa['id'] else ['bb'])
+
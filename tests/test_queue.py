@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+from conftest import flashpair, image_file, run_concurrently
+
+
+def upload(app, sender, data):
+    return app.test_client().post('/image/upload',
+                                  data={'image': image_file(data)},
+                                  headers=sender['headers'],
+                                  content_type='multipart/form-data')
+
+
+def deadlines(app):
+    with app.app_context():
+        return [(image.id, image.expires_at) for image in
+                flashpair.Image.query.order_by(flashpair.Image.id)]
+
+
+def test_concurrent_uploads_respect_queue_depth(app, register, pair,
+                                                monkeypatch):
+    monkeypatch.setitem(app.config, 'IMAGE_QUEUE_DEPTH', 3)
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+
+    statuses = run_concurrently([
+        lambda n=n: upload(app, alice, b'image %d' % n).status_code
+        for n in range(8)])
+
+    assert sorted(statuses) == [200] * 3 + [400] * 5
+    with app.app_context():
+        assert flashpair.pending_images(bob['id']).count() == 3
+
+
+def test_queued_images_wait_for_the_one_ahead(app, client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    before = datetime.utcnow()
+    for n in range(3):
+        assert upload(app, alice, b'image %d' % n).status_code == 200
+
+    (_, first), (_, second), (_, third) = deadlines(app)
+    assert first - before <= timedelta(seconds=31)
+    assert second - first == timedelta(seconds=30)
+    assert third - second == timedelta(seconds=30)
+
+    check = client.get('/image/check', headers=bob['headers']).get_json()
+    assert check['timeLeft'] <= 30
+
+
+def test_viewing_the_head_starts_the_next_window(app, client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    for n in range(3):
+        upload(app, alice, b'image %d' % n)
+    head = client.get('/image/check', headers=bob['headers']).get_json()
+
+    viewed_at = datetime.utcnow()
+    assert client.get(f"/image/view/{head['imageId']}",
+                      headers=bob['headers']).status_code == 200
+
+    _, (_, second), (_, third) = deadlines(app)
+    assert abs(second - (viewed_at + timedelta(seconds=30))) < timedelta(
+        seconds=2)
+    assert third - second == timedelta(seconds=30)
+    following = client.get('/image/check', headers=bob['headers']).get_json()
+    assert following['imageId'] != head['imageId']
+    assert 28 < following['timeLeft'] <= 30
@@ -0,0 +1,57 @@
+def refresh(client, token):
+    return client.post('/auth/refresh', json={'refresh_token': token})
+
+
+def login(client, username, password='password'):
+    response = client.post('/auth/login', json={
+        'username': username, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['refresh_token']
+
+
+def test_refresh_rotates_the_token(client, register):
+    alice = register('alice')
+
+    response = refresh(client, alice['refresh_token'])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['access_token']
+    assert body['refresh_token'] != alice['refresh_token']
+    status = client.get('/pair/status', headers={
+        'Authorization': f"Bearer {body['access_token']}"})
+    assert status.status_code == 200
+
+
+def test_reused_token_revokes_its_family(client, register):
+    alice = register('alice')
+    successor = refresh(client, alice['refresh_token']).get_json()[
+        'refresh_token']
+
+    reused = refresh(client, alice['refresh_token'])
+
+    assert reused.status_code == 401
+    assert reused.get_json()['error'] == 'Refresh token reuse detected'
+    # The legitimate holder's successor went with the family
+    assert refresh(client, successor).status_code == 401
+
+
+def test_reuse_leaves_other_logins_alone(client, register):
+    alice = register('alice')
+    other_device = login(client, 'alice')
+    refresh(client, alice['refresh_token'])
+
+    assert refresh(client, alice['refresh_token']).status_code == 401
+    assert refresh(client, other_device).status_code == 200
+
+
+def test_logout_revokes_the_family(client, register):
+    alice = register('alice')
+    successor = refresh(client, alice['refresh_token']).get_json()[
+        'refresh_token']
+
+    response = client.post('/auth/logout',
+                           json={'refresh_token': alice['refresh_token']})
+
+    assert response.status_code == 200
+    assert refresh(client, successor).status_code == 401
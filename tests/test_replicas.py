@@ -0,0 +1,25 @@
+import time
+
+from utils import replicas
+from utils.replicas import RecentWrites
+
+
+def test_marks_stay_until_the_window_ends():
+    writes = RecentWrites()
+    writes.mark([1], 60)
+
+    assert writes.is_recent('1')
+    assert not writes.is_recent('2')
+
+
+def test_expired_marks_are_swept_without_being_read(monkeypatch):
+    monkeypatch.setattr(replicas, 'SWEEP_SIZE', 8)
+    writes = RecentWrites()
+    for user_id in range(100):
+        writes.mark([user_id], 0)
+    time.sleep(0.01)
+
+    writes.mark(['live'], 60)
+
+    assert len(writes._deadlines) < 8
+    assert writes.is_recent('live')
@@ -0,0 +1,86 @@
+from conftest import flashpair, image_file, run_concurrently
+
+
+def create_room(client, owner, name='friends'):
+    response = client.post('/rooms', json={'name': name},
+                           headers=owner['headers'])
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
+
+
+def join(client, member, room):
+    return client.post('/rooms/join', json={'code': room['code']},
+                       headers=member['headers'])
+
+
+def send(client, sender, room, data=b'\xff\xd8 room image', key=None):
+    headers = dict(sender['headers'])
+    if key:
+        headers['Idempotency-Key'] = key
+    return client.post(f"/rooms/{room['roomId']}/images",
+                       data={'image': image_file(data)},
+                       headers=headers,
+                       content_type='multipart/form-data')
+
+
+def test_room_image_is_stored_once_for_every_member(app, client, register):
+    alice, bob, carol = register('alice'), register('bob'), register('carol')
+    room = create_room(client, alice)
+    for member in (bob, carol):
+        assert join(client, member, room).status_code == 200
+
+    response = send(client, alice, room)
+
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert sorted(body['sentTo']) == sorted([bob['id'], carol['id']])
+    with app.app_context():
+        blobs = flashpair.Blob.query.all()
+        assert len(blobs) == 1 and blobs[0].refcount == 2
+        assert flashpair.Image.query.filter_by(
+            room_id=room['roomId']).count() == 2
+
+    for member, image_id in zip((bob, carol), body['imageIds']):
+        headers = member['headers']
+        assert client.get(f'/image/view/{image_id}',
+                          headers=headers).status_code == 200
+        assert client.get(f'/image/view/{image_id}',
+                          headers=headers).status_code == 404
+
+
+def test_room_retry_replays_and_other_rooms_refuse_the_key(client, register):
+    alice, bob, carol = register('alice'), register('bob'), register('carol')
+    first, second = create_room(client, alice), create_room(client, alice)
+    join(client, bob, first)
+    join(client, carol, second)
+
+    original = send(client, alice, first, key='k1')
+    retried = send(client, alice, first, key='k1')
+    elsewhere = send(client, alice, second, b'\xff\xd8 other', key='k1')
+
+    assert retried.headers['Idempotent-Replayed'] == 'true'
+    assert retried.get_json() == original.get_json()
+    assert elsewhere.status_code == 422
+    assert client.get('/image/check',
+                      headers=carol['headers']).get_json()['hasNewImage'] is False
+
+
+def test_concurrent_joins_respect_room_size(app, client, register,
+                                            monkeypatch):
+    monkeypatch.setitem(app.config, 'ROOM_MAX_MEMBERS', 3)
+    owner = register('owner')
+    joiners = [register(f'user{n}') for n in range(4)]
+    room = create_room(client, owner)
+
+    def join_as(member):
+        def call():
+            with app.test_client() as own_client:
+                return join(own_client, member, room).status_code
+        return call
+
+    statuses = run_concurrently([join_as(member) for member in joiners])
+
+    assert sorted(statuses) == [200, 200, 400, 400]
+    with app.app_context():
+        assert flashpair.RoomMember.query.filter_by(
+            room_id=room['roomId']).count() == 3
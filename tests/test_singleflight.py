@@ -0,0 +1,60 @@
+import threading
+
+from flask import Flask
+
+from utils.singleflight import SingleFlight
+
+
+def test_waiters_share_the_leaders_result():
+    flights = SingleFlight(ttl=0, timeout=5)
+    release = threading.Event()
+    started = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'shared'
+
+    leader = threading.Thread(target=flights.do, args=('key', compute))
+    leader.start()
+    started.wait(5)
+    threading.Timer(0.05, release.set).start()
+
+    assert flights.do('key', lambda: 'own') == 'shared'
+    leader.join()
+    assert len(calls) == 1
+
+
+def test_waiter_runs_its_own_call_when_the_leader_is_stuck():
+    flights = SingleFlight(ttl=0, timeout=0.05)
+    release = threading.Event()
+    started = threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait(5)
+        return 'late'
+
+    leader = threading.Thread(target=flights.do, args=('key', stuck))
+    leader.start()
+    started.wait(5)
+
+    assert flights.do('key', lambda: 'own') == 'own'
+    release.set()
+    leader.join()
+
+
+def test_blueprint_flights_follow_app_config(monkeypatch):
+    from routes.pair import pair_bp
+    from utils import singleflight
+
+    monkeypatch.setattr(singleflight.flights, 'ttl', 0.25)
+    monkeypatch.setattr(singleflight.flights, 'timeout', 5.0)
+    app = Flask(__name__)
+    app.config.update(SINGLE_FLIGHT_TTL=0, SINGLE_FLIGHT_TIMEOUT=1.5)
+    app.register_blueprint(pair_bp, url_prefix='/pair')
+
+    assert singleflight.flights.ttl == 0
+    assert singleflight.flights.timeout == 1.5
@@ -0,0 +1,73 @@
+from conftest import flashpair, image_file
+
+MB = 1024 * 1024
+
+
+def create_session(client, user, length, use_header=False):
+    if use_header:
+        return client.post('/image/uploads', headers={
+            **user['headers'], 'Upload-Length': str(length)})
+    return client.post('/image/uploads', json={'length': length},
+                       headers=user['headers'])
+
+
+def test_resumable_upload_is_counted_once(client, register):
+    alice = register('alice')
+    data = b'\xff\xd8 resumable upload'
+    before = flashpair.storage.snapshot()['storedBytes']
+    response = create_session(client, alice, len(data))
+    assert response.status_code == 201, response.get_json()
+    upload_id = response.get_json()['uploadId']
+    reserved = flashpair.storage.snapshot()['storedBytes']
+    assert reserved == before + len(data)
+
+    response = client.patch(f'/image/uploads/{upload_id}', data=data,
+                            headers={**alice['headers'], 'Upload-Offset': '0'})
+
+    assert response.status_code == 204
+    assert flashpair.storage.snapshot()['storedBytes'] == reserved
+
+
+def test_declared_length_counts_against_the_user_quota(client, register,
+                                                       monkeypatch):
+    monkeypatch.setattr(flashpair.storage, 'user_quota_bytes', 25 * MB)
+
+    for user, use_header in ((register('alice'), False),
+                             (register('bob'), True)):
+        assert create_session(client, user, 15 * MB,
+                              use_header).status_code == 201
+        refused = create_session(client, user, 15 * MB, use_header)
+        assert refused.status_code == 429
+
+
+def test_declared_length_counts_against_the_global_quota(client, register,
+                                                         monkeypatch):
+    alice = register('alice')
+    monkeypatch.setattr(flashpair.storage, 'quota_bytes', 5 * MB)
+
+    response = create_session(client, alice, 10 * MB)
+
+    assert response.status_code == 507
+
+
+def test_sender_usage_is_cached_between_refreshes(client, register, pair,
+                                                  monkeypatch):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    queries = []
+
+    def user_bytes(user_id):
+        queries.append(user_id)
+        return 0
+
+    monkeypatch.setattr(flashpair.storage, 'user_bytes', user_bytes)
+    monkeypatch.setattr(flashpair.storage, 'refresh_interval', 60)
+    monkeypatch.setattr(flashpair.storage, '_user_at_rest', {})
+    for data in (b'\xff\xd8 first', b'\xff\xd8 second'):
+        response = client.post('/image/upload',
+                               data={'image': image_file(data)},
+                               headers=alice['headers'],
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+
+    assert len(queries) == 1
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from conftest import flashpair, image_file
+
+
+def expire_one_image(app, client, sender):
+    response = client.post('/image/upload',
+                           data={'image': image_file()},
+                           headers=sender['headers'],
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    with app.app_context():
+        flashpair.db.session.execute(
+            flashpair.db.update(flashpair.Image)
+            .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        flashpair.db.session.commit()
+
+
+def cleanup_tasks():
+    return flashpair.Task.query.filter_by(
+        name='cleanup_expired_images').all()
+
+
+def test_failed_cleanup_is_retried(app, client, register, pair, monkeypatch):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    expire_one_image(app, client, alice)
+
+    def unavailable(images):
+        raise RuntimeError('storage unavailable')
+
+    monkeypatch.setattr(flashpair, 'release_image_files', unavailable)
+    with app.app_context():
+        flashpair.tasks.enqueue('cleanup_expired_images')
+        flashpair.db.session.commit()
+    flashpair.tasks.run_pending()
+
+    with app.app_context():
+        retries = cleanup_tasks()
+        assert retries
+        assert all(task.status == 'pending' and task.attempts == 1
+                   and 'storage unavailable' in task.last_error
+                   for task in retries)
+        assert flashpair.Image.query.count() == 1
+
+    monkeypatch.undo()
+    with app.app_context():
+        flashpair.db.session.execute(
+            flashpair.db.update(flashpair.Task)
+            .values(run_at=datetime.utcnow()))
+        flashpair.db.session.commit()
+    flashpair.tasks.run_pending()
+
+    with app.app_context():
+        assert cleanup_tasks() == []
+        assert flashpair.Image.query.count() == 0
+
+
+def test_storage_eviction_works_in_batches(app, client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    for n in range(3):
+        response = client.post('/image/upload',
+                               data={'image': image_file(b'\xff\xd8 %d' % n)},
+                               headers=alice['headers'],
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+
+    with app.app_context():
+        flashpair.db.session.execute(
+            flashpair.db.update(flashpair.Image)
+            .values(viewed_at=datetime.utcnow()))
+        flashpair.db.session.commit()
+        flashpair.evict_storage({}, limit=2)
+
+        assert flashpair.Image.query.count() == 0
+        assert flashpair.Blob.query.count() == 0
@@ -0,0 +1,26 @@
+from utils import token_versions
+from utils.token_versions import TokenVersionCache
+
+
+def test_versions_are_cached_until_invalidated():
+    loads = []
+
+    def loader(user_id):
+        loads.append(user_id)
+        return len(loads)
+
+    cache = TokenVersionCache(loader, ttl=60)
+
+    assert cache.get(1) == 1
+    assert cache.get(1) == 1
+    cache.invalidate(1)
+    assert cache.get(1) == 2
+
+
+def test_expired_entries_are_swept(monkeypatch):
+    monkeypatch.setattr(token_versions, 'SWEEP_SIZE', 8)
+    cache = TokenVersionCache(lambda user_id: 0, ttl=0)
+    for user_id in range(100):
+        cache.get(user_id)
+
+    assert len(cache._entries) < 8
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from conftest import flashpair, image_file, run_concurrently
+
+
+def upload(client, sender, data=b'\xff\xd8 view once'):
+    response = client.post('/image/upload',
+                           data={'image': image_file(data)},
+                           headers=sender['headers'],
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['imageId']
+
+
+def test_image_can_be_viewed_once(client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    image_id = upload(client, alice, b'\xff\xd8 first')
+
+    first = client.get(f'/image/view/{image_id}', headers=bob['headers'])
+    second = client.get(f'/image/view/{image_id}', headers=bob['headers'])
+
+    assert first.status_code == 200
+    assert first.data == b'\xff\xd8 first'
+    assert second.status_code == 404
+    assert second.get_json()['error'] == 'Image already viewed'
+
+
+def test_only_the_recipient_can_view(client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    image_id = upload(client, alice)
+
+    response = client.get(f'/image/view/{image_id}', headers=alice['headers'])
+
+    assert response.status_code == 404
+    assert client.get(f'/image/view/{image_id}',
+                      headers=bob['headers']).status_code == 200
+
+
+def test_concurrent_views_are_claimed_once(app, register, pair):
+    alice, bob = register('alice'), register('bob')
+    client = app.test_client()
+    pair(alice, bob)
+    image_id = upload(client, alice)
+
+    statuses = run_concurrently([
+        lambda: app.test_client().get(f'/image/view/{image_id}',
+                                      headers=bob['headers'],
+                                      buffered=True).status_code
+        for _ in range(6)])
+
+    assert sorted(statuses) == [200] + [404] * 5
+
+
+def test_expired_image_cannot_be_viewed(app, client, register, pair):
+    alice, bob = register('alice'), register('bob')
+    pair(alice, bob)
+    image_id = upload(client, alice)
+    with app.app_context():
+        flashpair.db.session.execute(
+            flashpair.db.update(flashpair.Image)
+            .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        flashpair.db.session.commit()
+
+    response = client.get(f'/image/view/{image_id}', headers=bob['headers'])
+
+    assert response.status_code == 404
+    assert response.get_json()['error'] == 'Image expired'
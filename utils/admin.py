@@ -0,0 +1,23 @@
+from functools import wraps
+
+from flask import current_app, jsonify
+from flask_jwt_extended import get_jwt_identity
+
+
+def parse_admin_ids(value):
+    """User ids from a comma separated ADMIN_USER_IDS setting"""
+    return frozenset(part.strip() for part in (value or '').split(',')
+                     if part.strip())
+
+
+def admin_required(view):
+    """Restrict a JWT-protected view to ADMIN_USER_IDS.
+    Apply below ``@jwt_required()``."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        admins = current_app.config.get('ADMIN_USER_IDS', frozenset())
+        if str(get_jwt_identity()) not in admins:
+            return jsonify({'error': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+
+    return wrapper
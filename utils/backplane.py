@@ -0,0 +1,191 @@
+import json
+import os
+import select
+import threading
+import time
+
+from utils.resp import RespConnection
+
+CHANNEL = 'flashpair_events'
+
+
+class Backplane:
+    """Publish pair and inbox events to every worker and node.
+
+    Events are small dicts with a ``type`` and the ``users`` they concern.
+    Listeners run on the backend's delivery thread and must not block.
+    """
+
+    def __init__(self, channel=CHANNEL):
+        self.channel = channel
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def subscribe(self, listener):
+        """Register ``listener(event)`` and return a function removing it"""
+        with self._lock:
+            self._listeners.append(listener)
+
+        def unsubscribe():
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+
+        return unsubscribe
+
+    def publish(self, event_type, user_ids, **data):
+        event = dict(data, type=event_type,
+                     users=[str(u) for u in user_ids if u is not None])
+        try:
+            self.start()
+            self._send(json.dumps(event, separators=(',', ':')))
+        except Exception as e:
+            # Realtime delivery is best effort; the DB stays the source of truth
+            print(f"Backplane publish error: {e}")
+
+    def close(self):
+        pass
+
+    def start(self):
+        """Start delivery in this process; cheap to call on every request"""
+        # Listener threads do not survive a fork, so start them per process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+                    self._pid = os.getpid()
+
+    def _start(self):
+        pass
+
+    def _send(self, payload):
+        raise NotImplementedError
+
+    def _deliver(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            print(f"Backplane dropped malformed event: {payload!r}")
+            return
+
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Backplane listener error: {e}")
+
+    def _run_forever(self, loop, name):
+        """Run ``loop`` on a daemon thread, restarting it with backoff"""
+        def runner():
+            delay = 0.5
+            while True:
+                try:
+                    loop()
+                    delay = 0.5
+                except Exception as e:
+                    print(f"{name} listener error: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+        thread = threading.Thread(target=runner, name=name, daemon=True)
+        thread.start()
+
+
+class InProcessBackplane(Backplane):
+    """Single-node backend: events reach listeners in this process only"""
+
+    def _send(self, payload):
+        self._deliver(payload)
+
+
+class PostgresBackplane(Backplane):
+    """Postgres ``LISTEN/NOTIFY`` backend"""
+
+    def __init__(self, dsn, channel=CHANNEL):
+        super().__init__(channel)
+        self.dsn = dsn
+        self._conn = None
+        self._send_lock = threading.Lock()
+
+    def _connect(self):
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    def _send(self, payload):
+        with self._send_lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None or self._conn.closed:
+                        self._conn = self._connect()
+                    with self._conn.cursor() as cursor:
+                        cursor.execute('SELECT pg_notify(%s, %s)',
+                                       (self.channel, payload))
+                    return
+                except Exception:
+                    self._conn = None
+                    if attempt:
+                        raise
+
+    def _start(self):
+        self._conn = None
+        self._run_forever(self._listen, 'pg-backplane')
+
+    def _listen(self):
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._deliver(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+
+class RespBackplane(Backplane):
+    """Redis-protocol ``PUBLISH/SUBSCRIBE`` backend.
+
+    Works against Redis or any local server speaking RESP.
+    """
+
+    def __init__(self, url, channel=CHANNEL):
+        super().__init__(channel)
+        self.url = url
+        self._publisher = RespConnection(url)
+
+    def _send(self, payload):
+        self._publisher.command('PUBLISH', self.channel, payload)
+
+    def _start(self):
+        self._publisher.close()
+        self._run_forever(self._listen, 'resp-backplane')
+
+    def _listen(self):
+        conn = RespConnection(self.url, timeout=None)
+        conn.connect()
+        try:
+            conn.send('SUBSCRIBE', self.channel)
+            while True:
+                reply = conn.read_reply()
+                if isinstance(reply, list) and reply[0] == b'message':
+                    self._deliver(reply[2].decode())
+        finally:
+            conn.close()
+
+
+def create_backplane(url=None):
+    """Pick a backend from a URL: postgresql://, redis:// or memory://"""
+    if not url or url.startswith('memory://'):
+        return InProcessBackplane()
+    if url.startswith('postgres'):
+        return PostgresBackplane(url.replace('+psycopg2', '', 1))
+    if url.startswith('redis://'):
+        return RespBackplane(url)
+    raise ValueError(f"Unsupported backplane URL: {url}")
@@ -5,6 +5,7 @@ import random
 import string
 from datetime import datetime, timedelta
 from database import db
+from utils.replicas import use_primary
 import os
 
 def generate_pairing_code():
@@ -13,10 +14,11 @@ def generate_pairing_code():
 
 def cleanup_expired_images():
     """Clean up expired images from database and filesystem"""
-    expired_images = Image.query.filter(
-        Image.expires_at < datetime.utcnow(),
-        Image.status == 'viewed'
-    ).all()
+    with use_primary():
+        expired_images = Image.query.filter(
+            Image.expires_at < datetime.utcnow(),
+            Image.status == 'viewed'
+        ).all()
     
     for image in expired_images:
         try:
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class HandoffCache:
+    """Bytes of freshly uploaded images, kept in memory for their recipient.
+
+    With pair affinity both partners are served by the same process, so
+    the upload can hand its bytes straight to the view that follows it.
+    Entries are taken at most once, expire after ``ttl`` seconds, and the
+    oldest are dropped beyond ``max_bytes``. A miss just means reading the
+    shared copy instead.
+    """
+
+    def __init__(self, max_bytes, ttl=30):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, key, data, **meta):
+        if len(data) > self.max_bytes:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (now + self.ttl, data, meta)
+            self._size += len(data)
+            # Oldest first: drop what expired, then what does not fit
+            while self._entries:
+                oldest = next(iter(self._entries))
+                if (self._entries[oldest][0] >= now
+                        and self._size <= self.max_bytes):
+                    break
+                self._discard(oldest)
+        return True
+
+    def take(self, key):
+        """Remove and return ``(data, meta)``, or None if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._discard(key)
+
+        deadline, data, meta = entry
+        if deadline < time.monotonic():
+            return None
+        return data, meta
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self._size}
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+
+
+class ReadinessProber:
+    """Run dependency checks on a background thread.
+
+    ``/readyz`` serves the last result from memory, so probes from Docker or
+    the platform never take a pool connection or touch the disk themselves.
+    The result is public: failures carry a fixed reason code, and exception
+    details go to the log only.
+    """
+
+    def __init__(self, app, db, upload_folder, interval=10,
+                 min_free_bytes=100 * 1024 * 1024):
+        self.app = app
+        self.db = db
+        self.upload_folder = upload_folder
+        self.interval = interval
+        self.min_free_bytes = min_free_bytes
+        self._result = {'ready': False, 'checks': {}, 'reason': 'starting'}
+        self._finished_at = None
+        self._engine = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the prober in this process; cheap to call on every request"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    thread = threading.Thread(
+                        target=self._run, name='readiness-prober', daemon=True)
+                    thread.start()
+                    self._pid = os.getpid()
+
+    def snapshot(self):
+        """Latest probe result plus live pool stats and prober lag"""
+        result = dict(self._result)
+        if self._finished_at is not None:
+            age = time.monotonic() - self._finished_at
+            result['probeAgeSeconds'] = round(age, 3)
+            result['lagSeconds'] = round(max(0.0, age - self.interval), 3)
+            if age > 3 * self.interval:
+                result['ready'] = False
+                result['reason'] = 'prober_stalled'
+        result['pool'] = self.pool_stats()
+        return result
+
+    def pool_stats(self):
+        pool = self._engine.pool if self._engine is not None else None
+        if pool is None or not hasattr(pool, 'checkedout'):
+            return None
+
+        size = pool.size()
+        checked_out = pool.checkedout()
+        capacity = size + max(getattr(pool, '_max_overflow', 0), 0)
+        return {
+            'size': size,
+            'checkedOut': checked_out,
+            'overflow': pool.overflow(),
+            'saturation': round(checked_out / capacity, 3) if capacity else None
+        }
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self._result = self.probe()
+            except Exception as e:
+                print(f"Readiness probe error: {e}")
+                self._result = {'ready': False, 'checks': {},
+                                'reason': 'probe_failed'}
+            self._finished_at = time.monotonic()
+            time.sleep(max(0.0, self.interval - (self._finished_at - started)))
+
+    def probe(self):
+        checks = {
+            'database': self._check_database(),
+            'storage': self._check_storage(),
+            'disk': self._check_disk()
+        }
+        failed = [name for name, check in checks.items() if not check['ok']]
+        return {
+            'ready': not failed,
+            'checks': checks,
+            'reason': ', '.join(failed) + ' failing' if failed else None
+        }
+
+    def _check_database(self):
+        started = time.monotonic()
+        try:
+            with self.app.app_context():
+                self._engine = self.db.engine
+            with self._engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            return {'ok': True, 'latencyMs': self._elapsed_ms(started)}
+        except Exception as e:
+            print(f"Readiness database check failed: {e}")
+            return {'ok': False, 'error': 'database_unavailable'}
+
+    def _check_storage(self):
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.upload_folder,
+                                             prefix='.probe-') as probe_file:
+                probe_file.write(b'ok')
+                probe_file.flush()
+            return {'ok': True}
+        except Exception as e:
+            print(f"Readiness storage check failed: {e}")
+            return {'ok': False, 'error': 'storage_unwritable'}
+
+    def _check_disk(self):
+        try:
+            usage = shutil.disk_usage(self.upload_folder)
+            return {
+                'ok': usage.free >= self.min_free_bytes,
+                'freeBytes': usage.free,
+                'usedRatio': round(usage.used / usage.total, 3)
+            }
+        except Exception as e:
+            print(f"Readiness disk check failed: {e}")
+            return {'ok': False, 'error': 'disk_unavailable'}
+
+    @staticmethod
+    def _elapsed_ms(started):
+        return round((time.monotonic() - started) * 1000, 2)
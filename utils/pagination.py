@@ -0,0 +1,27 @@
+import base64
+import json
+from datetime import datetime
+
+
+def encode_cursor(timestamp, row_id):
+    """Opaque keyset cursor for the position after (timestamp, row_id)"""
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), row_id
+    except Exception as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def page_limit(value, default=20, maximum=100):
+    """Clamp a ?limit= query parameter"""
+    try:
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,35 @@
+import base64
+import io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: uploads just carry no preview
+    Image = None
+
+MAX_PREVIEW_BYTES = 1024
+
+
+def tiny_preview(path, size=16, quality=40):
+    """A ``size`` px JPEG of the image as a data: URI, or None.
+
+    A few hundred bytes that clients can blow up and blur as a placeholder
+    while the full image loads. JPEGs are decoded at reduced scale, so
+    this costs a few milliseconds even for camera-sized uploads.
+    """
+    if Image is None or not size:
+        return None
+    try:
+        with Image.open(path) as image:
+            image.draft('RGB', (size * 8, size * 8))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((size, size))
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    except Exception as e:
+        print(f"Preview error for {path}: {e}")
+        return None
+
+    data = buffer.getvalue()
+    if len(data) > MAX_PREVIEW_BYTES:
+        return None
+    return 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii')
@@ -0,0 +1,219 @@
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from flask import request
+
+MAX_PROFILE_SECONDS = 300
+MAX_STACKS = 20000
+
+
+class SamplingProfiler:
+    """Statistical profiler for live requests, off unless switched on.
+
+    While a session runs, a background thread reads the stacks of threads
+    serving selected requests every ``interval`` seconds and counts them
+    as collapsed stacks (``frame;frame;frame count``), the input format of
+    flamegraph.pl and speedscope. Requests are selected by route rule or
+    endpoint name, and then at ``rate``. When no session runs, the only
+    cost is one attribute check per request. Sessions are per process.
+    """
+
+    def __init__(self, app, interval=0.005):
+        self.interval = interval
+        self.enabled = False
+        self._routes = frozenset()
+        self._rate = 1.0
+        self._until = 0.0
+        self._active = {}
+        self._stacks = {}
+        self._info = None
+        self._session = 0
+        self._lock = threading.Lock()
+
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def start(self, seconds, routes=(), rate=1.0):
+        """Profile ``routes`` (all if empty) for ``seconds``, replacing any
+        session still running; returns the new session's status"""
+        seconds = min(float(seconds), MAX_PROFILE_SECONDS)
+        if seconds <= 0 or not 0 < rate <= 1:
+            raise ValueError('seconds must be positive and rate in (0, 1]')
+
+        with self._lock:
+            self._routes = frozenset(routes)
+            self._rate = rate
+            self._until = time.monotonic() + seconds
+            self._stacks = {}
+            self._info = {
+                'routes': sorted(self._routes),
+                'rate': rate,
+                'seconds': seconds,
+                'startedAt': time.time(),
+                'requests': 0,
+                'samples': 0
+            }
+            self._session += 1
+            self.enabled = True
+            threading.Thread(target=self._run, args=(self._session,),
+                             name='sampling-profiler', daemon=True).start()
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            self._session += 1
+            self.enabled = False
+            self._active = {}
+
+    def status(self):
+        info = dict(self._info) if self._info else {}
+        info['running'] = self.enabled
+        info['pid'] = os.getpid()
+        if self.enabled:
+            info['remainingSeconds'] = round(
+                max(0.0, self._until - time.monotonic()), 1)
+        info['stacks'] = len(self._stacks)
+        return info
+
+    def collapsed(self):
+        """Samples of the last session in collapsed-stack format"""
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: -item[1])
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def _before_request(self):
+        if not self.enabled:
+            return None
+
+        rule = request.url_rule.rule if request.url_rule else request.path
+        if self._routes and rule not in self._routes and (
+                request.endpoint not in self._routes):
+            return None
+        if self._rate < 1 and random.random() >= self._rate:
+            return None
+
+        with self._lock:
+            self._active[threading.get_ident()] = f'{request.method} {rule}'
+            self._info['requests'] += 1
+        return None
+
+    def _teardown_request(self, _exc):
+        if self._active:
+            with self._lock:
+                self._active.pop(threading.get_ident(), None)
+
+    def _run(self, session):
+        while self._session == session and time.monotonic() < self._until:
+            time.sleep(self.interval)
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+
+            frames = sys._current_frames()
+            samples = []
+            for ident, label in active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples.append(label + ';' + collapse_stack(frame))
+            del frames
+
+            with self._lock:
+                if self._session != session:
+                    break
+                for stack in samples:
+                    if stack in self._stacks or len(self._stacks) < MAX_STACKS:
+                        self._stacks[stack] = self._stacks.get(stack, 0) + 1
+                self._info['samples'] += len(samples)
+
+        with self._lock:
+            if self._session == session:
+                self.enabled = False
+                self._active = {}
+
+
+def collapse_stack(frame):
+    """``func (file:line);...`` from the outermost frame inwards"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} '
+                     f'({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+class MemoryTracer:
+    """tracemalloc snapshots and diffs against a baseline, per process.
+
+    Tracing starts with the first snapshot and slows allocations while on,
+    so stop it once the growth is found.
+    """
+
+    def __init__(self):
+        self._baseline = None
+        self._baseline_at = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, frames=1, limit=20, key_type='lineno'):
+        """Take a new baseline and return its top allocations"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._baseline = self._take()
+            self._baseline_at = time.time()
+            stats = self._baseline.statistics(key_type)
+        return self.status(top=[format_stat(stat) for stat in stats[:limit]])
+
+    def diff(self, limit=20, key_type='lineno'):
+        """Top allocation growth since the baseline, or None without one"""
+        with self._lock:
+            if self._baseline is None or not tracemalloc.is_tracing():
+                return None
+            stats = self._take().compare_to(self._baseline, key_type)
+        return self.status(
+            baselineAt=self._baseline_at,
+            top=[format_stat(stat) for stat in stats[:limit]])
+
+    def stop(self):
+        with self._lock:
+            self._baseline = None
+            self._baseline_at = None
+            tracemalloc.stop()
+
+    def status(self, **extra):
+        current, peak = (tracemalloc.get_traced_memory()
+                         if tracemalloc.is_tracing() else (0, 0))
+        return dict({
+            'tracing': tracemalloc.is_tracing(),
+            'pid': os.getpid(),
+            'tracedBytes': current,
+            'peakBytes': peak,
+            'overheadBytes': tracemalloc.get_tracemalloc_memory()
+        }, **extra)
+
+    @staticmethod
+    def _take():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>')))
+
+
+def format_stat(stat):
+    """StatisticDiff or Statistic as a JSON-friendly dict"""
+    entry = {
+        'traceback': [f'{frame.filename}:{frame.lineno}'
+                      for frame in stat.traceback],
+        'sizeBytes': stat.size,
+        'count': stat.count
+    }
+    if hasattr(stat, 'size_diff'):
+        entry['sizeDiffBytes'] = stat.size_diff
+        entry['countDiff'] = stat.count_diff
+    return entry
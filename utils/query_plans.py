@@ -0,0 +1,184 @@
+"""EXPLAIN every hot query and fail on sequential scans or costly plans.
+
+    python -m utils.seed --schema app --users 1000000 --images 5000000
+    python -m utils.query_plans --schema app --max-cost 1000
+
+Run against a seeded database before deploying: plans depend on table
+statistics, so an empty database proves nothing. Exits with status 1 when
+a query reads a whole table or (PostgreSQL only, SQLite has no costs)
+its estimated total cost exceeds the budget.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, create_engine, func, or_, select, tuple_
+
+from utils.seed import app_tables, database_url, models_tables
+from utils.sql import explain
+
+DEFAULT_MAX_COST = 1000.0
+
+
+def app_queries(conn):
+    """(name, statement) for the hot paths of app.py"""
+    _metadata, (users, images) = app_tables()
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=30)
+    user_id = conn.execute(select(users.c.id).where(
+        users.c.current_pair_id.isnot(None)).limit(1)).scalar() or 1
+    code = conn.execute(select(users.c.current_pair_code).where(
+        users.c.current_pair_code.isnot(None)).limit(1)).scalar() or '000000'
+
+    live = and_(images.c.recipient_id == user_id,
+                images.c.viewed_at.is_(None),
+                images.c.expires_at >= now)
+    partner = users.alias('partner')
+    return [
+        ('pending-image check', select(
+            images.c.id, images.c.sender_id, images.c.sent_at,
+            images.c.filename, images.c.content_hash
+        ).where(live).order_by(images.c.sent_at, images.c.id).limit(1)),
+        ('inbox page', select(
+            images.c.id, images.c.sender_id, images.c.sent_at
+        ).where(live, tuple_(images.c.sent_at, images.c.id) > (cutoff, 0))
+         .order_by(images.c.sent_at, images.c.id).limit(21)),
+        ('sync', select(
+            users.c.current_pair_id, users.c.current_pair_code,
+            partner.c.username, images.c.id, images.c.sender_id,
+            images.c.sent_at
+        ).select_from(
+            users.outerjoin(partner, partner.c.id == users.c.current_pair_id)
+            .outerjoin(images, and_(images.c.recipient_id == users.c.id,
+                                    images.c.expires_at >= now,
+                                    images.c.viewed_at.is_(None)))
+        ).where(users.c.id == user_id)
+         .order_by(images.c.sent_at, images.c.id).limit(1)),
+        ('pairing-code lookup', select(users.c.id).where(
+            users.c.current_pair_code == code)),
+        ('login', select(users).where(users.c.username == 'user1')),
+        ('expiry scan', select(images).where(images.c.expires_at < now)
+         .order_by(images.c.expires_at).limit(500)),
+    ]
+
+
+def models_queries(conn):
+    """(name, statement) for the hot paths of the blueprint routes"""
+    _metadata, (users, pairs, images) = models_tables()
+    now = datetime.utcnow()
+    user_id, pair_id = conn.execute(select(
+        users.c.id, users.c.current_pair_id
+    ).where(users.c.current_pair_id.isnot(None)).limit(1)).first() or ('', '')
+    code = conn.execute(select(users.c.pairing_code).where(
+        users.c.pairing_code.isnot(None)).limit(1)).scalar() or '000000'
+    retention_cutoff = now - timedelta(days=7)
+
+    queued = and_(images.c.receiver_id == user_id, images.c.status == 'sent')
+    return [
+        ('pending-image check', select(images).where(queued)
+         .order_by(images.c.sent_at, images.c.id).limit(1)),
+        ('inbox page', select(
+            images.c.id, images.c.pair_id, images.c.sender_id,
+            images.c.sent_at
+        ).where(queued, tuple_(images.c.sent_at, images.c.id) > (now - timedelta(days=1), ''))
+         .order_by(images.c.sent_at, images.c.id).limit(21)),
+        ('queue depth', select(func.count()).select_from(images).where(
+            images.c.pair_id == pair_id, images.c.status == 'sent')),
+        ('pairing-code lookup', select(users.c.id).where(
+            users.c.pairing_code == code,
+            users.c.pairing_code_expiry >= now,
+            users.c.current_pair_id.is_(None))),
+        ('login', select(users).where(users.c.email == 'user1@example.com')),
+        ('expiry scan', select(images).where(
+            images.c.expires_at < now, images.c.status == 'viewed')),
+        ('image retention scan', select(images.c.id).where(or_(
+            and_(images.c.status.in_(('viewed', 'expired')),
+                 images.c.expires_at < retention_cutoff),
+            and_(images.c.status == 'sent',
+                 images.c.sent_at < retention_cutoff))).limit(1000)),
+        ('pair retention scan', select(pairs.c.id).where(
+            pairs.c.status == 'inactive',
+            pairs.c.last_activity < now - timedelta(days=30)).limit(1000)),
+        ('admin pair listing', select(pairs)
+         .order_by(pairs.c.created_at.desc(), pairs.c.id.desc()).limit(101)),
+        ('admin pair listing by user', select(pairs).where(or_(
+            pairs.c.user1_id == user_id, pairs.c.user2_id == user_id))
+         .order_by(pairs.c.created_at.desc(), pairs.c.id.desc()).limit(101)),
+    ]
+
+
+def postgresql_plan(conn, statement):
+    """(top plan node, every node) from EXPLAIN (FORMAT JSON)"""
+    document = conn.execute(explain(statement)).scalar()
+    root = document[0]['Plan']
+    nodes, stack = [], [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get('Plans', []))
+    return root, nodes
+
+
+def check_plan(conn, name, statement, max_cost):
+    """Problems with the plan of one statement, and a one-line summary"""
+    problems = []
+    if conn.dialect.name == 'postgresql':
+        root, nodes = postgresql_plan(conn, statement)
+        for node in nodes:
+            if node['Node Type'] == 'Seq Scan':
+                problems.append(f"sequential scan on {node['Relation Name']}")
+        if root['Total Cost'] > max_cost:
+            problems.append(
+                f"cost {root['Total Cost']:.0f} over budget {max_cost:.0f}")
+        summary = (f"cost={root['Total Cost']:.1f} " + ', '.join(
+            node['Node Type'] + (f" using {node['Index Name']}"
+                                 if 'Index Name' in node else '')
+            for node in nodes))
+    else:
+        details = [row[-1] for row in conn.execute(explain(statement))]
+        for detail in details:
+            # "SCAN t" reads the table; "SCAN t USING INDEX i" walks an index
+            if detail.startswith('SCAN ') and ' USING ' not in detail:
+                problems.append(f"full scan: {detail}")
+        summary = '; '.join(details)
+    return problems, summary
+
+
+def check_plans(engine, schema, max_cost=DEFAULT_MAX_COST):
+    """Run every check; returns [(name, problems, summary)]"""
+    results = []
+    with engine.connect() as conn:
+        queries = (app_queries if schema == 'app' else models_queries)(conn)
+        for name, statement in queries:
+            problems, summary = check_plan(conn, name, statement, max_cost)
+            results.append((name, problems, summary))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--schema', choices=('app', 'models'), default='app')
+    parser.add_argument('--database-url',
+                        help='defaults to $DATABASE_URL, else the local SQLite file')
+    parser.add_argument('--max-cost', type=float, default=DEFAULT_MAX_COST,
+                        help='planner cost budget per query (PostgreSQL)')
+    args = parser.parse_args(argv)
+
+    url = database_url(args.database_url)
+    os.environ['DATABASE_URL'] = url
+    failed = 0
+    for name, problems, summary in check_plans(
+            create_engine(url), args.schema, args.max_cost):
+        print(f"{'FAIL' if problems else 'ok':4} {name}: {summary}")
+        for problem in problems:
+            print(f"     - {problem}")
+        failed += bool(problems)
+
+    print(f"{failed} of the hot queries have regressed" if failed
+          else "All hot query plans use indexes within budget")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import math
+import threading
+import time
+
+from flask import g, jsonify, request
+from flask_jwt_extended import decode_token
+
+from utils.resp import RespConnection
+
+EXEMPT_ENDPOINTS = {'liveness_check', 'readiness_check', 'health_check'}
+
+# Token bucket refill and take, atomically on the shared server
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local data = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local retry = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry)
+"""
+
+
+def token_identity():
+    """Verified subject of the bearer token, without any user lookup"""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        return decode_token(header[7:])['sub']
+    except Exception:
+        return None
+
+
+class MemoryBucketStore:
+    """Per-process token buckets keyed by an arbitrary string"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take one token; return 0 when allowed, else seconds to wait"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                retry_after = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                retry_after = (1 - tokens) / rate
+
+            if len(self._buckets) > self.max_entries:
+                self._prune(now)
+        return retry_after
+
+    def _prune(self, now, idle_seconds=300):
+        # Idle buckets are full again, so forgetting them changes nothing
+        stale = [key for key, (_, updated) in self._buckets.items()
+                 if now - updated > idle_seconds]
+        for key in stale:
+            del self._buckets[key]
+
+
+class RespBucketStore:
+    """Token buckets shared by all workers through a Redis-protocol server.
+
+    Falls back to per-process buckets while the server is unreachable, and
+    logs once per outage rather than once per request.
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        self.prefix = prefix
+        self._conn = RespConnection(url, timeout=0.2)
+        self._fallback = MemoryBucketStore()
+        self._down = False
+
+    def take(self, key, rate, burst):
+        try:
+            reply = self._conn.command('EVAL', TAKE_SCRIPT, 1, self.prefix + key,
+                                       rate, burst, repr(time.time()))
+        except Exception as e:
+            if not self._down:
+                self._down = True
+                print(f"Rate limit backend error, using local buckets: {e}")
+            return self._fallback.take(key, rate, burst)
+
+        if self._down:
+            self._down = False
+            print("Rate limit backend reachable again")
+        return float(reply)
+
+
+class ConcurrencyLimiter:
+    """Non-blocking cap on requests in flight in this process"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class RateLimiter:
+    """Shed load before a view runs.
+
+    Every request takes a slot from the global concurrency limiter. Routes
+    with a budget in ``RATE_LIMITS`` (endpoint -> (per second, burst)) also
+    take a token from the caller's IP bucket, scaled by
+    ``RATE_LIMIT_IP_FACTOR``, and from the user's bucket when a valid access
+    token is present. All checks happen before any DB work.
+    """
+
+    def __init__(self, app=None):
+        self.budgets = {}
+        self.ip_factor = 1
+        self.store = None
+        self.concurrency = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.budgets = app.config.get('RATE_LIMITS', {})
+        self.ip_factor = app.config.get('RATE_LIMIT_IP_FACTOR', 5)
+
+        backend = app.config.get('RATE_LIMIT_BACKEND')
+        self.store = RespBucketStore(backend) if backend else MemoryBucketStore()
+
+        max_concurrent = app.config.get('MAX_CONCURRENT_REQUESTS')
+        if max_concurrent:
+            self.concurrency = ConcurrencyLimiter(max_concurrent)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        endpoint = request.endpoint
+        if endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        if self.concurrency is not None:
+            if not self.concurrency.try_acquire():
+                return self._reject(503, 'Server busy, retry shortly', 1)
+            g.rate_limit_slot = True
+
+        budget = self.budgets.get(endpoint)
+        if budget is None:
+            return None
+
+        rate, burst = budget
+        retry_after = self.store.take(
+            f'ip:{endpoint}:{request.remote_addr}',
+            rate * self.ip_factor, burst * self.ip_factor)
+        if not retry_after:
+            user_id = token_identity()
+            if user_id is not None:
+                retry_after = self.store.take(
+                    f'user:{endpoint}:{user_id}', rate, burst)
+
+        if retry_after:
+            return self._reject(429, 'Too many requests', retry_after)
+        return None
+
+    def _after_request(self, response):
+        # Streamed bodies (send_file) are still in flight after the view
+        # returns; hold the slot until the server has sent the last byte
+        if g.pop('rate_limit_slot', False):
+            response.call_on_close(self.concurrency.release)
+        return response
+
+    def _teardown_request(self, _exc):
+        # Only reached with the slot still held if no response was built
+        if g.pop('rate_limit_slot', False):
+            self.concurrency.release()
+
+    @staticmethod
+    def _reject(status, message, retry_after):
+        response = jsonify({'error': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
@@ -0,0 +1,90 @@
+import hashlib
+import hmac
+import secrets
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+
+
+class RefreshTokens:
+    """Rotating refresh tokens, stored only as HMAC-SHA256 digests.
+
+    Renewing costs one HMAC and one conditional UPDATE on the unique digest
+    index, instead of a password hash. Every refresh marks the presented
+    token used and issues its successor in the same family. Presenting a
+    used token again means it was copied, so the whole family is revoked
+    and its holder has to log in.
+
+    ``model`` needs ``id``, ``token_hash`` (unique), ``user_id``,
+    ``family_id``, ``expires_at`` and ``used_at`` columns.
+    """
+
+    def __init__(self, db, model, secret, ttl=timedelta(days=30)):
+        self.db = db
+        self.model = model
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.ttl = ttl
+
+    def digest(self, token):
+        return hmac.new(self.secret, token.encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, user_id, family_id=None):
+        """Stage a new token in the current session and return it"""
+        token = secrets.token_urlsafe(32)
+        self.db.session.add(self.model(
+            token_hash=self.digest(token),
+            user_id=user_id,
+            family_id=family_id or uuid.uuid4().hex,
+            expires_at=datetime.utcnow() + self.ttl))
+        return token
+
+    def rotate(self, token):
+        """Spend ``token`` and return ``(user_id, successor)``, committed.
+
+        Raises ValueError if the token is unknown, expired or reused.
+        """
+        Token = self.model
+        session = self.db.session
+        now = datetime.utcnow()
+        digest = self.digest(token)
+
+        claimed = session.execute(
+            update(Token)
+            .where(Token.token_hash == digest,
+                   Token.used_at.is_(None),
+                   Token.expires_at > now)
+            .values(used_at=now)
+            .returning(Token.user_id, Token.family_id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if claimed is None:
+            spent = session.execute(
+                select(Token.family_id, Token.used_at)
+                .where(Token.token_hash == digest)).first()
+            if spent is not None and spent.used_at is not None:
+                session.execute(delete(Token)
+                                .where(Token.family_id == spent.family_id)
+                                .execution_options(synchronize_session=False))
+                session.commit()
+                print(f"Refresh token reuse, revoked family {spent.family_id}")
+                raise ValueError('Refresh token reuse detected')
+            session.rollback()
+            raise ValueError('Invalid or expired refresh token')
+
+        successor = self.issue(claimed.user_id, claimed.family_id)
+        session.commit()
+        return claimed.user_id, successor
+
+    def revoke(self, token):
+        """Delete the family ``token`` belongs to (logout); commit afterwards"""
+        Token = self.model
+        family_id = select(Token.family_id).where(
+            Token.token_hash == self.digest(token)).scalar_subquery()
+        return self.db.session.execute(
+            delete(Token).where(Token.family_id == family_id)
+            .execution_options(synchronize_session=False)).rowcount
+
+    def expired(self):
+        """Condition for rows that can be purged"""
+        return self.model.expires_at < datetime.utcnow()
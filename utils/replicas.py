@@ -0,0 +1,106 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+SWEEP_SIZE = 1024
+
+
+class RoutingSession(Session):
+    """Session that sends reads to the ``replica`` bind in read-only routes.
+
+    Flushes and DML statements always go to the primary, as does every
+    query outside a route decorated with :func:`read_only`.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None
+                and not self._flushing
+                and not getattr(clause, 'is_dml', False)
+                and g.get('use_replica', False)
+                and REPLICA_BIND in self._db.engines):
+            return self._db.engines[REPLICA_BIND]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+class RecentWrites:
+    """Users that wrote recently and must read their writes from the primary.
+
+    Marks live in this process. Set ``publish(user_ids)`` to share the marks
+    of :func:`mark_written` with other workers, e.g. over the backplane;
+    without it, a read served by another worker within the window may
+    still go to the replica. Expired marks are swept whenever the number of
+    marks doubles, so memory follows the users active within the window.
+    """
+
+    def __init__(self, publish=None):
+        self.publish = publish
+        self._deadlines = {}
+        self._sweep_at = SWEEP_SIZE
+        self._lock = threading.Lock()
+
+    def mark(self, keys, window):
+        now = time.monotonic()
+        deadline = now + window
+        with self._lock:
+            for key in keys:
+                self._deadlines[str(key)] = deadline
+            if len(self._deadlines) >= self._sweep_at:
+                self._deadlines = {key: until for key, until
+                                   in self._deadlines.items() if until > now}
+                self._sweep_at = max(SWEEP_SIZE, 2 * len(self._deadlines))
+
+    def is_recent(self, key):
+        deadline = self._deadlines.get(str(key))
+        if deadline is None:
+            return False
+        if deadline > time.monotonic():
+            return True
+
+        with self._lock:
+            self._deadlines.pop(str(key), None)
+        return False
+
+
+recent_writes = RecentWrites()
+
+
+def mark_written(*user_ids):
+    """Pin the given users to the primary for the staleness window"""
+    window = current_app.config.get('REPLICA_STALENESS_SECONDS', 5)
+    user_ids = [u for u in user_ids if u is not None]
+    recent_writes.mark(user_ids, window)
+    if recent_writes.publish is not None and user_ids:
+        recent_writes.publish(user_ids)
+
+
+def read_only(view):
+    """Serve a JWT-protected view from the replica unless the caller wrote
+    within the staleness window. Apply below ``@jwt_required()``."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = not recent_writes.is_recent(get_jwt_identity())
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.use_replica = False
+
+    return wrapper
+
+
+@contextmanager
+def use_primary():
+    """Force the primary inside a read-only view, e.g. for cleanup writes"""
+    previous = g.get('use_replica', False)
+    g.use_replica = False
+    try:
+        yield
+    finally:
+        g.use_replica = previous
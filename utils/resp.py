@@ -0,0 +1,92 @@
+import socket
+import threading
+from urllib.parse import urlparse
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RespConnection:
+    """Minimal blocking client for the Redis serialization protocol (RESP).
+
+    Enough for PUBLISH/SUBSCRIBE and scripted commands against Redis or any
+    local server speaking the same protocol, without a client dependency.
+    """
+
+    def __init__(self, url, timeout=5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.database = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        self._sock = socket.create_connection(
+            (self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.database:
+            self._call('SELECT', self.database)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._reader = None
+
+    def command(self, *args):
+        """Send one command and return its reply, reconnecting once"""
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self.connect()
+                return self._call(*args)
+            except (OSError, EOFError):
+                self.close()
+                self.connect()
+                return self._call(*args)
+
+    def send(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self._sock.sendall(b''.join(parts))
+
+    def read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise EOFError('Connection closed by server')
+
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode()
+        if kind == b'-':
+            raise RespError(body.decode())
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise RespError(f'Unexpected reply type {kind!r}')
+
+    def _call(self, *args):
+        self.send(*args)
+        return self.read_reply()
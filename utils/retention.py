@@ -0,0 +1,391 @@
+"""Keep the blueprint's image and pair tables bounded.
+
+The worker starts with the app that registers ``image_bp``. The one-off
+partition migration runs from the command line:
+
+    flask --app <app> retention partition-images
+    python -m utils.retention partition-images --database-url postgresql://...
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask.cli import AppGroup
+from sqlalchemy import (and_, create_engine, delete, insert, literal, or_,
+                        select, text)
+
+from database import db
+from models.image import Image
+from models.pair import Pair
+from models.refresh_token import RefreshToken
+
+PARTITION_PREFIX = 'image_p'
+RETENTION_LOCK_ID = 0x466c5072  # pg advisory lock shared by all workers
+
+
+def archive_table(model):
+    """``<table>_archive`` with the model's columns plus ``archived_at``"""
+    source = model.__table__
+    name = f'{source.name}_archive'
+    if name in db.metadata.tables:
+        return db.metadata.tables[name]
+
+    columns = [db.Column(c.name, c.type, primary_key=c.primary_key)
+               for c in source.columns]
+    return db.Table(name, db.metadata, *columns,
+                    db.Column('archived_at', db.DateTime, nullable=False))
+
+
+ImageArchive = archive_table(Image)
+PairArchive = archive_table(Pair)
+
+
+def image_retention_filter(cutoff):
+    """Images nobody can see any more, finished before ``cutoff``"""
+    return or_(
+        and_(Image.status.in_(('viewed', 'expired')),
+             Image.expires_at < cutoff),
+        # Never opened: the sender's copy is as good as gone
+        and_(Image.status == 'sent', Image.sent_at < cutoff))
+
+
+def pair_retention_filter(cutoff):
+    return and_(Pair.status == 'inactive', Pair.last_activity < cutoff)
+
+
+def purge_rows(model, condition, archive=None, batch_size=1000,
+               max_batches=None, on_batch=None):
+    """Delete rows matching ``condition`` in primary-key batches.
+
+    Each batch is its own short transaction, so purging never holds long
+    locks or builds a large undo log. With ``archive`` the rows are copied
+    there first, in the same transaction. ``on_batch(ids)`` runs before the
+    rows go. Returns the number of rows removed.
+    """
+    removed = 0
+    batches = 0
+    columns = [c.name for c in model.__table__.columns]
+    while max_batches is None or batches < max_batches:
+        ids = db.session.execute(
+            select(model.id).where(condition).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        if on_batch is not None:
+            on_batch(ids)
+        if archive is not None:
+            db.session.execute(insert(archive).from_select(
+                columns + ['archived_at'],
+                select(*model.__table__.columns,
+                       literal(datetime.utcnow(), db.DateTime))
+                .where(model.id.in_(ids))))
+        db.session.execute(delete(model).where(model.id.in_(ids))
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+
+        removed += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+    return removed
+
+
+def remove_image_files(ids):
+    """Delete files still on disk for images about to be purged"""
+    for file_path in db.session.execute(
+            select(Image.file_path).where(Image.id.in_(ids))).scalars():
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error deleting file {file_path}: {e}")
+
+
+# Postgres range partitioning of ``image`` by month of ``sent_at``. Old
+# months are detached and dropped whole instead of deleted row by row.
+
+
+def image_is_partitioned(conn):
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {'name': Image.__tablename__}).first() is not None
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(moment):
+    return month_start(month_start(moment) + timedelta(days=32))
+
+
+def partition_name(start):
+    return f"{PARTITION_PREFIX}{start:%Y%m}"
+
+
+def ensure_image_partitions(conn, months_ahead=2, since=None):
+    """Create monthly partitions from ``since`` (default now) onwards"""
+    start = month_start(since or datetime.utcnow())
+    last = datetime.utcnow()
+    for _ in range(months_ahead):
+        last = next_month(last)
+
+    while start <= last:
+        end = next_month(start)
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{partition_name(start)}" '
+            f'PARTITION OF "{Image.__tablename__}" '
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"))
+        start = end
+
+
+def image_partitions(conn):
+    """Monthly partitions of ``image`` as (name, upper bound), oldest first"""
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :name AND c.relname LIKE :prefix "
+        "ORDER BY c.relname"
+    ), {'name': Image.__tablename__,
+        'prefix': PARTITION_PREFIX + '%'}).scalars()
+
+    partitions = []
+    for name in names:
+        try:
+            start = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m')
+        except ValueError:
+            continue  # e.g. the default partition
+        partitions.append((name, next_month(start)))
+    return partitions
+
+
+def drop_image_partitions(conn, cutoff, archive=False):
+    """Detach every partition that ends before ``cutoff``.
+
+    The detached table is dropped, or renamed to ``image_archive_YYYYMM``
+    when archiving. Returns the names of the partitions removed.
+    """
+    removed = []
+    for name, upper_bound in image_partitions(conn):
+        if upper_bound > cutoff:
+            break
+
+        # Unopened images still have files on disk
+        for file_path in conn.execute(text(
+                f'SELECT file_path FROM "{name}" WHERE status = \'sent\'')
+        ).scalars():
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Error deleting file {file_path}: {e}")
+
+        conn.execute(text(
+            f'ALTER TABLE "{Image.__tablename__}" DETACH PARTITION "{name}"'))
+        if archive:
+            conn.execute(text(
+                f'ALTER TABLE "{name}" RENAME TO '
+                f'"{Image.__tablename__}_archive_{name[len(PARTITION_PREFIX):]}"'))
+        else:
+            conn.execute(text(f'DROP TABLE "{name}"'))
+        removed.append(name)
+    return removed
+
+
+def partition_image_table(conn):
+    """One-off migration of a plain ``image`` table to monthly partitions.
+
+    Run inside a transaction during a maintenance window: the table is
+    rebuilt and its rows copied, which locks it for the duration. The
+    primary key becomes ``(id, sent_at)``, as declared in models/image.py.
+    """
+    table = Image.__tablename__
+    if image_is_partitioned(conn):
+        return False
+
+    oldest = conn.execute(text(f'SELECT min(sent_at) FROM "{table}"')).scalar()
+    conn.execute(text(f'ALTER TABLE "{table}" RENAME TO "{table}_unpartitioned"'))
+    for index in Image.__table__.indexes:
+        conn.execute(text(f'ALTER INDEX IF EXISTS "{index.name}" '
+                          f'RENAME TO "{index.name}_unpartitioned"'))
+
+    # The partition key has to be part of the primary key
+    conn.execute(text(
+        f'CREATE TABLE "{table}" (LIKE "{table}_unpartitioned" '
+        f'INCLUDING DEFAULTS) PARTITION BY RANGE (sent_at)'))
+    conn.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN sent_at SET NOT NULL'))
+    conn.execute(text(f'ALTER TABLE "{table}" ADD CONSTRAINT '
+                      f'"{table}_partitioned_pkey" PRIMARY KEY (id, sent_at)'))
+    for index in Image.__table__.indexes:
+        index.create(bind=conn)
+
+    ensure_image_partitions(conn, since=oldest)
+    conn.execute(text(
+        f'INSERT INTO "{table}" SELECT * FROM "{table}_unpartitioned" '
+        f'WHERE sent_at IS NOT NULL'))
+    conn.execute(text(f'DROP TABLE "{table}_unpartitioned"'))
+    return True
+
+
+class RetentionWorker:
+    """Keep ``image`` and ``pair`` bounded in the background.
+
+    Every ``RETENTION_INTERVAL`` seconds, finished images older than
+    ``RETENTION_IMAGE_DAYS`` and inactive pairs older than
+    ``RETENTION_PAIR_DAYS`` are deleted in batches of ``RETENTION_BATCH_SIZE``,
+    or moved to ``*_archive`` tables with ``RETENTION_ARCHIVE``. Expired
+    refresh tokens are deleted too. On Postgres
+    with a partitioned ``image`` table, old months are dropped whole and
+    upcoming months are created ahead of time.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('RETENTION_IMAGE_DAYS', 7)
+        app.config.setdefault('RETENTION_PAIR_DAYS', 30)
+        app.config.setdefault('RETENTION_BATCH_SIZE', 1000)
+        app.config.setdefault('RETENTION_INTERVAL', 300)
+        app.config.setdefault('RETENTION_ARCHIVE', False)
+        if app.config['RETENTION_INTERVAL']:
+            app.before_request(self.start)
+        app.cli.add_command(retention_cli)
+
+    def start(self):
+        """Start the worker in this process; cheap to call on every request"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    thread = threading.Thread(
+                        target=self._run, name='retention', daemon=True)
+                    thread.start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['RETENTION_INTERVAL'])
+            try:
+                with self.app.app_context():
+                    self.run_once()
+            except Exception as e:
+                print(f"Retention error: {e}")
+
+    def run_once(self):
+        """One retention pass; returns what was removed"""
+        engine = db.engine
+        if engine.dialect.name != 'postgresql':
+            return self._purge(partitioned=False)
+
+        # Only one worker across all processes does the pass
+        with engine.connect() as lock_conn:
+            locked = lock_conn.execute(text('SELECT pg_try_advisory_lock(:id)'),
+                                       {'id': RETENTION_LOCK_ID}).scalar()
+            if not locked:
+                return None
+            try:
+                return self._purge(partitioned=True)
+            finally:
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:id)'),
+                                  {'id': RETENTION_LOCK_ID})
+
+    def _purge(self, partitioned):
+        config = self.app.config
+        now = datetime.utcnow()
+        archive = config['RETENTION_ARCHIVE']
+        batch_size = config['RETENTION_BATCH_SIZE']
+        image_cutoff = now - timedelta(days=config['RETENTION_IMAGE_DAYS'])
+        pair_cutoff = now - timedelta(days=config['RETENTION_PAIR_DAYS'])
+        if archive:
+            db.metadata.create_all(db.engine,
+                                   tables=[ImageArchive, PairArchive])
+
+        result = {'images': 0, 'pairs': 0, 'refresh_tokens': 0,
+                  'partitions': []}
+        with db.engine.begin() as conn:
+            partitioned = partitioned and image_is_partitioned(conn)
+            if partitioned:
+                ensure_image_partitions(conn)
+                result['partitions'] = drop_image_partitions(
+                    conn, image_cutoff, archive=archive)
+
+        if not partitioned:
+            result['images'] = purge_rows(
+                Image, image_retention_filter(image_cutoff),
+                archive=ImageArchive if archive else None,
+                batch_size=batch_size, on_batch=remove_image_files)
+        result['pairs'] = purge_rows(
+            Pair, pair_retention_filter(pair_cutoff),
+            archive=PairArchive if archive else None, batch_size=batch_size)
+        result['refresh_tokens'] = purge_rows(
+            RefreshToken, RefreshToken.expires_at < now, batch_size=batch_size)
+
+        if result['images'] or result['pairs'] or result['partitions']:
+            print(f"Retention removed {result['images']} images, "
+                  f"{result['pairs']} pairs, "
+                  f"{len(result['partitions'])} image partitions")
+        return result
+
+
+# Started by the app that registers image_bp (see routes/image.py)
+retention = RetentionWorker()
+
+retention_cli = AppGroup('retention', help='Image and pair retention.')
+
+
+@retention_cli.command('run')
+def run_command():
+    """Run one retention pass now."""
+    print(retention.run_once())
+
+
+@retention_cli.command('partition-images')
+def partition_images_command():
+    """Partition the image table by month (PostgreSQL, one-off)."""
+    with db.engine.begin() as conn:
+        migrate(conn)
+
+
+def migrate(conn):
+    if conn.dialect.name != 'postgresql':
+        print("Partitioning needs PostgreSQL; nothing to do")
+        return False
+    if not partition_image_table(conn):
+        print(f"{Image.__tablename__} is already partitioned")
+        return False
+    print(f"Partitioned {Image.__tablename__} by month")
+    return True
+
+
+def main(argv=None):
+    from utils.seed import database_url
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('partition-images',))
+    parser.add_argument('--database-url',
+                        help='defaults to $DATABASE_URL, else the local SQLite file')
+    args = parser.parse_args(argv)
+
+    with create_engine(database_url(args.database_url)).begin() as conn:
+        migrate(conn)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
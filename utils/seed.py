@@ -0,0 +1,281 @@
+"""Synthetic data at production scale, for load and query-plan checks.
+
+    python -m utils.seed --schema app --users 1000000 --images 5000000
+    python -m utils.seed --schema models --database-url postgresql://...
+
+``app`` seeds the tables of app.py (``users``, ``images``), ``models`` the
+blueprint models (``user``, ``pair``, ``image``). Rows go in with Core
+multi-row inserts in batches, so memory stays flat at any size. Seed a
+scratch database: the background cleanup of a running app deletes the
+old images. Afterwards run ``python -m utils.query_plans``.
+"""
+import argparse
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from werkzeug.security import generate_password_hash
+
+BATCH_SIZE = 10000
+
+# Share of users in an active pair, and holding an open pairing code
+PAIRED_SHARE = 0.6
+CODE_SHARE = 0.05
+
+
+def database_url(url=None):
+    url = url or os.environ.get('DATABASE_URL') or 'sqlite:///flashpair.db'
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def insert_batches(conn, table, rows, batch_size=BATCH_SIZE):
+    """Insert an iterable of dicts in batches; returns the row count"""
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            conn.execute(table.insert(), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+        count += len(batch)
+    return count
+
+
+def random_time(rng, now, days):
+    return now - timedelta(seconds=rng.random() * days * 86400)
+
+
+def pairing_code(rng):
+    return f'{rng.randrange(1000000):06d}'
+
+
+class Seeder:
+    """Deterministic rows for ``users`` users and ``images`` images spread
+    over the last ``days`` days; the same ``seed`` gives the same data"""
+
+    def __init__(self, users, images, days=30, seed=0):
+        self.users = users
+        self.images = images
+        self.days = days
+        self.rng = random.Random(seed)
+        self.now = datetime.utcnow()
+        # Hashing millions of passwords would dominate the run
+        self.password_hash = generate_password_hash('password')
+
+    def partner(self, index):
+        """Partner of the 0-based user ``index``, or None if unpaired.
+
+        The first PAIRED_SHARE of users are paired with their neighbour.
+        """
+        paired = int(self.users * PAIRED_SHARE) // 2 * 2
+        if index >= paired:
+            return None
+        return index + 1 if index % 2 == 0 else index - 1
+
+    # app.py schema: integer ids, pairing via users.current_pair_id
+
+    def app_users(self):
+        rng = self.rng
+        for index in range(self.users):
+            partner = self.partner(index)
+            yield {
+                'id': index + 1,
+                'username': f'user{index + 1}',
+                'password_hash': self.password_hash,
+                'current_pair_id': partner + 1 if partner is not None else None,
+                'current_pair_code': (
+                    pairing_code(rng)
+                    if partner is None and rng.random() < CODE_SHARE else None),
+                'created_at': random_time(rng, self.now, self.days),
+                'token_version': 0
+            }
+
+    def app_images(self):
+        rng = self.rng
+        paired = int(self.users * PAIRED_SHARE) // 2 * 2
+        if not paired:
+            return
+        for index in range(self.images):
+            sender = rng.randrange(paired)
+            recent = rng.random() < 0.01
+            sent_at = (self.now - timedelta(seconds=rng.random() * 30)
+                       if recent else random_time(rng, self.now, self.days))
+            viewed = not recent or rng.random() < 0.5
+            yield {
+                'id': index + 1,
+                'filename': f'seed_{index + 1}.jpg',
+                'sender_id': sender + 1,
+                'recipient_id': self.partner(sender) + 1,
+                'sent_at': sent_at,
+                'viewed_at': (sent_at + timedelta(seconds=rng.random() * 20)
+                              if viewed else None),
+                'expires_at': sent_at + timedelta(seconds=30),
+                'content_hash': None
+            }
+
+    # models/ schema: uuid ids, a pair row per pairing, image status column
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def models_rows(self):
+        """Row generators for (users, pairs, images), in insert order"""
+        rng = self.rng
+        user_ids = [self.uuid() for _ in range(self.users)]
+        active_pairs = {}
+        for index in range(0, int(self.users * PAIRED_SHARE) // 2 * 2, 2):
+            active_pairs[index] = self.uuid()
+
+        def users():
+            for index, user_id in enumerate(user_ids):
+                partner = self.partner(index)
+                pair_id = active_pairs.get(min(index, partner)) if (
+                    partner is not None) else None
+                code = partner is None and rng.random() < CODE_SHARE
+                yield {
+                    'id': user_id,
+                    'username': f'user{index + 1}',
+                    'email': f'user{index + 1}@example.com',
+                    'password_hash': self.password_hash,
+                    'created_at': random_time(rng, self.now, self.days),
+                    'is_verified': True,
+                    'current_pair_id': pair_id,
+                    'pairing_code': pairing_code(rng) if code else None,
+                    'pairing_code_expiry': (
+                        self.now + timedelta(minutes=rng.random() * 10)
+                        if code else None)
+                }
+
+        # Past pairings outnumber live ones
+        pairs = [(pair_id, index, 'active')
+                 for index, pair_id in active_pairs.items()]
+        for _ in range(len(active_pairs) * 2 if self.users > 1 else 0):
+            pairs.append((self.uuid(), rng.randrange(self.users - 1),
+                          'inactive'))
+
+        def pair_rows():
+            for pair_id, index, status in pairs:
+                created_at = random_time(rng, self.now, self.days)
+                yield {
+                    'id': pair_id,
+                    'user1_id': user_ids[index],
+                    'user2_id': user_ids[index + 1],
+                    'status': status,
+                    'created_at': created_at,
+                    'last_activity': created_at + (self.now - created_at) * rng.random()
+                }
+
+        def images():
+            if not pairs:
+                return
+            for _ in range(self.images):
+                pair_id, index, _status = pairs[rng.randrange(len(pairs))]
+                sender, receiver = index, index + 1
+                if rng.random() < 0.5:
+                    sender, receiver = receiver, sender
+                sent_at = random_time(rng, self.now, self.days)
+                status = rng.choices(('sent', 'viewed', 'expired'),
+                                     (0.02, 0.08, 0.9))[0]
+                viewed_at = (sent_at + timedelta(seconds=rng.random() * 3600)
+                             if status != 'sent' else None)
+                image_id = self.uuid()
+                yield {
+                    'id': image_id,
+                    'pair_id': pair_id,
+                    'sender_id': user_ids[sender],
+                    'receiver_id': user_ids[receiver],
+                    'filename': f'{image_id}.jpg',
+                    'file_path': f'uploads/{image_id}.jpg',
+                    'status': status,
+                    'sent_at': sent_at,
+                    'viewed_at': viewed_at,
+                    'expires_at': (viewed_at + timedelta(seconds=30)
+                                   if viewed_at else None)
+                }
+
+        return users(), pair_rows(), images()
+
+
+def app_tables():
+    import app as flashpair
+    return flashpair.db.metadata, [flashpair.User.__table__,
+                                   flashpair.Image.__table__]
+
+
+def models_tables():
+    from database import db
+    from models import Image, Pair, User
+    return db.metadata, [User.__table__, Pair.__table__, Image.__table__]
+
+
+def analyze(conn):
+    """Refresh planner statistics after a bulk load"""
+    conn.execute(text('ANALYZE'))
+
+
+def seed(engine, schema, users, images, days=30, seed_value=0):
+    """Create the schema's tables if needed and fill them; returns counts"""
+    seeder = Seeder(users, images, days=days, seed=seed_value)
+    counts = {}
+    if schema == 'app':
+        metadata, (user_table, image_table) = app_tables()
+        metadata.create_all(engine)
+        with engine.begin() as conn:
+            counts['users'] = insert_batches(conn, user_table,
+                                             seeder.app_users())
+            counts['images'] = insert_batches(conn, image_table,
+                                              seeder.app_images())
+            if engine.dialect.name == 'postgresql':
+                # Explicit ids leave the serial sequences behind
+                for table in (user_table, image_table):
+                    conn.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{table.name}', "
+                        f"'id'), coalesce(max(id), 1)) FROM {table.name}"))
+    else:
+        metadata, (user_table, pair_table, image_table) = models_tables()
+        metadata.create_all(engine)
+        user_rows, pair_rows, image_rows = seeder.models_rows()
+        with engine.begin() as conn:
+            counts['users'] = insert_batches(conn, user_table, user_rows)
+            counts['pairs'] = insert_batches(conn, pair_table, pair_rows)
+            counts['images'] = insert_batches(conn, image_table, image_rows)
+
+    with engine.begin() as conn:
+        analyze(conn)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--schema', choices=('app', 'models'), default='app')
+    parser.add_argument('--database-url',
+                        help='defaults to $DATABASE_URL, else the local SQLite file')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--images', type=int, default=500000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    url = database_url(args.database_url)
+    # app.py reads its database from the environment when imported
+    os.environ['DATABASE_URL'] = url
+    engine = create_engine(url)
+    started = datetime.utcnow()
+    counts = seed(engine, args.schema, args.users, args.images,
+                  days=args.days, seed_value=args.seed)
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    print(f"Seeded {args.schema} schema in {elapsed:.1f}s: " +
+          ', '.join(f'{count} {name}' for name, count in counts.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
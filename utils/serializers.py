@@ -0,0 +1,49 @@
+from sqlalchemy import DateTime, select
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+class RowSerializer:
+    """``row -> dict`` compiled once for a fixed set of columns.
+
+    Built from ``key=Model.column`` pairs; the generated function is a single
+    dict display, so serializing a Core row costs no per-field lookups and
+    no ORM instance. DateTime columns are written as ISO 8601 strings.
+    """
+
+    def __init__(self, **fields):
+        self.keys = tuple(fields)
+        self.columns = tuple(fields.values())
+        self._from_row = self._compile(lambda i, column: f'row[{i}]')
+        self._from_object = self._compile(
+            lambda i, column: f'obj.{column.key}', argument='obj')
+
+    def select(self):
+        """SELECT of exactly these columns, in serializer order"""
+        return select(*self.columns)
+
+    def __call__(self, row):
+        return self._from_row(row)
+
+    def many(self, rows):
+        from_row = self._from_row
+        return [from_row(row) for row in rows]
+
+    def from_object(self, obj):
+        """Same dict from a loaded ORM instance"""
+        return self._from_object(obj)
+
+    def _compile(self, accessor, argument='row'):
+        items = []
+        for i, (key, column) in enumerate(zip(self.keys, self.columns)):
+            value = accessor(i, column)
+            if isinstance(column.type, DateTime):
+                value = f'_iso({value})'
+            items.append(f'{key!r}: {value}')
+
+        source = f"def serialize({argument}):\n    return {{{', '.join(items)}}}\n"
+        namespace = {'_iso': _iso}
+        exec(source, namespace)
+        return namespace['serialize']
@@ -0,0 +1,107 @@
+import threading
+import time
+from functools import wraps
+
+from flask_jwt_extended import get_jwt_identity
+
+from utils.replicas import recent_writes
+
+SWEEP_SIZE = 1024
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'expires')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires = 0.0
+
+
+class SingleFlight:
+    """Collapse identical concurrent calls into one, per process.
+
+    The first caller of a key runs the function; callers arriving while it
+    runs wait for and share its result, as do callers within ``ttl``
+    seconds after it finished. Results that ``cacheable(result)`` rejects
+    are shared with the waiters only. A waiter gives up on a leader still
+    running after ``timeout`` seconds and runs the function itself.
+    """
+
+    def __init__(self, ttl=0.25, timeout=5.0):
+        self.ttl = ttl
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Take ``ttl`` and ``timeout`` from the app's SINGLE_FLIGHT_*"""
+        self.ttl = app.config.get('SINGLE_FLIGHT_TTL', self.ttl)
+        self.timeout = app.config.get('SINGLE_FLIGHT_TIMEOUT', self.timeout)
+
+    def do(self, key, fn, cacheable=None):
+        now = time.monotonic()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None or (call.done.is_set() and call.expires <= now)
+            if leader:
+                if len(self._calls) >= SWEEP_SIZE:
+                    self._sweep(now)
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                # The leader is stuck; don't hold this request behind it
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            if cacheable is None or cacheable(call.result):
+                call.expires = time.monotonic() + self.ttl
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.done.set()
+
+    def view(self, operation):
+        """Coalesce a JWT-protected view per (user, operation, URL args).
+
+        The view must return a payload dict or ``(payload, status)``, so
+        each caller gets its own response. Users who wrote within the
+        replica staleness window bypass it and read their own writes.
+        Apply below ``@jwt_required()``.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                user_id = str(get_jwt_identity())
+                if recent_writes.is_recent(user_id):
+                    return view(*args, **kwargs)
+                key = (user_id, operation, tuple(sorted(kwargs.items())))
+                return self.do(key, lambda: view(*args, **kwargs),
+                               cacheable=successful)
+
+            return wrapper
+
+        return decorator
+
+    def _sweep(self, now):
+        for key in [key for key, call in self._calls.items()
+                    if call.done.is_set() and call.expires <= now]:
+            del self._calls[key]
+
+
+def successful(result):
+    """Cache view results, but not server errors"""
+    status = result[1] if isinstance(result, tuple) else 200
+    return status < 500
+
+
+# Shared by the blueprint routes, configured when they are registered
+flights = SingleFlight()
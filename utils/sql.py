@@ -0,0 +1,101 @@
+from sqlalchemy import literal_column, select, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable, FunctionElement
+from sqlalchemy.types import DateTime
+
+
+class utcnow(FunctionElement):
+    """Database clock as a naive UTC timestamp, shifted by ``seconds``.
+
+    Matches the ``datetime.utcnow()`` values the models store, so expiry
+    windows can be computed and compared inside a single statement.
+    """
+    type = DateTime()
+    name = 'utcnow'
+    inherit_cache = True
+
+    def __init__(self, seconds=0):
+        super().__init__(literal_column(str(int(seconds))))
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    seconds = compiler.process(element.clauses, **kw)
+    return f"(timezone('utc', now()) + {seconds} * interval '1 second')"
+
+
+@compiles(utcnow, 'sqlite')
+def _utcnow_sqlite(element, compiler, **kw):
+    seconds = compiler.process(element.clauses, **kw)
+    return f"strftime('%Y-%m-%d %H:%M:%f', 'now', '{seconds} seconds')"
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    seconds = compiler.process(element.clauses, **kw)
+    if seconds != '0':
+        raise NotImplementedError(
+            f"utcnow() offsets are not supported on {compiler.dialect.name}")
+    return 'CURRENT_TIMESTAMP'
+
+
+def execute_autocommit(engine, statement):
+    """Run one statement in its own implicit transaction and return its rows.
+
+    Saves the separate COMMIT round trip for single-statement writes.
+    """
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        result = conn.execute(statement)
+        return result.all() if result.returns_rows else []
+
+
+def lock_rows(session, column, values):
+    """Lock the rows whose ``column`` is in ``values`` until the transaction ends.
+
+    PostgreSQL takes row locks with ``SELECT ... FOR UPDATE``, in key order
+    so that two lockers cannot deadlock. SQLite has no row locks; a no-op
+    UPDATE takes its database write lock instead.
+    """
+    values = sorted(set(values))
+    if session.get_bind().dialect.name == 'sqlite':
+        session.execute(update(column.table).where(column.in_(values))
+                        .values({column.name: column}))
+    else:
+        session.execute(select(column).where(column.in_(values))
+                        .order_by(column).with_for_update())
+
+
+class explain(Executable, ClauseElement):
+    """The planner's plan for ``statement`` instead of its rows.
+
+    PostgreSQL returns one JSON document (``EXPLAIN (FORMAT JSON)``),
+    SQLite the rows of ``EXPLAIN QUERY PLAN``.
+    """
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+def _explained(element, compiler, **kw):
+    sql = compiler.process(element.statement, **kw)
+    # The rows are the plan, not the statement's columns
+    compiler._result_columns = []
+    return sql
+
+
+@compiles(explain, 'postgresql')
+def _explain_postgresql(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + _explained(element, compiler, **kw)
+
+
+@compiles(explain, 'sqlite')
+def _explain_sqlite(element, compiler, **kw):
+    return 'EXPLAIN QUERY PLAN ' + _explained(element, compiler, **kw)
+
+
+@compiles(explain)
+def _explain_default(element, compiler, **kw):
+    raise NotImplementedError(
+        f"explain() is not supported on {compiler.dialect.name}")
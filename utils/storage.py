@@ -0,0 +1,218 @@
+import math
+import os
+import random
+import shutil
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from utils.ratelimit import token_identity
+
+
+class StorageAccountant:
+    """Admission control for uploads based on the bytes they will add.
+
+    Runs before the view, so over-quota uploads are refused before their
+    body is read. Bytes at rest come from ``stored_bytes()`` and the disk,
+    refreshed every ``refresh_interval`` seconds on a background thread.
+    Bytes in flight are the declared sizes of uploads this process is still
+    receiving: the request's Content-Length, or ``declared_size()`` when
+    that is larger (the full length of a resumable upload, read the same
+    way its view reads it). An upload is refused with:
+
+    - 507 when it cannot fit in ``quota_bytes`` (or the disk, keeping
+      ``reserve_bytes`` free)
+    - 429 when it would take its sender past ``user_quota_bytes``
+      (``user_bytes(user_id)`` plus their in-flight uploads); the figure
+      is cached per process for ``refresh_interval`` seconds
+    - 429, with a probability rising from 0 at ``high_watermark`` to 1 at
+      capacity, so load tapers off instead of failing all at once
+
+    Above the watermark ``on_pressure()`` is called, at most once per
+    refresh, to start eviction.
+    """
+
+    def __init__(self, app, upload_folder, stored_bytes, user_bytes,
+                 endpoints, on_pressure=None, declared_size=None):
+        self.upload_folder = upload_folder
+        self.stored_bytes = stored_bytes
+        self.user_bytes = user_bytes
+        self.endpoints = set(endpoints)
+        self.on_pressure = on_pressure
+        self.declared_size = declared_size
+
+        self.quota_bytes = app.config.get('STORAGE_QUOTA_MB', 0) * 1024 * 1024
+        self.user_quota_bytes = app.config.get(
+            'USER_STORAGE_QUOTA_MB', 0) * 1024 * 1024
+        self.reserve_bytes = app.config.get(
+            'HEALTH_MIN_FREE_MB', 100) * 1024 * 1024
+        self.high_watermark = app.config.get('STORAGE_HIGH_WATERMARK', 0.85)
+        self.refresh_interval = app.config.get('STORAGE_REFRESH_INTERVAL', 5)
+        self.default_size = app.config.get('MAX_CONTENT_LENGTH') or 0
+
+        self.app = app
+        self._at_rest = 0
+        self._disk_free = None
+        self._in_flight = 0
+        self._in_flight_users = {}
+        self._user_at_rest = {}
+        self._pressure_signalled = False
+        self._pid = None
+        self._lock = threading.Lock()
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def start(self):
+        """Start refreshing in this process; cheap to call on every request"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._in_flight = 0
+                    self._in_flight_users = {}
+                    thread = threading.Thread(
+                        target=self._run, name='storage-accounting',
+                        daemon=True)
+                    thread.start()
+                    self._pid = os.getpid()
+
+    def refresh(self):
+        with self.app.app_context():
+            at_rest = int(self.stored_bytes() or 0)
+        disk_free = shutil.disk_usage(self.upload_folder).free
+        cutoff = time.monotonic() - self.refresh_interval
+        with self._lock:
+            self._at_rest = at_rest
+            self._disk_free = disk_free
+            self._pressure_signalled = False
+            self._user_at_rest = {
+                user_id: cached for user_id, cached
+                in self._user_at_rest.items() if cached[1] >= cutoff}
+
+    def user_stored(self, user_id):
+        """Bytes ``user_id`` has at rest, queried at most once a refresh"""
+        now = time.monotonic()
+        cached = self._user_at_rest.get(user_id)
+        if cached is not None and now - cached[1] < self.refresh_interval:
+            return cached[0]
+        stored = int(self.user_bytes(user_id) or 0)
+        with self._lock:
+            self._user_at_rest[user_id] = (stored, now)
+        return stored
+
+    def snapshot(self):
+        capacity = self.capacity()
+        used = self._at_rest + self._in_flight
+        return {
+            'storedBytes': self._at_rest,
+            'inFlightBytes': self._in_flight,
+            'capacityBytes': capacity,
+            'usedRatio': round(used / capacity, 3) if capacity else None,
+            'diskFreeBytes': self._disk_free
+        }
+
+    def capacity(self):
+        """Bytes uploads may occupy, from the quota and the free disk"""
+        limits = []
+        if self.quota_bytes:
+            limits.append(self.quota_bytes)
+        if self._disk_free is not None:
+            # Everything stored so far plus what the disk still has room for
+            limits.append(self._at_rest +
+                          max(0, self._disk_free - self.reserve_bytes))
+        return min(limits) if limits else None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Storage accounting error: {e}")
+            time.sleep(self.refresh_interval)
+
+    def _before_request(self):
+        if request.endpoint not in self.endpoints:
+            return None
+
+        incoming = request.content_length
+        if incoming is None:
+            incoming = self.default_size
+        if self.declared_size is not None:
+            try:
+                # Resumable uploads declare their full size up front
+                incoming = max(incoming, self.declared_size())
+            except ValueError:
+                pass
+        capacity = self.capacity()
+
+        with self._lock:
+            used = self._at_rest + self._in_flight
+            full = capacity is not None and used + incoming > capacity
+            ratio = used / capacity if capacity else 0
+            pressure = full or ratio >= self.high_watermark
+            signal = pressure and not self._pressure_signalled
+            if pressure:
+                self._pressure_signalled = True
+
+        if signal and self.on_pressure is not None:
+            try:
+                self.on_pressure()
+            except Exception as e:
+                print(f"Storage pressure handler error: {e}")
+        if full:
+            return self._reject(507, 'Insufficient storage, retry later', 30)
+        if pressure and random.random() >= (
+                (1 - ratio) / (1 - self.high_watermark)):
+            return self._reject(429, 'Storage busy, retry shortly', 5)
+
+        user_id = token_identity()
+        if user_id is not None and self.user_quota_bytes:
+            user_used = self.user_stored(user_id)
+            if (user_used + self._in_flight_users.get(user_id, 0) + incoming
+                    > self.user_quota_bytes):
+                # Queued images expire within 30 seconds and free their bytes
+                return self._reject(429, 'Storage quota exceeded', 30)
+
+        with self._lock:
+            self._in_flight += incoming
+            if user_id is not None:
+                self._in_flight_users[user_id] = (
+                    self._in_flight_users.get(user_id, 0) + incoming)
+        g.storage_reservation = (user_id, incoming)
+        return None
+
+    def _after_request(self, response):
+        if 'storage_reservation' in g and response.status_code < 300:
+            g.storage_stored = True
+        return response
+
+    def _teardown_request(self, _exc):
+        reservation = g.pop('storage_reservation', None)
+        if reservation is None:
+            return
+
+        user_id, incoming = reservation
+        with self._lock:
+            self._in_flight -= incoming
+            if g.pop('storage_stored', False):
+                # Count it as stored until the next refresh measures it
+                self._at_rest += incoming
+                cached = self._user_at_rest.get(user_id)
+                if cached is not None:
+                    self._user_at_rest[user_id] = (
+                        cached[0] + incoming, cached[1])
+            if user_id is not None:
+                remaining = self._in_flight_users.get(user_id, 0) - incoming
+                if remaining > 0:
+                    self._in_flight_users[user_id] = remaining
+                else:
+                    self._in_flight_users.pop(user_id, None)
+
+    @staticmethod
+    def _reject(status, message, retry_after):
+        response = jsonify({'error': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
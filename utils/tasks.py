@@ -0,0 +1,181 @@
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+
+class TaskQueue:
+    """Durable background tasks stored as rows of ``model``.
+
+    ``enqueue()`` stages a row in the caller's session, so the work commits
+    atomically with the change that caused it and survives a crash right
+    after. Worker threads in every process claim due rows with a
+    conditional UPDATE, run the registered handler and delete the row.
+    Failures are retried with exponential backoff up to ``max_attempts``;
+    a row whose worker died is claimable again once its lease runs out.
+    Handlers may therefore run more than once and must be idempotent.
+
+    ``model`` needs ``id``, ``name``, ``payload``, ``dedupe_key`` (unique),
+    ``status``, ``attempts``, ``run_at``, ``locked_until`` and
+    ``last_error`` columns.
+    """
+
+    def __init__(self, app, db, model, workers=1, poll_interval=1.0,
+                 max_attempts=5, lease_seconds=60, backoff_seconds=2):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self._handlers = {}
+        self._periodic = {}
+        self._next_due = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def handler(self, name):
+        """Register ``fn(payload)`` as the handler for tasks called ``name``"""
+        def register(fn):
+            self._handlers[name] = fn
+            return fn
+
+        return register
+
+    def periodic(self, name, seconds):
+        """Enqueue ``name`` every ``seconds``; at most one is ever queued"""
+        self._periodic[name] = seconds
+
+    def enqueue(self, name, payload=None, delay=0):
+        """Stage a task in the current session; it runs once committed"""
+        if name not in self._handlers:
+            raise ValueError(f"No handler for task {name!r}")
+
+        self.db.session.add(self.model(
+            name=name,
+            payload=json.dumps(payload or {}),
+            status='pending',
+            attempts=0,
+            run_at=datetime.utcnow() + timedelta(seconds=delay)))
+
+    def enqueue_unique(self, name, payload=None, key=None):
+        """Queue ``name`` in its own transaction unless an instance keyed
+        ``key`` (default: the name) is still queued; returns True if added"""
+        session = self.db.session
+        session.add(self.model(
+            name=name, payload=json.dumps(payload or {}),
+            dedupe_key=key or name, status='pending', attempts=0,
+            run_at=datetime.utcnow()))
+        try:
+            session.commit()
+            return True
+        except IntegrityError:
+            session.rollback()
+            return False
+
+    def start(self):
+        """Start the workers in this process; cheap to call on every request"""
+        if not self.workers:
+            return
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    for i in range(self.workers):
+                        thread = threading.Thread(
+                            target=self._run_forever, name=f'task-worker-{i}',
+                            daemon=True)
+                        thread.start()
+                    self._pid = os.getpid()
+
+    def run_pending(self, limit=100):
+        """Run due tasks in the calling thread; returns how many ran"""
+        ran = 0
+        with self.app.app_context():
+            self._schedule_periodic()
+            while ran < limit:
+                task = self._claim()
+                if task is None:
+                    break
+                self._execute(task)
+                ran += 1
+        return ran
+
+    def _run_forever(self):
+        while True:
+            try:
+                if not self.run_pending():
+                    time.sleep(self.poll_interval)
+            except Exception as e:
+                print(f"Task worker error: {e}")
+                time.sleep(self.poll_interval)
+
+    def _due(self, now):
+        Task = self.model
+        return or_(
+            and_(Task.status == 'pending', Task.run_at <= now),
+            # Lease expired: the worker that claimed it is gone
+            and_(Task.status == 'running', Task.locked_until < now))
+
+    def _claim(self):
+        Task = self.model
+        session = self.db.session
+        now = datetime.utcnow()
+
+        candidate = select(Task.id).where(self._due(now)).order_by(
+            Task.run_at).limit(1).with_for_update(skip_locked=True)
+        try:
+            task = session.execute(
+                update(Task)
+                .where(Task.id == candidate.scalar_subquery(), self._due(now))
+                .values(status='running',
+                        attempts=Task.attempts + 1,
+                        locked_until=now + timedelta(seconds=self.lease_seconds))
+                .returning(Task.id, Task.name, Task.payload, Task.attempts)
+                .execution_options(synchronize_session=False)
+            ).first()
+            session.commit()
+            return task
+        except Exception:
+            session.rollback()
+            raise
+
+    def _execute(self, task):
+        Task = self.model
+        session = self.db.session
+        try:
+            handler = self._handlers[task.name]
+            handler(json.loads(task.payload or '{}'))
+            session.execute(delete(Task).where(Task.id == task.id)
+                            .execution_options(synchronize_session=False))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"Task {task.name} #{task.id} failed "
+                  f"(attempt {task.attempts}): {e}")
+            if task.attempts >= self.max_attempts:
+                # Keep the row for inspection, freeing its periodic slot
+                values = {'status': 'failed', 'dedupe_key': None}
+            else:
+                delay = min(300, self.backoff_seconds * 2 ** (task.attempts - 1))
+                values = {'status': 'pending',
+                          'run_at': datetime.utcnow() + timedelta(
+                              seconds=delay * random.uniform(0.5, 1.0))}
+            session.execute(update(Task).where(Task.id == task.id)
+                            .values(last_error=str(e)[:1000], **values)
+                            .execution_options(synchronize_session=False))
+            session.commit()
+
+    def _schedule_periodic(self):
+        now = time.monotonic()
+        for name, seconds in self._periodic.items():
+            if self._next_due.get(name, 0) > now:
+                continue
+            self._next_due[name] = now + seconds
+            self.enqueue_unique(name, key=f'periodic:{name}')
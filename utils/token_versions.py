@@ -0,0 +1,42 @@
+import threading
+import time
+
+SWEEP_SIZE = 1024
+
+
+class TokenVersionCache:
+    """In-memory cache of per-user token versions.
+
+    Tokens carrying a ``tv`` claim are only trusted while it matches the
+    user's current version. Entries expire after ``ttl`` seconds so that a
+    bump made by another worker is picked up within that window. Expired
+    entries are swept whenever the cache doubles in size, so it holds about
+    the users seen within ``ttl``.
+    """
+
+    def __init__(self, loader, ttl=5):
+        self._loader = loader
+        self._ttl = ttl
+        self._entries = {}
+        self._sweep_at = SWEEP_SIZE
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry and entry[1] > now:
+            return entry[0]
+
+        version = self._loader(user_id)
+        with self._lock:
+            self._entries[user_id] = (version, now + self._ttl)
+            if len(self._entries) >= self._sweep_at:
+                self._entries = {key: entry for key, entry
+                                 in self._entries.items() if entry[1] > now}
+                self._sweep_at = max(SWEEP_SIZE, 2 * len(self._entries))
+        return version
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)